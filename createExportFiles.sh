@@ -3,11 +3,16 @@
 # This script will run ftArchPostProc with the -t, -a, or -n option given as
 # the first command line argument. It will create exportable csv data files
 # from raw sql database csv data files.
+#
+# The files are processed in parallel by ftppBatch.py, which uses one worker
+# process per core by default. Any further command line arguments are passed on
+# to ftppBatch.py (e.g. -j 4 to use 4 worker processes). Use -- to pass options
+# on to ftArchPostProc (e.g. -- -rs 1S).
 
 # Functions
 usage()
 {
-    echo "usage: createExportFiles.sh -t | -a | -n"
+    echo "usage: createExportFiles.sh -t | -a | -n [ftppBatch options] [-- ftArchPostProc options]"
 }
 
 # Make sure the first (and only used) argument is an expected one (-t or -a or -n)
@@ -66,42 +71,18 @@ SRC_NAMES[24]="171208_00_06_Mockup"
 SRC_NAMES[25]="171208_06_12_Mockup"
 SRC_NAMES[26]="171208_12_18_Mockup"
 SRC_NAMES[27]="171208_18_24_Mockup"
-SRl_NAMES[28]="171212_00_06_Mockup"
+SRC_NAMES[28]="171212_00_06_Mockup"
 SRC_NAMES[29]="171212_06_12_Mockup"
 SRC_NAMES[30]="171212_12_18_Mockup"
 SRC_NAMES[31]="171212_18_24_Mockup"
 
-# loop thru the array of file names
-# [@] denotes an indexed array
-# Make sure the source file exists, if not print a message and move on
-for FILE in "${SRC_NAMES[@]}"
-do
-    # add the extension 
-    SRC_FILE=$FILE".csv" 
-    # it exists or skip it
-    if [ ! -f $SRC_FILE ]; then
-        # The source file does not exist
-        echo $SRC_FILE" does not exist. Skipping it."
-    else
-        # destination file with the exension
-        DEST_FILE=$FILE"_ForExport.csv"
+# add the .csv extension to each file name
+SRC_FILES=("${SRC_NAMES[@]/%/.csv}")
 
-        # Create the command based on the command line argument
-        # The invalid cases were caught above, so no check needed here
-        case $1 in
-            -t )                FTPP_CMD="ftpp -t $SRC_FILE $DEST_FILE"
-                                ;;
-            -a )                FTPP_CMD="ftpp -a $SRC_FILE $DEST_FILE"
-                                ;;
-            -n )                FTPP_CMD="ftpp -n $SRC_FILE $DEST_FILE"
-                                ;;
-        esac
-        # echo it for informational purposes
-        echo $FTPP_CMD
-        # run the cmd
-        eval "$FTPP_CMD"
-    fi
-done
+# Process all the files with a pool of worker processes. ftppBatch.py skips
+# any source file which does not exist, names the destination files
+# <name>_ForExport.csv, and prints a summary at the end.
+python3 "$SCRIPT_DIR/ftppBatch.py" "${SRC_FILES[@]}" "$@"
 
 # deactivate the python environment
 deactivate
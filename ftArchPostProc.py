@@ -96,10 +96,27 @@
 #   Timestamp, Time Bias, Tag1 Value, Tag2 Value, Tag3 Value ...
 # where timestamp default format is yyyy-mm-dd hh:mm:ss.nnn (24 hr)
 #
-# -am1, -am2, -am3, -am4 or --archiveMerge (optional, default=None). Archive Merge.
+# -am1, -am2, -am3, -am4 or --archiveMergen (optional, default=None). Archive Merge.
 # Merge these named files with the data in the inputFileName before processing.
 # Must have the same format/layout as the input file.
 #
+# -am or --archiveMerge (optional, default=None). Archive Merge. Same as
+# -am1..-am4, but can be used any number of times, to merge any number of files.
+#
+# -amg or --archiveMergeGlob (optional, default=None). Archive Merge Glob.
+# Merge the files matching this pattern (e.g. "exports/*.csv"), in name order.
+# Can be used more than once. Quote the pattern so the shell does not expand it.
+#
+# -aml or --archiveMergeList (optional, default=None). Archive Merge List.
+# Merge the files named in this text file, one file name per line, in order.
+# Blank lines and lines starting with # are ignored, and relative names are
+# relative to the directory of the list file. Can be used more than once.
+#
+# Files to merge are merged in the order given: -am1..-am4, -am, -amg, then
+# -aml. A file is only merged once. The data is merged per tag. When a tag
+# has a value at the same timestamp in more than one file, the value from the
+# file merged last is kept.
+#
 # -se or --sourceEncoding (optional, default of "utf-8"). Source file encoding.
 #
 # -sd or --sourceDelimiter (optional, default of ","). Destination file field
@@ -168,20 +185,197 @@
 # next sample point are thrown away. For the other options, the intermediate
 # values are used to calculate the statistic.
 #
+# -cs or --chunkSize (optional, default=None). Only used with the -a option.
+# Read the input and merge files in chunks of this many rows. Only the typed
+# per tag data is kept between chunks, so memory use is bounded by the chunk
+# size plus the retained data instead of the size of the input file. If not
+# specified, the whole file is read at once.
+#
+# -ae or --alignEngine (optional, default='merge'). Choose how the instrument
+# data is aligned to the output timestamps. Choices are: merge (one merge_asof
+# per instrument) and vector (one preallocated array filled using
+# searchsorted). Both give the same output. The vector engine is faster and
+# uses less memory when there are many instruments.
+#
+# -gm or --gridMode (optional, default='dense'). Choose the output timestamps.
+# Choices are: dense (every sample period, see -rs, from the start to the end
+# time) and events (only the times at which at least one instrument has a
+# sample, rounded down to the sample period). The events output is the rows of
+# the dense output at those times, so its size follows the number of samples
+# rather than the time span. The events grid needs a fixed sample period (not
+# months, weeks ...).
+#
+# -gs or --gridSpacing (optional, default=None). With the events grid, keep the
+# output timestamps at least this far apart (e.g. "1T"), leaving out the ones in
+# between. Default is to keep them all.
+#
+# -cd or --cacheDir (optional, default=None). Cache the parsed source data
+# in this directory. The cache holds the typed, per tag data made from the input
+# and merge files, and is used again when the same files are processed with the
+# same file type (-t/-a/-n/-s), source delimiter, source encoding, and source
+# time format. The other options (-st, -et, -vq, -rs, -stats ...) can change
+# from run to run. A source file that changes in any way (size, modification
+# time, or content) is parsed again. Default is no cache.
+#
+# -cm or --cacheMaxMB (optional, default=1024). Size limit of the cache in
+# megabytes. The least recently used entries are removed to stay under the limit.
+#
+# -j or --jobs (optional, default=1). Number of worker processes used to make
+# and resample the instruments. The source data is passed to the workers, and the
+# resampled data passed back, through memory mapped (shared memory) files. The
+# output is the same for any number of jobs. Default is 1, which does the work
+# in this process. Needs a platform with fork (e.g. Linux).
+#
+# -fp or --floatPrecision (optional, default=None). Round the float values in
+# the output file to this many decimal places. This makes the output file
+# smaller. Default is to write the values with full precision.
+#
+# -pr or --precision (optional, default=float64). Precision of the values.
+# Choices are: float64 and float32. With float32, the float values are kept as
+# float32 from the parse through the resampling and alignment to the output
+# file, which takes half the memory. The mean and standard deviation stats are
+# still calculated in float64, and then made float32. Integer values are kept
+# as integers. The float32 values are written with the fewest digits which
+# read back as the same value, so at most 9 significant digits (e.g. 1/3 is
+# written as 0.33333334 rather than 0.3333333333333333), and source values
+# with more than about 7 significant digits are rounded (e.g. 123456.789 is
+# written as 123456.79). Default is float64.
+#
+# -wt or --writeThreads (optional, default=1). Number of threads used to format
+# the output file rows. The rows are formatted and written in large chunks, and
+# with more than one thread, the chunks are formatted in parallel. The output is
+# the same for any number of threads.
+#
+# -ow or --outputWindow (optional, default=None). Write the output file a time
+# window at a time, e.g. 1H for an hour of output timestamps at a time. Each
+# window is aligned and then written by a background thread while the next one
+# is aligned, so the output data of the whole time span is never in memory at
+# once. The last value of each instrument carries forward from one window to
+# the next, and the output file is the same as without the option. Windows
+# start on a multiple of the period (e.g. at midnight for 1D). Only for the csv
+# output format, and not in incremental mode (-inc). Default is to write the
+# whole output at once.
+#
+# -of or --outputFormat (optional, default='csv'). Output file format. Choices
+# are: csv, parquet, feather (Arrow IPC), and hdf5. The binary formats store the
+# timestamp as a datetime and the values with their types, so the output can be
+# read without parsing text. The -dd, -de, -dtf, and -wt options only apply to
+# csv. In the binary formats, the export control message is kept as file level
+# metadata (key "export_control") instead of a text header. Parquet and feather
+# need the pyarrow package, and hdf5 needs the tables (PyTables) package.
+#
+# -oc or --outputCompression (optional, default=None). Compression used for the
+# binary output formats. For example snappy, gzip or zstd for parquet, lz4 or
+# zstd for feather, and zlib, blosc or bzip2 for hdf5. Default is no compression.
+#
+# -inc or --incremental (optional, default=False). Incremental (append) mode.
+# Append only the new data to an existing output file, rather than writing the
+# whole output file again. A state file (the output file name plus ".ftppstate")
+# is kept next to the output file, with the last timestamp written (the
+# watermark), the sample period and stats, the output columns, and the last value
+# and latest source time of each instrument. The source rows at or after the
+# watermark are kept in a second file (the state file name plus ".npz"). Only
+# the source rows of each instrument after its latest source time are processed,
+# and only the rows after the watermark are appended. The last value of each
+# instrument is carried forward, so the appended rows are the same as a full run
+# would give. The sample period and stats of the output file are used, and tags
+# which are not in the output file yet are left out (with a warning). If there is
+# no output file or state file, the output file has changed since the state was
+# saved, or an instrument has new source rows before the watermark, the whole
+# output file is written and a new state saved. Only for the csv output format.
+#
+# -si or --sortedInput (optional, default=False). The input and merge files are
+# in time order (ascending or descending). Rows outside the start and end time
+# (-st/-et) are always dropped as the files are read. With this option, the -t
+# and -n files are read in blocks of rows, and a block is checked using just its
+# first and last timestamps, so a block outside the start and end time is
+# skipped without converting its timestamps, and reading stops once the file is
+# past the start and end time. A merge file whose first and last rows are both
+# outside the start and end time is not read, apart from its header. The -a
+# files are grouped by tag, so this does not apply to them. Do not use this if
+# the files are not in time order, as rows in the time range could be missed.
+# Not used when the parsed data is cached (-cd).
+#
+# -ix or --index (optional, default=False). Use a block index of each input and
+# merge file to read just the parts of the file which are needed. The index is
+# kept next to the file (the file name plus ".ftppidx"), and holds the position
+# of each block of rows in the file, with the first and last timestamp in the
+# block, and for archive data (-a), the TagIds in it. Only the blocks with rows
+# in the start and end time (-st/-et), and for archive data, rows for the tags
+# given with -tg, are read. The index is made the first time the file is used
+# (which reads all of it), and made again whenever the file changes. Only for
+# -t, -a and -n files, and not for the utf_16 or utf_32 encodings. Not used when
+# the parsed data is cached (-cd).
+#
+# -tg or --tags (optional, default=None). Only process these tags. Give the tag
+# names (or the instrument names made from them, with spaces, hyphens and periods
+# changed to underscores) separated by commas. Can be used more than once.
+# Default is all the tags.
+#
+# -mm or --memoryMap (optional, default=False). Only used with the -a option.
+# Map the input and merge files into memory and scan their bytes, instead of
+# reading them with read_csv. The row and field boundaries are found in the raw
+# bytes, and only the fields needed are converted: the TagId of each row, the
+# TagName of the first row of each tag, the Timestamp of the rows of the tags
+# given with -tg, and the Value of the rows in the start and end time (-st/-et).
+# Only the typed per tag data is kept, as with -cs, which is not used. Values
+# are converted exactly, the same as when the whole file is read at once. Needs
+# a single character delimiter, and an encoding such as utf_8 or latin_1 (not
+# utf_16 or utf_32). Blocks of rows with quoted values are read with read_csv.
+#
+# -pf or --profile (optional, default=None). Write a profiling report (json) to
+# this file. It has the wall clock and CPU time, rows in and out, rows per
+# second, and peak memory (process RSS, and python allocations traced with
+# tracemalloc) of each stage of the run: reading the source files, converting
+# the timestamps, parsing the source data into tags, the cache, making the
+# instruments, resampling, aligning and writing. The time spent making and
+# resampling each instrument is included too. Stage times include the time of
+# the stages done inside them (e.g. merge files read while parsing). Tracing
+# the memory makes the run a little slower. The report is written at the end of
+# a run which completes.
+#
+# -cp or --cprofile (optional, default=None). Profile the run with cProfile, and
+# save the statistics to this file, to be looked at with pstats (python -m
+# pstats FILE) or a viewer such as snakeviz.
+#
 # -noExportMsg (optional, default=False). When this argument is used, it turns
 # off the inclusion of an export control message.  The defaults to false, so a
 # message is included unless this argument is specified.
 #
 # -v, --verbose (optional, defalt=False). Increse output Messaging.
+#
+# Using ftArchPostProc from python:
+# The processing can also be done by a python program, in its own process,
+# without starting the program (and loading the libraries) again for each file,
+# and without writing the output file:
+#
+#   import ftArchPostProc
+#   df_out = ftArchPostProc.process('a', 'archive.csv', resample='1S',
+#                                   archiveMerge=['archive2.csv'])
+#
+# process() returns the output data (a timestamp indexed data frame, with a
+# column for each instrument), and also writes it to the output file if one is
+# given. The options are keyword arguments named as the long options above
+# (the args.xxx names below). With a windowPeriod (e.g. '1H'), process() returns
+# an iterator of the output data a time window at a time instead. Errors raise
+# a ProcessError. PostProcessor does the work, one method per stage (read and
+# parse, make the instruments, align, write), for programs which need the
+# stages separately.
 
 # imports
 #
+# Only the light, standard libraries are imported here, so the help (-h) and
+# the argument checks are quick. The numerical libraries, and the modules of
+# this program which use them, are imported by _loadLibraries() when the files
+# are processed. The modules only needed by some options (the cache, the
+# worker processes, incremental mode ...) are imported where they are used.
+#
 # system related
+import os
+import re
 import sys
 # date and time stuff
 from datetime import datetime, time
-from pandas.tseries.frequencies import to_offset
-from dateutil import parser as duparser
 
 # csv file stuff
 import csv
@@ -189,18 +383,56 @@ import csv
 # arg parser
 import argparse
 
-# numerical manipulation libraries
-import numpy as np
-import pandas as pd
 
-# user libraries
-# Note: May need PYTHONPATH (set in ~/.profile?) to be set depending
-# on the location of the imported files
-# TimeStamped Indexed Data Class
-from bpsTsIdxData import TsIdxData
-# list duplication helper functions
-from bpsListDuplicates import listDuplicates
-from bpsListDuplicates import listToListIntersection
+# set when the libraries below have been imported
+_librariesLoaded = False
+
+
+def _loadLibraries():
+    """
+    Import the numerical libraries, and the modules which use them, as globals
+    of this module. Does nothing after the first time.
+    """
+    global _librariesLoaded, to_offset, Tick, np, pd, TsIdxData, \
+        ArchiveTagAccumulator, groupBoundaries, readHeader, AsofAligner, parseTimestamps, \
+        archiveSchema, trendSchema, normalizedSchema, readTyped, readHeaderTyped, \
+        readStrain, writeFrame, writeColumnar, TagMerger, collectMergeFiles, TimeWindow, \
+        PRECISIONS, asPrecision, resampleAs, InstrumentRegistry, duplicateNames, commonNames
+    if _librariesLoaded:
+        return
+    # date and time stuff
+    from pandas.tseries.frequencies import to_offset
+    from pandas.tseries.offsets import Tick
+
+    # numerical manipulation libraries
+    import numpy as np
+    import pandas as pd
+
+    # user libraries
+    # Note: May need PYTHONPATH (set in ~/.profile?) to be set depending
+    # on the location of the imported files
+    # TimeStamped Indexed Data Class
+    from bpsTsIdxData import TsIdxData
+    # instrument registry, and duplicate column name detection
+    from ftppRegistry import InstrumentRegistry, duplicateNames, commonNames
+    # archive (-a) chunked ingestion helpers
+    from ftppArchive import ArchiveTagAccumulator, groupBoundaries, readHeader
+    # vectorized alignment engine
+    from ftppAlign import AsofAligner
+    # memoized, fixed format timestamp parsing
+    from ftppTimeParse import parseTimestamps
+    # typed, per input format reading of the source files
+    from ftppSchema import archiveSchema, trendSchema, normalizedSchema, readTyped, \
+                           readHeaderTyped, readStrain
+    # fast output file writing
+    from ftppWriter import writeFrame, writeColumnar
+    # per tag k-way merge of the input and merge files
+    from ftppMerge import TagMerger, collectMergeFiles
+    # start/end time filtering as the source files are read
+    from ftppWindow import TimeWindow
+    # value precision
+    from ftppPrecision import PRECISIONS, asPrecision, resampleAs
+    _librariesLoaded = True
 
 
 # **** argument parsing
@@ -300,6 +532,23 @@ eplStr="""Final Test Archive Data Post Processing
  Merge these named files with the data in the inputFileName before processing.
  Must have the same format/layout as the input file.
 
+ -am or --archiveMerge (optional, default=None). Archive Merge. Same as
+ -am1..-am4, but can be used any number of times, to merge any number of files.
+
+ -amg or --archiveMergeGlob (optional, default=None). Archive Merge Glob.
+ Merge the files matching this pattern (e.g. "exports/*.csv"), in name order.
+ Can be used more than once. Quote the pattern so the shell does not expand it.
+
+ -aml or --archiveMergeList (optional, default=None). Archive Merge List.
+ Merge the files named in this text file, one file name per line, in order.
+ Blank lines and lines starting with # are ignored, and relative names are
+ relative to the directory of the list file. Can be used more than once.
+
+ Files to merge are merged in the order given: -am1..-am4, -am, -amg, then
+ -aml. A file is only merged once. The data is merged per tag. When a tag
+ has a value at the same timestamp in more than one file, the value from the
+ file merged last is kept.
+
  -se or --sourceEncoding (optional, default of "utf-8"). Source file encoding.
 
  -sd or --sourceDelimiter (optional, default of ","). Destination file field
@@ -369,6 +618,159 @@ eplStr="""Final Test Archive Data Post Processing
  next sample point are thrown away. For the other options, the intermediate
  values are used to calculate the statistic.
 
+ -cs or --chunkSize (optional, default=None). Only used with the -a option.
+ Read the input and merge files in chunks of this many rows. Only the typed
+ per tag data is kept between chunks, so memory use is bounded by the chunk
+ size plus the retained data instead of the size of the input file. If not
+ specified, the whole file is read at once.
+
+ -ae or --alignEngine (optional, default='merge'). Choose how the instrument
+ data is aligned to the output timestamps. Choices are: merge (one merge_asof
+ per instrument) and vector (one preallocated array filled using
+ searchsorted). Both give the same output. The vector engine is faster and
+ uses less memory when there are many instruments.
+
+ -gm or --gridMode (optional, default='dense'). Choose the output timestamps.
+ Choices are: dense (every sample period, see -rs, from the start to the end
+ time) and events (only the times at which at least one instrument has a
+ sample, rounded down to the sample period). The events output is the rows of
+ the dense output at those times, so its size follows the number of samples
+ rather than the time span. The events grid needs a fixed sample period (not
+ months, weeks ...).
+
+ -gs or --gridSpacing (optional, default=None). With the events grid, keep the
+ output timestamps at least this far apart (e.g. "1T"), leaving out the ones in
+ between. Default is to keep them all.
+
+ -cd or --cacheDir (optional, default=None). Cache the parsed source data
+ in this directory. The cache holds the typed, per tag data made from the input
+ and merge files, and is used again when the same files are processed with the
+ same file type (-t/-a/-n/-s), source delimiter, source encoding, and source
+ time format. The other options (-st, -et, -vq, -rs, -stats ...) can change
+ from run to run. A source file that changes in any way (size, modification
+ time, or content) is parsed again. Default is no cache.
+
+ -cm or --cacheMaxMB (optional, default=1024). Size limit of the cache in
+ megabytes. The least recently used entries are removed to stay under the limit.
+
+ -j or --jobs (optional, default=1). Number of worker processes used to make
+ and resample the instruments. The source data is passed to the workers, and the
+ resampled data passed back, through memory mapped (shared memory) files. The
+ output is the same for any number of jobs. Default is 1, which does the work
+ in this process. Needs a platform with fork (e.g. Linux).
+
+ -fp or --floatPrecision (optional, default=None). Round the float values in
+ the output file to this many decimal places. This makes the output file
+ smaller. Default is to write the values with full precision.
+
+ -pr or --precision (optional, default=float64). Precision of the values.
+ Choices are: float64 and float32. With float32, the float values are kept as
+ float32 from the parse through the resampling and alignment to the output
+ file, which takes half the memory. The mean and standard deviation stats are
+ still calculated in float64, and then made float32. Integer values are kept
+ as integers. The float32 values are written with the fewest digits which
+ read back as the same value, so at most 9 significant digits (e.g. 1/3 is
+ written as 0.33333334 rather than 0.3333333333333333), and source values
+ with more than about 7 significant digits are rounded (e.g. 123456.789 is
+ written as 123456.79). Default is float64.
+
+ -wt or --writeThreads (optional, default=1). Number of threads used to format
+ the output file rows. The rows are formatted and written in large chunks, and
+ with more than one thread, the chunks are formatted in parallel. The output is
+ the same for any number of threads.
+
+ -ow or --outputWindow (optional, default=None). Write the output file a time
+ window at a time, e.g. 1H for an hour of output timestamps at a time. Each
+ window is aligned and then written by a background thread while the next one
+ is aligned, so the output data of the whole time span is never in memory at
+ once. The last value of each instrument carries forward from one window to
+ the next, and the output file is the same as without the option. Windows
+ start on a multiple of the period (e.g. at midnight for 1D). Only for the csv
+ output format, and not in incremental mode (-inc). Default is to write the
+ whole output at once.
+
+ -of or --outputFormat (optional, default='csv'). Output file format. Choices
+ are: csv, parquet, feather (Arrow IPC), and hdf5. The binary formats store the
+ timestamp as a datetime and the values with their types, so the output can be
+ read without parsing text. The -dd, -de, -dtf, and -wt options only apply to
+ csv. In the binary formats, the export control message is kept as file level
+ metadata (key "export_control") instead of a text header. Parquet and feather
+ need the pyarrow package, and hdf5 needs the tables (PyTables) package.
+
+ -oc or --outputCompression (optional, default=None). Compression used for the
+ binary output formats. For example snappy, gzip or zstd for parquet, lz4 or
+ zstd for feather, and zlib, blosc or bzip2 for hdf5. Default is no compression.
+
+ -inc or --incremental (optional, default=False). Incremental (append) mode.
+ Append only the new data to an existing output file, rather than writing the
+ whole output file again. A state file (the output file name plus ".ftppstate")
+ is kept next to the output file, with the last timestamp written (the
+ watermark), the sample period and stats, the output columns, and the last value
+ and latest source time of each instrument. The source rows at or after the
+ watermark are kept in a second file (the state file name plus ".npz"). Only
+ the source rows of each instrument after its latest source time are processed,
+ and only the rows after the watermark are appended. The last value of each
+ instrument is carried forward, so the appended rows are the same as a full run
+ would give. The sample period and stats of the output file are used, and tags
+ which are not in the output file yet are left out (with a warning). If there is
+ no output file or state file, the output file has changed since the state was
+ saved, or an instrument has new source rows before the watermark, the whole
+ output file is written and a new state saved. Only for the csv output format.
+
+ -si or --sortedInput (optional, default=False). The input and merge files are
+ in time order (ascending or descending). Rows outside the start and end time
+ (-st/-et) are always dropped as the files are read. With this option, the -t
+ and -n files are read in blocks of rows, and a block is checked using just its
+ first and last timestamps, so a block outside the start and end time is
+ skipped without converting its timestamps, and reading stops once the file is
+ past the start and end time. A merge file whose first and last rows are both
+ outside the start and end time is not read, apart from its header. The -a
+ files are grouped by tag, so this does not apply to them. Do not use this if
+ the files are not in time order, as rows in the time range could be missed.
+ Not used when the parsed data is cached (-cd).
+
+ -ix or --index (optional, default=False). Use a block index of each input and
+ merge file to read just the parts of the file which are needed. The index is
+ kept next to the file (the file name plus ".ftppidx"), and holds the position
+ of each block of rows in the file, with the first and last timestamp in the
+ block, and for archive data (-a), the TagIds in it. Only the blocks with rows
+ in the start and end time (-st/-et), and for archive data, rows for the tags
+ given with -tg, are read. The index is made the first time the file is used
+ (which reads all of it), and made again whenever the file changes. Only for
+ -t, -a and -n files, and not for the utf_16 or utf_32 encodings. Not used when
+ the parsed data is cached (-cd).
+
+ -tg or --tags (optional, default=None). Only process these tags. Give the tag
+ names (or the instrument names made from them, with spaces, hyphens and periods
+ changed to underscores) separated by commas. Can be used more than once.
+ Default is all the tags.
+
+ -mm or --memoryMap (optional, default=False). Only used with the -a option.
+ Map the input and merge files into memory and scan their bytes, instead of
+ reading them with read_csv. The row and field boundaries are found in the raw
+ bytes, and only the fields needed are converted: the TagId of each row, the
+ TagName of the first row of each tag, the Timestamp of the rows of the tags
+ given with -tg, and the Value of the rows in the start and end time (-st/-et).
+ Only the typed per tag data is kept, as with -cs, which is not used. Values
+ are converted exactly, the same as when the whole file is read at once. Needs
+ a single character delimiter, and an encoding such as utf_8 or latin_1 (not
+ utf_16 or utf_32). Blocks of rows with quoted values are read with read_csv.
+
+ -pf or --profile (optional, default=None). Write a profiling report (json) to
+ this file. It has the wall clock and CPU time, rows in and out, rows per
+ second, and peak memory (process RSS, and python allocations traced with
+ tracemalloc) of each stage of the run: reading the source files, converting
+ the timestamps, parsing the source data into tags, the cache, making the
+ instruments, resampling, aligning and writing. The time spent making and
+ resampling each instrument is included too. Stage times include the time of
+ the stages done inside them (e.g. merge files read while parsing). Tracing
+ the memory makes the run a little slower. The report is written at the end of
+ a run which completes.
+
+ -cp or --cprofile (optional, default=None). Profile the run with cProfile, and
+ save the statistics to this file, to be looked at with pstats (python -m
+ pstats FILE) or a viewer such as snakeviz.
+
  -noExportMsg (optional, default=False). When this argument is used, it turns
  off the inclusion of an export control message.  The defaults to false, so a
  message is included unless this argument is specified.
@@ -396,6 +798,21 @@ parser.add_argument('-am4', '--archiveMerge4', default=None, metavar='', \
                    help='Merge this named file with the data in the \
 inputFileName before processing. Must be used with the -a option. \
 Must have the same format/layout as the input file.')
+parser.add_argument('-am', '--archiveMerge', default=None, metavar='', \
+                   action='append', \
+                   help='Merge this named file with the data in the \
+inputFileName before processing. Can be used any number of times. \
+Must have the same format/layout as the input file.')
+parser.add_argument('-amg', '--archiveMergeGlob', default=None, metavar='', \
+                   action='append', \
+                   help='Merge the files matching this pattern, in name order, \
+with the data in the inputFileName before processing. Can be used more than once. \
+Must have the same format/layout as the input file.')
+parser.add_argument('-aml', '--archiveMergeList', default=None, metavar='', \
+                   action='append', \
+                   help='Merge the files named in this text file (one per line), \
+with the data in the inputFileName before processing. Can be used more than once. \
+Must have the same format/layout as the input file.')
 parser.add_argument('-sd', '--sourceDelimiter', default=',', metavar='', \
                    help='Source file field delimiter. Default is a comma (\",\").')
 parser.add_argument('-se', '--sourceEncoding', default='utf_8', metavar='', \
@@ -463,6 +880,110 @@ parser.add_argument('-stats', default='m', metavar='', \
  which is on or after the timestamp is shown. The values between this and the \
  next sample point are thrown away. For the other options, the intermediate \
  values are used to calculate the statistic.')
+parser.add_argument('-cs', '--chunkSize', default=None, type=int, metavar='', \
+                    help='Read archive data (-a) input and merge files in \
+chunks of this many rows. Only the typed per tag data is kept between chunks, \
+so memory use is bounded by the chunk size plus the retained data instead of \
+the size of the input file. Default is to read the whole file at once.')
+
+parser.add_argument('-ae', '--alignEngine', default='merge', metavar='', \
+                    choices=['merge', 'vector'], \
+                    help='Choose how the instrument data is aligned to the \
+output timestamps. Choices are: merge (one merge_asof per instrument) and \
+vector (one preallocated array filled using searchsorted). Both give the \
+same output. Default is merge.')
+parser.add_argument('-gm', '--gridMode', default='dense', metavar='', \
+                    choices=['dense', 'events'], \
+                    help='Choose the output timestamps. Choices are: dense \
+(every sample period from the start to the end time) and events (only the times \
+at which an instrument has a sample, rounded down to the sample period). \
+Default is dense.')
+parser.add_argument('-gs', '--gridSpacing', default=None, metavar='', \
+                    help='With the events grid, keep the output timestamps at \
+least this far apart (e.g. "1T"), leaving out the ones in between. Default is \
+to keep them all.')
+
+parser.add_argument('-cd', '--cacheDir', default=None, metavar='', \
+                    help='Cache the parsed source data in this directory, and \
+reuse it when the same input and merge files are processed again with the \
+same file type, source delimiter, source encoding and source time format. \
+Default is no cache.')
+parser.add_argument('-cm', '--cacheMaxMB', default=1024, type=float, metavar='', \
+                    help='Size limit of the cache in megabytes. The least \
+recently used entries are removed to stay under the limit. Default is 1024.')
+
+parser.add_argument('-j', '--jobs', default=1, type=int, metavar='', \
+                    help='Number of worker processes used to make and resample \
+the instruments. The data is passed to and from the workers through memory \
+mapped (shared memory) files, and the output is the same for any number of \
+jobs. Default is 1, which does the work in this process.')
+
+parser.add_argument('-fp', '--floatPrecision', default=None, type=int, metavar='', \
+                    help='Round the float values in the output file to this \
+many decimal places, to make the file smaller. Default is full precision.')
+
+# the choices are ftppPrecision.PRECISIONS, which is not imported yet
+parser.add_argument('-pr', '--precision', default='float64', metavar='', \
+                    choices=['float64', 'float32'], \
+                    help='Precision of the values. Choices are: float64 and \
+float32. float32 takes half the memory, and writes at most 9 significant \
+digits. Mean and standard deviation stats are calculated in float64. Default \
+is float64.')
+
+parser.add_argument('-wt', '--writeThreads', default=1, type=int, metavar='', \
+                    help='Number of threads used to format the output file \
+rows. The output is the same for any number of threads. Default is 1.')
+
+parser.add_argument('-ow', '--outputWindow', default=None, metavar='', \
+                    help='Write the output file a time window (e.g. 1H) at a \
+time, each window written by a background thread while the next is aligned, so \
+the whole output is never in memory at once. The output file is the same. csv \
+output only, and not with -inc. Default is to write the whole output at once.')
+
+# the choices are ftppWriter.OUTPUT_FORMATS, which is not imported yet
+parser.add_argument('-of', '--outputFormat', default='csv', metavar='', \
+                    choices=['csv', 'parquet', 'feather', 'hdf5'], \
+                    help='Output file format. Choices are: csv, parquet, \
+feather, and hdf5. The binary formats keep the export control message as file \
+metadata. Default is csv.')
+parser.add_argument('-oc', '--outputCompression', default=None, metavar='', \
+                    help='Compression used for the binary output formats \
+(e.g. snappy, gzip, zstd, lz4, zlib, blosc). Default is no compression.')
+
+parser.add_argument('-inc', '--incremental', action='store_true', default=False, \
+                    help='Append only the new data to an existing output file \
+(csv only), using a state file kept next to it. The last value of each \
+instrument is carried forward, so the appended rows are the same as a full \
+run would give. The whole file is written if it cannot be appended to.')
+
+parser.add_argument('-si', '--sortedInput', action='store_true', default=False, \
+                    help='The input and merge files are in time order. Blocks \
+of rows outside the start and end time are skipped using their first and last \
+timestamps, reading stops once past the end, and merge files outside the start \
+and end time are not read. Rows outside the start and end time are always \
+dropped as the files are read.')
+
+parser.add_argument('-ix', '--index', action='store_true', default=False, \
+                    help='Use a block index of each input and merge file \
+(kept next to it, and made when needed) to read just the blocks of rows in \
+the start and end time, and for archive data, for the tags given with -tg.')
+parser.add_argument('-tg', '--tags', action='append', default=None, metavar='', \
+                    help='Only process these tags (comma separated tag or \
+instrument names). Can be used more than once. Default is all the tags.')
+
+parser.add_argument('-mm', '--memoryMap', action='store_true', default=False, \
+                    help='Read archive data (-a) input and merge files by \
+mapping them into memory and scanning their bytes, converting only the fields \
+and rows needed. Needs a single character delimiter and an ascii compatible \
+encoding (e.g. utf_8 or latin_1).')
+
+parser.add_argument('-pf', '--profile', default=None, metavar='', \
+                    help='Write a json profiling report to this file, with \
+the time, rows, rows per second and peak memory of each stage of the run, and \
+the time spent on each instrument. Default is no report.')
+parser.add_argument('-cp', '--cprofile', default=None, metavar='', \
+                    help='Profile the run with cProfile, and save the \
+statistics to this file (see the pstats module). Default is no cProfile.')
 
 parser.add_argument('-noExportMsg', action='store_true', default=False, \
                     help='Do not include the export control message at the \
@@ -481,8 +1002,6 @@ typegroup.add_argument('-n', action='store_true', default=False, \
                     help='Time normalized input file type (format).')
 typegroup.add_argument('-s', action='store_true', default=False, \
                     help='Strain gauge input file type (format).')
-# parse the arguments
-args = parser.parse_args()
 
 # At this point, the arguments will be:
 # Argument          Values      Description
@@ -492,6 +1011,9 @@ args = parser.parse_args()
 # args.archiveMerge2    string file to merge with input
 # args.archiveMerge2    string file to merge with input
 # args.archiveMerge4    string file to merge with input
+# args.archiveMerge     list of strings files to merge with input, or None
+# args.archiveMergeGlob list of strings patterns of files to merge, or None
+# args.archiveMergeList list of strings files listing files to merge, or None
 # args.sourceDelimiter  string Input file field delimiter. Default is ","
 # args.sourceEncoding   string Input file encoding. Default is utf_8.
 # args.destDelimiter    string Dest file field delimiter. Default is (",")
@@ -503,6 +1025,26 @@ args = parser.parse_args()
 # args.destTimeFormat   string Format string for destination data timestamps
 # args.resample         string Resample period. Default is 'S' or 1 sample/sec.
 # args.stats            string Stats to calc. Value, min, max, ave, std dev.
+# args.chunkSize        int    Rows per chunk when streaming -a input. None = all.
+# args.alignEngine      string Alignment engine. 'merge' or 'vector'.
+# args.gridMode         string Output timestamps. 'dense' or 'events'.
+# args.gridSpacing      string Events grid minimum spacing. None = all times.
+# args.cacheDir         string Parsed source data cache directory. None = no cache.
+# args.cacheMaxMB       float  Size limit of the cache in MB.
+# args.jobs             int    Number of instrument worker processes.
+# args.floatPrecision   int    Output float decimal places. None = full precision.
+# args.precision        string Value precision. 'float64' or 'float32'.
+# args.writeThreads     int    Number of output formatting threads.
+# args.outputWindow     string Output time window period. None = all at once.
+# args.outputFormat     string Output file format. csv, parquet, feather, or hdf5.
+# args.outputCompression string Binary output format compression. None = none.
+# args.incremental      True/False Append new data to the output file when set
+# args.sortedInput      True/False Input files are in time order when set
+# args.index            True/False Read using the block index files when set
+# args.tags             list of strings Tags to process, or None for all
+# args.memoryMap      True/False Scan memory mapped -a files when set
+# args.profile         string Profiling report (json) file. None = no report.
+# args.cprofile        string cProfile statistics file. None = no cProfile.
 # args.noExportMsg      True/False Exclude export control message when set
 # args.verbose          True/False Increase output messaging
 # args.t                True/False Historical trend input file type when set
@@ -510,223 +1052,548 @@ args = parser.parse_args()
 # args.n                True/False Time Normalized input file type when set.
 # args.s                True/False Strain gauge input file type when set.
 
-# Put the begin mark here, after the arg parsing, so argument problems are
-# reported first.
-print('**** Begin Processing ****')
-# get start processing time
-procStart = datetime.now()
-print('    Process start time: ' + procStart.strftime('%m/%d/%Y %H:%M:%S'))
-
-# **** Convert the start and end times to datetimes if they are specified.
-# Use the dateutil.parser function to get input flexability, and then
-# convert to a pandas datetime for max compatibility
-# If time info is not included in the start time, it defaults to
-# midnight, so comparisons will work as expected and capture the entire
-# day. For the end time, however, if time info is not included, force
-# it to be 11:59:59.999 so the entire end date is captured.
-if args.startTime is not None:
-    # Convert the argument to a datetime. If it can't be converted, ignore it.
-    # need to convert
-    try:
-        startArg = duparser.parse(args.startTime, fuzzy=True)
-        # convert to a pandas datetime for max compatibility
-        startArg = pd.to_datetime(startArg, errors='raise',
-                                  infer_datetime_format=True, origin='unix')
-    except ValueError as ve:
-        # not convertable ... invalid ... ignore
-        print('WARNING: Invalid start time. Ignoring.')
-        print(ve)
-        startArg = None
-else:
-    # arg is none, so update the internal version
-    startArg = None
-
-# repeat for end time
-if args.endTime is not None:
-    # Convert the argument to a datetime. If it can't be converted, ignore it.
-    try:
-        endArg = duparser.parse(args.endTime, fuzzy=True)
-        # convert to a pandas datetime for max compatibility
-        endArg = pd.to_datetime(endArg, errors='raise',
-                                  infer_datetime_format=True, origin='unix')
-
-        # assume the end time of midnight means end time info was not
-        # specified. Force it to the end of the day
-        if endArg.time() == time(0,0,0,0):
-            endArg = endArg.replace(hour=23, minute=59,
-                                    second=59, microsecond=999999)
-
-    except ValueError as ve:
-        # not convertable ... invalid ... ignore
-        print('WARNING: Invalid end time. Ignoring.')
-        print(ve)
-        endArg = None
-
-else:
-    # arg is none, so update the internal version
-    endArg = None
-
-# get the resample argument
-if args.resample is not None:
-    # a resample arg was supplied.  Try to use it, or default to 1 sec.
-    try:
-        resampleArg = to_offset(args.resample) # use the offset version
-    except ValueError as ve:
+
+# **** Errors
+class ProcessError(Exception):
+    """
+    Raised when the files cannot be processed. The message is the error which
+    was printed.
+    """
+
+
+def _fail(*lines):
+    """
+    Print the lines of an error message, and raise a ProcessError with them.
+    """
+    for line in lines:
+        print(line)
+    raise ProcessError('\n'.join(str(line) for line in lines))
+
+
+# The syntax of a pandas offset string (the -rs argument), e.g. "5S", "1H30T"
+# or "W-SUN": one or more of an optional number followed by a name, which can
+# have a suffix after a hyphen. The names are checked by pandas later.
+_OFFSET_SYNTAX = re.compile(r'(\s*[+-]?(\d*\.\d*|\d*)\s*[A-Za-z]+(-[\dA-Za-z-]+)?)+\s*')
+
+
+def _checkArgs(args):
+    """
+    Check the arguments which can be checked without the numerical libraries,
+    so mistakes are reported quickly. Raise a ProcessError (after printing it)
+    if the input file or a named merge file does not exist. An invalid
+    resample period is replaced with 1 second, with a warning.
+    """
+    if not os.path.isfile(args.inputFileName):
+        _fail('ERROR: The input file "' + args.inputFileName + '" does not exist.')
+    # The glob patterns (-amg) only give files which exist, so they are not checked.
+    mergeNames = [args.archiveMerge1, args.archiveMerge2, args.archiveMerge3,
+                  args.archiveMerge4] + (args.archiveMerge or []) + \
+        (args.archiveMergeList or [])
+    for mergeName in mergeNames:
+        if mergeName is not None and not os.path.isfile(mergeName):
+            _fail('ERROR: The merge file "' + mergeName + '" does not exist.')
+    if args.resample is not None and _OFFSET_SYNTAX.fullmatch(args.resample) is None:
         print('WARNING: Invalid resample period specified. Using 1 second')
-        print(ve)
-        resampleArg = to_offset('S')
-else:
-    # arg is none, so update the internal version
-    resampleArg = None
-
-# force the stats argument to a lower case string so they are case insensitive.
-stats = str(args.stats).lower()
-
-# Use the specified argument for the source time format, or use the
-# -t/-a/-n/-s option to determine the source time format.
-if args.sourceTimeFormat is not None:
-    # a source time format has been specified. Use it over the other defaults
-    # make sure the source timestamp format argument is a string
-    sourceTimeFormat = str(args.sourceTimeFormat)
-elif args.t:
-    # no format specified. Use the default for this option
-    #sourceTimeFormat = '%m/%d/%Y %I:%M:%S %p'
-    sourceTimeFormat = '%m/%d/%Y %H:%M:%S.%f'
-elif args.a:
-    # no format specified. Use the default for this option
-    sourceTimeFormat = '%Y-%m-%d %H:%M:%S.%f'
-elif args.n:
-    # no format specified. Use the default for this option
-    sourceTimeFormat = '%Y-%m-%d %H:%M:%S.%f'
-elif args.s:
-    # no format specified. Use the default for this option
-    sourceTimeFormat = '%m/%d/%Y %I:%M:%S %p'
-
-# Use the specified argument for the destination time format, or use the source
-# time format if nothing was specified.
-if args.destTimeFormat is not None:
-    # a destination time format has been specified. Use it over the other defaults
-    # make sure the destination timestamp format argument is a string
-    destTimeFormat = str(args.destTimeFormat)
-else:
-    # no destination time format specified. Make it the same as the sourceTimeFormat.
-    destTimeFormat = sourceTimeFormat
-
-# **** read the csv file into a data frame.
-# The first row is treated as the header, except for in the -s case, and then
-# the header info is delt with when processing the -s option below.
-try:
-    # use string as the data type for all columns to prevent automatic
-    # datatype detection. We don't know ahead of time how many columns are
-    # being read in, so we don't yet know the types.
-    # We want duplicate column names to be preserved as in.
-    # They will get filtered out as duplicates later.
-    # The default behavior of read_csv is to append a ".n" to the column name
-    # where n is an integer value starting at 1 and incrementing up for each
-    # duplicate found. The problem with this is later, this gets interpreted as
-    # a different tag if using some options.
-    # COMPILER: mangle_dupe_cols=False is supposed to preserve the duplicate
-    # column names by turning off the mangling described above.
-    # It is "not supported yet" but is in the documentation for
-    # Pandas 0.22 and maybe earler as being a feature!!
-    # It throws a ValueError if used.  As a work around, don't use
-    # mangle_dupe_cols=False, and use header=None instead of header=0 in the
-    # read_csv function.  Then manually rename the columns using the 1st row
-    # of the csv.
-    df_source = pd.read_csv(args.inputFileName, sep=args.sourceDelimiter,
-                        delim_whitespace=False, encoding=args.sourceEncoding,
-                        header=None, dtype = str, skipinitialspace=True)
-                        # mangle_dupe_cols=False)
-    # Manually rename the columns using the 1st row of the csv.
-    # Don't do this with the strain gauge file types because the header
-    # processing is more complicated, and is done below.
-    if not args.s:
-        df_source = df_source.rename(columns=df_source.iloc[0], copy=False).iloc[1:].reset_index(drop=True)
-    # NOTE: At this point the source may have duplicate columns. This may be okay
-    # or it may be problematic, depending on the -t, -a, -s or -n option. Deal with
-    # duplicates below when we check the option.
-
-except ValueError as ve:
-    print('ERROR opening source file: "' + args.inputFileName + '". Check file \
-name, file presence, and permissions. Unexpected encoding can also cause this \
-error.')
-    print(ve)
-    quit()
-
-# print diagnostic info if verbose is set
-if args.verbose:
-    print('**** Input Data ****')
-    print(df_source)
-
-# put source the headers into a list
-headerList = df_source.columns.values.tolist()
-# Make a spot for a list of instrument TsIdxData objects,
-# and a list of just instrument names. The latter is used to detect
-# data for duplicate instruments. If a duplicate is found, the data is
-# appended to an already existing instrument.
-instData = []
-instDataNames = []
-
-# **** Look at the data type being input (-t, -a, -n or -s) and make sure there
-# is at least the minimum number of columns for a valid data file. If there are
-# any merge files specified (-am params), then merge them. Finally process the
-# data into a list of TsIdxData objects, with one object per instrument holding
-# the time stamped indexed value data.
-# Note that in the -s strain gauge data, the headerList or column names are not
-# yet processed, so the column names and header list are just 0, 1, ..., n
-if args.t and len(headerList) >= 2:
-    # Historical trend data, and there are at least two (time/value pair) cols.
-    # The data is expected to have these columns
-    # [0] Tag 1 Timestamp
-    # [1] Tag 1 Value
-    # ...
-    # [(n-1) * 2] Tag n Timestamp
-    # [((n-1) * 2) + 1] Tag n Value
-    # where the header contains the instrument names plus a suffix for the
-    # timestamp and value columns.
-    #
-    # In the historical trend case, loop thru every other column to get to the
-    # time stamp columns. The instrument name can be derived from this and the
-    # values can be obtained from a relative (+1) index from the timestamp
-    print('\nHistorical Trend Data Specified. The source data is expected to \
-have the following format:\n \
-    Tag1 TimeStamp, Tag1 Value, Tag2 TimeStamp, Tag2 Value ... \n\
-and the timestamps may or may not be synchronized.\n')
+        args.resample = 'S'
+
+
+# Internal function to make an instrument name from a tag name.
+def _instNameOf(tagName):
+    """
+    Return the instrument name for a tag name: the tag name with the spaces,
+    hyphens, and periods replaced with underscores.
+    """
+    instName = tagName.replace(' ', '_')
+    instName = instName.replace('-', '_')
+    instName = instName.replace('.', '_')
+    return instName
+
+
+class PostProcessor(object):
+    """
+    Post processes the files given by the arguments args (the parsed command
+    line, see main(), or made by process()). Each stage is a method, and run()
+    does them all in order:
+
+        loadSource()        read and parse the input and merge files into the
+                            source tags (or get them from the cache)
+        buildInstruments()  make the instruments from the source tags
+        timeGrid()          make the output timestamps
+        align()             resample the instruments, and align them to the
+                            output timestamps, giving the output data
+        write()             write the output data to the output file
+
+    Progress, warnings and errors are printed as the stages are done. A
+    ProcessError is raised if a stage cannot be done. Call close() when done
+    with the stages, to stop the instrument worker processes (-j).
+    """
+    def __init__(self, args):
+        self.args = args
+        # the numerical libraries are needed from here on
+        _loadLibraries()
+        # the instrument worker processes (-j), when used
+        self.instPool = None
+        # the parsed source data cache (-cd), when used, and the key of the
+        # files in it
+        self.parseCache = None
+        self.cacheKey = None
+
+        # **** Profile the run, if asked to (see ftppProfile.py). The source file reads
+        # and the timestamp conversions are done in many places, so the functions doing
+        # them are timed as stages of their own. The profiler does nothing otherwise.
+        from ftppProfile import StageProfiler
+        self.profiler = StageProfiler(args.profile, args.cprofile)
+        self.profiler.begin()
+        self.readTyped = self.profiler.timed('read', readTyped,
+                                             rowsOut=lambda result: len(result[0].index))
+        self.readStrain = self.profiler.timed('read', readStrain,
+                                              rowsOut=lambda result: len(result[1].index))
+        self.parseTimestamps = self.profiler.timed('timestamps', parseTimestamps, rowsIn=len)
+
+        # **** Convert the start and end times to datetimes if they are specified.
+        # Use the dateutil.parser function to get input flexability, and then
+        # convert to a pandas datetime for max compatibility
+        # If time info is not included in the start time, it defaults to
+        # midnight, so comparisons will work as expected and capture the entire
+        # day. For the end time, however, if time info is not included, force
+        # it to be 11:59:59.999 so the entire end date is captured.
+        if args.startTime is not None:
+            # Convert the argument to a datetime. If it can't be converted, ignore it.
+            # need to convert
+            from dateutil import parser as duparser
+            try:
+                self.startArg = duparser.parse(args.startTime, fuzzy=True)
+                # convert to a pandas datetime for max compatibility
+                self.startArg = pd.to_datetime(self.startArg, errors='raise',
+                                               infer_datetime_format=True, origin='unix')
+            except ValueError as ve:
+                # not convertable ... invalid ... ignore
+                print('WARNING: Invalid start time. Ignoring.')
+                print(ve)
+                self.startArg = None
+        else:
+            # arg is none, so update the internal version
+            self.startArg = None
 
-    # Deal with duplicates in the input file.
-    # Duplicates with this data format may or may not be problematic since
-    # a tag may be represented more than once, but contain different timestamps.
-    # We don't want to throw away a column just becasue it has a duplicate name.
-    # If the timestamps are duplicated, dups will be dropped after merging.
-    # Detect duplicates and warn.
-    dups = listDuplicates(df_source)
-    if dups:
-        # duplicates have been found.  Notify and continue.
-        print('    WARNING: There are column names duplicated in the input file "' + args.inputFileName + '".\n\
-This is allowed, but if the duplicate column or columns contain duplicate timestamps,\n\
-then only one value will be retained.\nThe following column names are duplicated:')
-        print(dups)
-        print()
+        # repeat for end time
+        if args.endTime is not None:
+            # Convert the argument to a datetime. If it can't be converted, ignore it.
+            from dateutil import parser as duparser
+            try:
+                self.endArg = duparser.parse(args.endTime, fuzzy=True)
+                # convert to a pandas datetime for max compatibility
+                self.endArg = pd.to_datetime(self.endArg, errors='raise',
+                                             infer_datetime_format=True, origin='unix')
+
+                # assume the end time of midnight means end time info was not
+                # specified. Force it to the end of the day
+                if self.endArg.time() == time(0,0,0,0):
+                    self.endArg = self.endArg.replace(hour=23, minute=59,
+                                                      second=59, microsecond=999999)
+
+            except ValueError as ve:
+                # not convertable ... invalid ... ignore
+                print('WARNING: Invalid end time. Ignoring.')
+                print(ve)
+                self.endArg = None
+
+        else:
+            # arg is none, so update the internal version
+            self.endArg = None
+
+        # get the resample argument
+        if args.resample is not None:
+            # a resample arg was supplied.  Try to use it, or default to 1 sec.
+            try:
+                self.resampleArg = to_offset(args.resample) # use the offset version
+            except ValueError as ve:
+                print('WARNING: Invalid resample period specified. Using 1 second')
+                print(ve)
+                self.resampleArg = to_offset('S')
+        else:
+            # arg is none, so update the internal version
+            self.resampleArg = None
+
+        # force the stats argument to a lower case string so they are case insensitive.
+        self.stats = str(args.stats).lower()
+
+        # make sure the chunk size, if specified, is a usable number of rows. If not,
+        # ignore it and read the whole file at once.
+        if args.chunkSize is not None and args.chunkSize < 1:
+            print('WARNING: Invalid chunk size specified. Reading the whole file at once.')
+            args.chunkSize = None
+
+        # make sure the source files can be scanned as bytes when memory mapping. If
+        # not, read them with read_csv.
+        if args.a and args.memoryMap:
+            # memory mapped scanning of the source files
+            from ftppMmap import canMap
+            if not canMap(args.sourceDelimiter, args.sourceEncoding):
+                print('WARNING: Files with the "' + args.sourceDelimiter + '" delimiter and the ' +
+                      args.sourceEncoding + ' encoding cannot be memory mapped. Reading them \
+with read_csv.')
+                args.memoryMap = False
+
+        # make sure the number of jobs is usable. If not, do the work in this process.
+        if args.jobs < 1:
+            print('WARNING: Invalid number of jobs specified. Using 1.')
+            args.jobs = 1
+        elif args.jobs > 1:
+            # parallel instrument construction and resampling
+            from ftppParallel import InstrumentPool
+            if not InstrumentPool.available():
+                print('WARNING: Worker processes are not available on this platform. \
+Using 1 job.')
+                args.jobs = 1
+
+        # make sure the float precision, if specified, is a usable number of decimal
+        # places. If not, ignore it and write full precision.
+        if args.floatPrecision is not None and args.floatPrecision < 0:
+            print('WARNING: Invalid float precision specified. Using full precision.')
+            args.floatPrecision = None
+
+        # make sure the value precision is one there is. If not, use float64.
+        # valueType is the numpy type of the float values.
+        if args.precision not in PRECISIONS:
+            print('WARNING: Invalid precision specified. Using ' + PRECISIONS[0] + '.')
+            args.precision = PRECISIONS[0]
+        self.valueType = getattr(np, args.precision)
+
+        # make sure the number of write threads is usable. If not, use 1.
+        if args.writeThreads < 1:
+            print('WARNING: Invalid number of write threads specified. Using 1.')
+            args.writeThreads = 1
+
+        # make sure the grid spacing, if specified, is a fixed period, and only used
+        # with the events grid. If not, ignore it. gridSpacing is the spacing in ns.
+        self.gridSpacing = None
+        if args.gridSpacing is not None:
+            if args.gridMode != 'events':
+                print('WARNING: The grid spacing is only used with the events grid \
+(-gm events). Ignoring it.')
+            else:
+                # output timestamp grid
+                from ftppGrid import fixedNanos
+                self.gridSpacing = fixedNanos(args.gridSpacing)
+                if self.gridSpacing is None:
+                    print('WARNING: Invalid grid spacing specified. Keeping all the \
+output timestamps.')
+
+        # In incremental mode, get the state of the output file (see ftppIncremental.py).
+        # incState stays None when not in incremental mode. When appending to the
+        # output file, use the sample period and stats it was made with.
+        self.incState = None
+        if args.incremental:
+            if args.outputFormat != 'csv':
+                print('WARNING: Incremental mode only works with the csv output format. \
+Writing the whole output file.')
+            else:
+                # incremental (append) mode state
+                from ftppIncremental import IncrementalState
+                try:
+                    self.incState = IncrementalState.load(args.outputFileName)
+                except ValueError as ve:
+                    print('WARNING: Unable to use the incremental state file. Writing the \
+whole output file.')
+                    print(ve)
+                if self.incState is None:
+                    # nothing to append to. Write the whole file and start a new state.
+                    self.incState = IncrementalState()
+                else:
+                    print('Incremental mode. Appending the data after ' +
+                          str(self.incState.watermark) + ' to the output file.')
+                    if self.resampleArg is not None and to_offset(self.resampleArg) != self.incState.offset():
+                        print('WARNING: The resample period does not match the output file. \
+Using ' + self.incState.freq + '.')
+                    self.resampleArg = self.incState.offset()
+                    if self.stats != self.incState.stats:
+                        print('WARNING: The stats do not match the output file. Using ' +
+                              self.incState.stats + '.')
+                        self.stats = self.incState.stats
+
+        # make sure the output window, if specified, is a period, and can be used
+        # with the output format and mode. If not, ignore it and write the whole
+        # output at once. outputWindow is the period as a pandas offset.
+        self.outputWindow = None
+        if args.outputWindow is not None:
+            if args.outputFormat != 'csv' or self.incState is not None:
+                print('WARNING: The output window is only used with the csv output \
+format, and not in incremental mode. Writing the whole output at once.')
+            else:
+                try:
+                    self.outputWindow = to_offset(args.outputWindow)
+                except ValueError:
+                    print('WARNING: Invalid output window specified. Writing the \
+whole output at once.')
+
+        # Use the specified argument for the source time format, or use the
+        # -t/-a/-n/-s option to determine the source time format.
+        if args.sourceTimeFormat is not None:
+            # a source time format has been specified. Use it over the other defaults
+            # make sure the source timestamp format argument is a string
+            self.sourceTimeFormat = str(args.sourceTimeFormat)
+        elif args.t:
+            # no format specified. Use the default for this option
+            #sourceTimeFormat = '%m/%d/%Y %I:%M:%S %p'
+            self.sourceTimeFormat = '%m/%d/%Y %H:%M:%S.%f'
+        elif args.a:
+            # no format specified. Use the default for this option
+            self.sourceTimeFormat = '%Y-%m-%d %H:%M:%S.%f'
+        elif args.n:
+            # no format specified. Use the default for this option
+            self.sourceTimeFormat = '%Y-%m-%d %H:%M:%S.%f'
+        elif args.s:
+            # no format specified. Use the default for this option
+            self.sourceTimeFormat = '%m/%d/%Y %I:%M:%S %p'
+
+        # Use the specified argument for the destination time format, or use the source
+        # time format if nothing was specified.
+        if args.destTimeFormat is not None:
+            # a destination time format has been specified. Use it over the other defaults
+            # make sure the destination timestamp format argument is a string
+            self.destTimeFormat = str(args.destTimeFormat)
+        else:
+            # no destination time format specified. Make it the same as the sourceTimeFormat.
+            self.destTimeFormat = self.sourceTimeFormat
+
+        # **** Put together the list of files to merge with the input file, in order:
+        # -am1..-am4, -am, the files matching -amg, then the files listed in -aml.
+        try:
+            self.mergeFiles = collectMergeFiles([args.archiveMerge1, args.archiveMerge2,
+                                                 args.archiveMerge3, args.archiveMerge4] +
+                                                (args.archiveMerge or []),
+                                                globPatterns=args.archiveMergeGlob,
+                                                listFiles=args.archiveMergeList)
+        except ValueError as ve:
+            _fail('ERROR: Unable to get the files to merge.', ve)
+
+        # **** Apply the start and end times (-st/-et) as the source files are read,
+        # rather than reading all of the rows and leaving it to the instruments (see
+        # ftppWindow.py). The instruments still apply the start and end times, so the
+        # output is the same. When the parsed source data is cached, all of it is read
+        # and cached, so the cache can be used again with any start and end time.
+        if args.cacheDir is None:
+            self.window = TimeWindow(self.startArg, self.endArg, sortedInput=args.sortedInput)
+        else:
+            self.window = TimeWindow()
+
+        # **** Only process the tags given with -tg, if any. Either the tag names or the
+        # instrument names made from them can be given.
+        self.tagFilter = None
+        if args.tags:
+            self.tagFilter = set(_instNameOf(tagName.strip()) for tagArg in args.tags
+                                 for tagName in tagArg.split(',') if tagName.strip())
+
+        # **** With -ix, use the block index of the input and merge files to read just
+        # the blocks of each file with rows in the time range, and for archive data,
+        # rows for the tags wanted (see ftppIndex.py). The index of a file is made the
+        # first time, and saved next to it. The indexes are not used with the cache,
+        # since it keeps all of the parsed data.
+        # indexTags is the TagId -> TagName of the archive tags wanted, as found in the
+        # indexes, so a tag is still in the output when none of its blocks are read.
+        self.indexTags = {}
+        if args.t:
+            self.indexLayout = 't'
+        elif args.a:
+            self.indexLayout = 'a'
+        elif args.n:
+            self.indexLayout = 'n'
+        else:
+            # strain gauge files have header rows above the data, and are not indexed
+            self.indexLayout = None
+
+    def _toDatetime(self, ts):
+        """
+        Return the series of timestamp strings converted to datetimes, the same
+        way the source data is converted below. Timestamps which cannot be
+        converted are NaT.
+        """
+        try:
+            return self.parseTimestamps(ts, errors='raise', timeFormat=self.sourceTimeFormat,
+                                        exact=False, origin='unix')
+        except ValueError:
+            return self.parseTimestamps(ts, errors='coerce', infer_datetime_format=True,
+                                        origin='unix')
+
+    def _wantTag(self, tagName):
+        """
+        Return True if the tag (tag name or instrument name) is to be processed.
+        """
+        return self.tagFilter is None or _instNameOf(tagName) in self.tagFilter
+
+    def _indexBlocks(self, fileName):
+        """
+        Return the list of blocks of the source file to read, or None to read
+        all of it. The index of the file is made and saved if needed.
+        """
+        args = self.args
+        if not args.index or args.cacheDir is not None or self.indexLayout is None:
+            return None
+        # block index (sidecar) files of the source files
+        from ftppIndex import openIndex, indexFileName
+        try:
+            index, built = openIndex(fileName, args.sourceDelimiter, args.sourceEncoding,
+                                     self.indexLayout, self.sourceTimeFormat, self._toDatetime)
+        except ValueError as ve:
+            print('WARNING: Unable to index the file "' + fileName + '". Reading all of it.')
+            print(ve)
+            return None
+        if index is None:
+            print('WARNING: Files with the ' + args.sourceEncoding + ' encoding cannot be \
+indexed. Reading all of "' + fileName + '".')
+            return None
+        if built:
+            print('Made the block index for "' + fileName + '".')
+            try:
+                index.save()
+            except OSError as oe:
+                print('WARNING: Unable to save the index file "' + indexFileName(fileName) + '".')
+                print(oe)
+        if not self.window.active and self.tagFilter is None:
+            # every block is needed
+            return None
+        tagIds = None
+        if self.indexLayout == 'a':
+            for tagId, tagName in index.tagNames().items():
+                if self._wantTag(tagName):
+                    self.indexTags.setdefault(tagId, tagName)
+            if self.tagFilter is not None:
+                tagIds = [tagId for tagId, tagName in index.tagNames().items()
+                          if self._wantTag(tagName)]
+        blocks = index.select(self.window, tagIds)
+        print('Reading ' + str(len(blocks)) + ' of ' + str(index.blockCount) +
+              ' blocks of "' + fileName + '".')
+        return blocks
+
+    def _resampleInst(self, inst):
+        """
+        Resample the instrument if it needs to be, and return its data with the
+        float values at the precision (-pr). See ftppPrecision.py.
+        """
+        if self.instPool is not None:
+            # already resampled by the worker processes, at the precision
+            inst.resample(self.resampleArg, self.stats)
+            return inst.data
+        return resampleAs(inst, self.resampleArg, self.stats, self.valueType)
+
+    def loadSource(self):
+        """
+        Read and parse the input and merge files, and return the list of
+        source tags: (instrument name, timestamp indexed value data) tuples,
+        in the order the instruments are to be made. The parsed data is taken
+        from, or saved in, the cache (-cd) if there is one. Only the tags wanted
+        (-tg) are returned, and in incremental mode (-inc), only the new data.
+        """
+        args = self.args
+        # **** Look for the parsed source data in the cache, if one is specified.
+        # The cache holds the typed, per tag data made from the input and merge files
+        # below. It depends on the files themselves, the file type (-t/-a/-n/-s), and
+        # the source delimiter, encoding, and time format, but not on the options that
+        # are applied to the instruments later (-st, -et, -vq, -rs, -stats, ...).
+        # srcTags is the list of (instrument name, timestamp indexed value data)
+        # tuples that the instruments are made from. It stays None until the source
+        # data is read from the cache or parsed below.
+        srcTags = None
+        cacheHit = False
+        if args.cacheDir is not None:
+            if args.t:
+                fileType = 't'
+            elif args.a:
+                fileType = 'a'
+            elif args.n:
+                fileType = 'n'
+            else:
+                fileType = 's'
+            # on disk cache of parsed source data
+            from ftppCache import ParseCache
+            try:
+                self.parseCache = ParseCache(args.cacheDir, args.cacheMaxMB)
+                self.cacheKey = self.parseCache.key([args.inputFileName] + self.mergeFiles,
+                                                    {'fileType': fileType,
+                                                     'sourceDelimiter': args.sourceDelimiter,
+                                                     'sourceEncoding': args.sourceEncoding,
+                                                     'sourceTimeFormat': self.sourceTimeFormat,
+                                                     'merge': 'tag'})
+                self.profiler.start('cacheLoad')
+                srcTags = self.parseCache.load(self.cacheKey)
+                self.profiler.stop('cacheLoad')
+            except OSError as oe:
+                # Can't use the cache (or a source file can't be read, which will be
+                # reported below). Carry on without the cache.
+                print('WARNING: Unable to use the cache directory "' + args.cacheDir + '".')
+                print(oe)
+                self.parseCache = None
+            cacheHit = srcTags is not None
+
+        # **** Look at the data type being input (-t, -a, -n or -s), read the
+        # input file, and make sure there is at least the minimum number of
+        # columns for a valid data file. If there are any merge files specified
+        # (-am params), then merge them. The data for each instrument is added to
+        # the list of source tags (srcTags), and then the instruments are made from
+        # the list.
+        if cacheHit:
+            # The source data was already parsed and is in the list of source tags.
+            self.profiler.start('parse')
+            print('\nUsing the cached source data for "' + args.inputFileName + '".\n')
+        elif args.t:
+            srcTags = self._trendSource()
+        elif args.a:
+            srcTags = self._archiveSource()
+        elif args.n:
+            srcTags = self._normalizedSource()
+        else:
+            srcTags = self._strainSource()
 
-    # Define a function to merge specified files. Put the internal definition
-    # here, as if only pertains to this file type, and so it can be seen
-    # before use
-    def _tMerge(fileToMerge, df_base, sep, encoding):
+        self.profiler.stop('parse', rowsOut=sum(len(df_data.index) for instName, df_data in srcTags or []))
+
+        # If the source data was parsed (not taken from the cache), and there is a
+        # cache, save the parsed data in the cache for next time.
+        if srcTags is None:
+            srcTags = []
+        elif self.parseCache is not None and not cacheHit:
+            try:
+                self.profiler.start('cacheStore')
+                self.parseCache.store(self.cacheKey, srcTags)
+                self.profiler.stop('cacheStore')
+            except OSError as oe:
+                print('    WARNING: Unable to save the parsed data in the cache.')
+                print(oe)
+
+        # Leave out the tags not given with -tg. Done after the cache is saved, so
+        # the cache keeps all the tags.
+        if self.tagFilter is not None:
+            srcTags = [(instName, df_data) for instName, df_data in srcTags
+                       if self._wantTag(instName)]
+
+        # Make the float values the precision (-pr) wanted. Done after the cache is
+        # saved, so the cache is the same for any precision. Each tag is replaced
+        # in turn, so its parsed data can be released as soon as it is converted.
+        for tagNum, (instName, df_data) in enumerate(srcTags):
+            srcTags[tagNum] = (instName, asPrecision(df_data, self.valueType))
+
+        # In incremental mode, only use the source rows after those already processed,
+        # along with the rows kept for the last row written. Hold on to the source
+        # data, so the rows needed to write the last row again next time can be kept.
+        if self.incState is not None:
+            srcTags = self.incState.newSource(srcTags)
+            self.incState.holdSource(srcTags)
+        return srcTags
+
+    def _readInput(self):
         """
-        This function merges data from the specified file name (fileToMerge)
-        with the base data (df_base), and returns the merged data.
-        The data to merge is read from a csv file, and must also be in the
-        Historical Trend data format (-t).
-
-        Since this file format has independent time/value pairs
-        in columns going to the right, this merge simply makes the source data wider
-        by appending columns (pd.concat with axis=1).
+        Read the input file, and return a tuple of its data, the strain gauge
+        data rows (-s only, otherwise None), and the list of all the names in
+        its header row. When streaming archive data (-a with -cs or -mm), only
+        the header row is read.
         """
+        args = self.args
+        df_strainData = None
+        # **** read the csv file into a data frame.
+        # The first row is treated as the header, except for in the -s case, and then
+        # the header info is delt with when processing the -s option below.
         try:
-            print('Merging file "' + fileToMerge + '".\n')
-            # use string as the data type for all columns to prevent automatic
-            # datatype detection. We don't know ahead of time how many columns are
-            # being read in, so we don't yet know the types.
+            # Read the columns directly into their types (see ftppSchema.py) rather
+            # than reading everything as strings and converting later.
             # We want duplicate column names to be preserved as in.
             # They will get filtered out as duplicates later.
             # The default behavior of read_csv is to append a ".n" to the column name
@@ -737,1330 +1604,1744 @@ then only one value will be retained.\nThe following column names are duplicated
             # column names by turning off the mangling described above.
             # It is "not supported yet" but is in the documentation for
             # Pandas 0.22 and maybe earler as being a feature!!
-            # It throws a ValueError if used.  As a work around, don't use
-            # mangle_dupe_cols=False, and use header=None instead of header=0 in the
-            # read_csv function.  Then manually rename the columns using the 1st row
-            # of the csv.
-            df_merge = pd.read_csv(fileToMerge, sep=sep,
-                                delim_whitespace=False, encoding=encoding,
-                                header=None, dtype = str, skipinitialspace=True)
-                                # mangle_dupe_cols=False)
-            df_merge = df_merge.rename(columns=df_merge.iloc[0], copy=False).iloc[1:].reset_index(drop=True)
+            # It throws a ValueError if used.  As a work around, the header row is
+            # read by itself with header=None, and the columns are named using it.
+            # headerList is all the names in the header row, including the columns
+            # the schema does not read (-a DataSource and Quality, -n Bias).
+            if args.a and (args.chunkSize or args.memoryMap):
+                # When streaming archive data (-a with -cs or -mm), only the header row is read
+                # here. The data is read a chunk at a time when processing the -a option.
+                headerList = readHeader(args.inputFileName, sep=args.sourceDelimiter,
+                                        encoding=args.sourceEncoding)
+                df_source = pd.DataFrame(columns=headerList)
+            elif args.s:
+                # The strain gauge file header processing is more complicated, and is
+                # done below. Here the header rows (as strings) and data rows (as
+                # numbers) are read separately.
+                df_source, df_strainData = self.readStrain(args.inputFileName,
+                                                           sep=args.sourceDelimiter,
+                                                           encoding=args.sourceEncoding)
+                headerList = df_source.columns.values.tolist()
+            else:
+                if args.a:
+                    schema = archiveSchema
+                elif args.n:
+                    schema = normalizedSchema
+                else:
+                    schema = trendSchema
+                # Filter the -n and -t rows by time as they are read. The -a rows
+                # are filtered once the tags are found, below.
+                keepChunk = None
+                if self.window.active and not args.a:
+                    keepChunk = self.window.chunkFilter(self._toDatetime, pairs=args.t)
+                df_source, headerList = self.readTyped(args.inputFileName,
+                                                       sep=args.sourceDelimiter,
+                                                       encoding=args.sourceEncoding,
+                                                       schema=schema, keepChunk=keepChunk,
+                                                       blocks=self._indexBlocks(args.inputFileName))
+            # NOTE: At this point the source may have duplicate columns. This may be okay
+            # or it may be problematic, depending on the -t, -a, -s or -n option. Deal with
+            # duplicates below when we check the option.
 
         except ValueError as ve:
-            print('ERROR when trying to merge: "' + fileToMerge + '".\n \
-Error opening file. Check file name, file presence, and permissions. \
-Unexpected encoding can also cause this error.')
-            print(ve)
-            quit()
+            _fail('ERROR opening source file: "' + args.inputFileName + '". Check file \
+name, file presence, and permissions. Unexpected encoding can also cause this \
+error.',
+                  ve)
 
-        # Deal with duplicates in the merge file.
+        # print diagnostic info if verbose is set
+        if args.verbose:
+            print('**** Input Data ****')
+            print(df_source)
+        return df_source, df_strainData, headerList
+
+    def _trendSource(self):
+        """
+        Read and parse the historical trend (-t) input and merge files, and
+        return the list of source tags, or None if the input file does not
+        have a time/value column pair.
+        """
+        args = self.args
+        df_source, _, headerList = self._readInput()
+        self.profiler.start('parse')
+        if len(headerList) < 2:
+            return None
+        # Historical trend data, and there are at least two (time/value pair) cols.
+        # The data is expected to have these columns
+        # [0] Tag 1 Timestamp
+        # [1] Tag 1 Value
+        # ...
+        # [(n-1) * 2] Tag n Timestamp
+        # [((n-1) * 2) + 1] Tag n Value
+        # where the header contains the instrument names plus a suffix for the
+        # timestamp and value columns.
+        #
+        # In the historical trend case, loop thru every other column to get to the
+        # time stamp columns. The instrument name can be derived from this and the
+        # values can be obtained from a relative (+1) index from the timestamp
+        print('\nHistorical Trend Data Specified. The source data is expected to \
+have the following format:\n \
+    Tag1 TimeStamp, Tag1 Value, Tag2 TimeStamp, Tag2 Value ... \n\
+and the timestamps may or may not be synchronized.\n')
+        srcTags = []
+
+        # Deal with duplicates in the input file.
+        # Duplicates with this data format may or may not be problematic since
+        # a tag may be represented more than once, but contain different timestamps.
+        # We don't want to throw away a column just becasue it has a duplicate name.
+        # If the timestamps are duplicated, dups will be dropped after merging.
         # Detect duplicates and warn.
-        dups = listDuplicates(df_merge)
+        dups = duplicateNames(df_source)
         if dups:
             # duplicates have been found.  Notify and continue.
-            print('    WARNING: There are column names duplicated in the file "' + fileToMerge + '.\n \
-This is allowed, but if the duplicate column or columns \
-contain duplicate timestamps, then only one value will be retained. \n \
-The following tags column names are duplicated:')
+            print('    WARNING: There are column names duplicated in the input file "' + args.inputFileName + '".\n\
+This is allowed, but if the duplicate column or columns contain duplicate timestamps,\n\
+then only one value will be retained.\nThe following column names are duplicated:')
             print(dups)
             print()
 
-        # Deal with duplicates between the source and merge file.
-        # Detect duplicates and warn.
-        dups = listToListIntersection(df_base, df_merge)
-        if dups:
-            # duplicates have been found.  Notify and continue.
-            print('    WARNING: There are tags in the input file "' + args.inputFileName + '" that are duplicated\n\
+        # Define a function to merge specified files. Put the internal definition
+        # here, as if only pertains to this file type, and so it can be seen
+        # before use
+        def _tMerge(fileToMerge, seenColumns, sep, encoding):
+            """
+            This function reads the data to merge from the specified file name
+            (fileToMerge), checks it for duplicates within the file and with the
+            column names already seen (seenColumns), and returns it.
+            The data to merge is read from a csv file, and must also be in the
+            Historical Trend data format (-t).
+
+            Since this file format has independent time/value pairs
+            in columns going to the right, the time/value pairs of the file are
+            simply added to the source tags, the same as the pairs of the input
+            file. There is no need to make a wider data frame with all the files.
+
+            If the file is entirely outside the start and end time (-si only), just
+            the header row is read, and the data frame has no rows.
+            """
+            try:
+                if self.window.fileOutside(fileToMerge, sep, encoding, self._toDatetime, pairs=True):
+                    # Nothing in the time range. Just read the header, so the tags
+                    # are still known.
+                    print('Skipping the data in file "' + fileToMerge + '". It is \
+outside the start and end time.\n')
+                    df_merge, mergeHeader = readHeaderTyped(fileToMerge, sep=sep,
+                                                            encoding=encoding,
+                                                            schema=trendSchema)
+                else:
+                    print('Merging file "' + fileToMerge + '".\n')
+                    # Read the columns directly into their types (see ftppSchema.py).
+                    # The header row is read by itself and used to name the columns, so
+                    # duplicate column names are preserved as is (no ".n" mangling).
+                    # mergeHeader is all the names in the header row.
+                    # Rows outside the start and end time are dropped as it is read.
+                    keepChunk = None
+                    if self.window.active:
+                        keepChunk = self.window.chunkFilter(self._toDatetime, pairs=True)
+                    df_merge, mergeHeader = self.readTyped(fileToMerge, sep=sep, encoding=encoding,
+                                                           schema=trendSchema, keepChunk=keepChunk,
+                                                           blocks=self._indexBlocks(fileToMerge))
+
+            except ValueError as ve:
+                _fail('ERROR when trying to merge: "' + fileToMerge + '".\n \
+Error opening file. Check file name, file presence, and permissions. \
+Unexpected encoding can also cause this error.',
+                      ve)
+
+            # Deal with duplicates in the merge file.
+            # Detect duplicates and warn.
+            dups = duplicateNames(df_merge)
+            if dups:
+                # duplicates have been found.  Notify and continue.
+                print('    WARNING: There are column names duplicated in the file "' + fileToMerge + '.\n \
+This is allowed, but if the duplicate column or columns \
+contain duplicate timestamps, then only one value will be retained. \n \
+The following tags column names are duplicated:')
+                print(dups)
+                print()
+
+            # Deal with duplicates between the source and merge file.
+            # Detect duplicates and warn.
+            dups = commonNames(seenColumns, df_merge)
+            if dups:
+                # duplicates have been found.  Notify and continue.
+                print('    WARNING: There are tags in the input file "' + args.inputFileName + '" that are duplicated\n\
 in the merge file "' + fileToMerge + '".\n\
 This is allowed, but if the duplicate column or columns contain duplicate timestamps,\n\
 then only one value will be retained.\nThe following tags are duplicated:')
-            print(dups)
-            print()
-
-        # Now merge the data. Append columns (axis = 1), keeping the header rows.
-        # There may be NaN values present when/if columns are diffenrent length.
-        # This isn't different than in the input file.
-        df_base = pd.concat([df_base, df_merge], axis=1, join='outer', sort=False)
-        # Drop the merge data as a matter of cleanup after it is maybe printed,
-        # and then return the merged data
+                print(dups)
+                print()
+
+            # print diagnostic info if verbose is set
+            if args.verbose:
+                print('**** Merge Data ****')
+                print(df_merge)
+
+            return df_merge
+            # end _tMerge()
+
+        # Internal function to parse the timestamps of a file. Put the internal
+        # definition here, as it only pertains to this file type.
+        def _trendTimes(tsCols):
+            """
+            Given the timestamp columns of a historical trend file, return a
+            tuple of the parsed timestamps of the rows which have one, as a long
+            table (a datetime series) of all the columns one after another, the
+            row number in the file of each, the start of each column in the long
+            table (with the end of the last one at the end), and the number of
+            the column each of the given columns is, as a list. Identical
+            timestamp columns (e.g. a trend export with synchronized tags) are
+            only put in the long table once. The padding rows of columns shorter
+            than the longest one are not put in it, and rows with an invalid
+            timestamp or outside the start and end time are dropped from it.
+            """
+            # Number the unique timestamp columns. Columns with the same number
+            # of timestamps, and the same first and last one, are compared to be
+            # sure they are the same.
+            uniqueCols = []
+            rowNums = []
+            colOf = []
+            colsByKey = {}
+            for tsCol in tsCols:
+                colRows = np.flatnonzero(tsCol.notna().values)
+                colKey = (len(colRows), tsCol.iat[colRows[0]], tsCol.iat[colRows[-1]]) \
+                    if len(colRows) else (0,)
+                for colNum in colsByKey.get(colKey, []):
+                    if uniqueCols[colNum].equals(tsCol):
+                        break
+                else:
+                    colNum = len(uniqueCols)
+                    uniqueCols.append(tsCol)
+                    rowNums.append(colRows)
+                    colsByKey.setdefault(colKey, []).append(colNum)
+                colOf.append(colNum)
+
+            # Stack the rows with a timestamp of the unique columns into the long
+            # table, and keep the row number of each.
+            colStarts = np.zeros(len(uniqueCols) + 1, dtype=np.int64)
+            colStarts[1:] = np.cumsum([len(colRows) for colRows in rowNums])
+            rawTs = pd.Series(np.concatenate([np.asarray(tsCol.values, dtype=object)[colRows]
+                                              for tsCol, colRows in zip(uniqueCols, rowNums)])
+                              if uniqueCols else np.empty(0, dtype=object))
+            rowNums = np.concatenate(rowNums) if rowNums else np.empty(0, dtype=np.int64)
+
+            # Parse the timestamps of the whole table at once.
+            # For changing to timestamps, coerce option for errors is marking
+            # dates after midnight (next day) as NaT.
+            # Not sure why. Try it with raise, first, and you get
+            # all the values. Put it in a try block, just in case an error is
+            # raised.
+            try:
+                ts = self.parseTimestamps(rawTs, errors='raise', timeFormat=self.sourceTimeFormat,
+                                          exact=False, origin='unix')
+            except ValueError as ve:
+                print('    WARNING: Problem converting some timestamps from \
+the source data.  Timestamps may be incorrect, and/or some rows may be missing.')
+                print(ve)
+                ts = self.parseTimestamps(rawTs, errors='coerce',
+                                          infer_datetime_format=True, origin='unix')
+            # Rround the timestamp to the nearest ms. Unseen ns and
+            # fractional ms values are not always displayed, and can cause
+            # unexpected merge and up/downsample results.
+            try:
+                ts = ts.dt.round('L')
+            except ValueError as ve:
+                print('    WARNING: Timestamp cannot be rounded.')
+                print(ve)
 
-        # print diagnostic info if verbose is set
-        if args.verbose:
-            print('**** Merge Data ****')
-            print(df_merge)
-            print('**** Merged Data ****')
-            print(df_base)
-
-        del df_merge
-        return df_base
-        # end _tMerge()
-
-    # If there are files specified to merge, merge them with the input file before
-    # further processing.
-    # Merge File 1
-    if args.archiveMerge1 is not None:
-        df_source = _tMerge(args.archiveMerge1, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 2
-    if args.archiveMerge2 is not None:
-        df_source = _tMerge(args.archiveMerge2, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 3
-    if args.archiveMerge3 is not None:
-        df_source = _tMerge(args.archiveMerge3, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 4
-    if args.archiveMerge4 is not None:
-        df_source = _tMerge(args.archiveMerge4, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # update the header list after the merge to make sure new tags are reflected.
-    headerList = df_source.columns.values.tolist()
-
-    # Loop thru the header list. Get the instrument name, create a data frame for
-    # each instrument, get the timestamp to be a datetime and the value to be a
-    # float, create a list of instruments and an list of TsIdxData objects (one
-    # per instrument).  If the instrument name is duplicated, the data sets are
-    # merged.
-    for idx in range(0, len(headerList), 2):
-        # For each header entry, make instrument and timestamp column names.
-        # Even indexes are timestamps, odd indexes are values.
-        # Get the inst name, leaving off the bit after the last space, which is
-        # normally 'Time' or 'ValueY'. If there is no space found, use the entire
-        # string as the instrument'a name.
-        # rpartition separates a string at the last separator,
-        # working from the right. Given a separator, rpartition returns a tuple:
-        #   The part before the separator, the separator, and the part after
-        #   the separator.  If the separator is not found, then the first two
-        #   elements are empty, and the third member contains the original string.
-        # member as the tag name -- this allows tag names with spaces to be
-        # preserved.
-        #
-        separated = headerList[idx].rpartition(' ')
-        if not separated[0]:
-            # No spaces in the header entry. Use the entire thing as the inst name.
-            instName = separated[2]
-        else:
-            # Use the first part before the leftmost space as the inst name
-            instName = separated[0]
-
-        # replace the spaces, hyphens, and periods with underscores
-        instName = instName.replace(' ', '_')
-        instName = instName.replace('-', '_')
-        instName = instName.replace('.', '_')
-        # Generate timestamp and value field (column) names.
-        # These will be used for the exported data.
-        # Include the instr name in the timestamp column label so it can be
-        # identified standalone
-        tsName = 'timestamp_' + instName
-        # Add the value prefix if it isn't there already.
-        # This is helpful when using an output file as an input file
-        valName = instName if instName.startswith('value') else 'value_' + instName
-        # print a message showing what we are processing
-        print('\nProcessing ' + instName)
-        # Create a new instrument object and use the above column names.
-        tid_inst = TsIdxData(instName, tsName, valName,
-                             df_source.iloc[:,[idx,idx+1]],
-                             args.valueQuery, startArg, endArg,
-                             sourceTimeFormat, forceColNames=True)
-        # See if instrument is already in the list. If so append the
-        # data to an existing instrument object already in the object list.
-        # If not, then append a new object with the new data to the name and
-        # object lists.
-        if instName in instDataNames:
-            # An instrument with the same name already exists.
-            # Append this data to it
-            idx = instDataNames.index(instName)
-            print('Inst in list at index ' + str(idx) + '. Appending data.')
-
-            # Appending the data will apply previously specified value queries
-            # and time filtering
-            instData[idx].appendData(tid_inst.data, 0) # don't ignore any rows
-        else:
-            # This instrument is not in the instrument list yet.
-            # Append it to the name list and the object list
-            print('Inst not yet seen. Appending new instrument to list of instruments.')
-            instDataNames.append(instName)
-            # Make an object with the instrument name, labels and data frame
-            # instrument data object, and append it to the list.
-            # Querying of value and filtering of timestamps will happen during
-            # construction of the object
-            instData.append(tid_inst)
-
-        # The instrument data is now contained in the instrument InstData object.
-        # Delete the instrument object to free up resources.
-        del tid_inst
-
-    # The data is now in instData in data frames. Done with the source data. Delete it.
-    del df_source
-
-elif args.a and len(headerList) >= 6:
-    # archive data, and at least the expected number of columns are present
-    # The data is expected to these columns:
-    #     [0] TagId
-    #     [1] TagName
-    #     [2] Timestamp
-    #     [3] DataSource
-    #     [4] Value
-    #     [5] Quality
-    print('\nArchive data file specified. The data is expected to be formatted as \
+            # Drop the rows without a valid timestamp, or outside the start and
+            # end time, and move the column starts to match.
+            keep = ts.notna().values
+            if self.window.active:
+                keep &= self.window.contains(ts)
+            if not keep.all():
+                # the number of rows kept before each column start
+                keptBefore = np.zeros(len(keep) + 1, dtype=np.int64)
+                keptBefore[1:] = np.cumsum(keep)
+                colStarts = keptBefore[colStarts]
+                ts = ts[keep]
+                rowNums = rowNums[keep]
+            return ts.values, rowNums, colStarts, colOf
+            # end _trendTimes()
+
+        # Internal function to add the time/value column pairs of a file to the
+        # source tags.
+        def _trendTags(df_trend, headers):
+            """
+            Given the data frame of a historical trend file, and its list of column
+            names (headers), add the time/value column pairs to the list of source
+            tags.
+            """
+            # Parse the timestamps of all the pairs at once (see _trendTimes()). The
+            # timestamps of each pair are then a contiguous slice of the long table.
+            pairStarts = range(0, len(headers), 2)
+            ts, rowNums, colStarts, colOf = _trendTimes([df_trend.iloc[:, idx]
+                                                         for idx in pairStarts])
+            # Loop thru the header list. Get the instrument name, and make a timestamp
+            # indexed data frame with float values for each time/value column pair.
+            # These are added to the list of source tags, and the instruments are made
+            # from the list further below.
+            for pairNum, idx in enumerate(pairStarts):
+                # For each header entry, make instrument and timestamp column names.
+                # Even indexes are timestamps, odd indexes are values.
+                # Get the inst name, leaving off the bit after the last space, which is
+                # normally 'Time' or 'ValueY'. If there is no space found, use the entire
+                # string as the instrument'a name.
+                # rpartition separates a string at the last separator,
+                # working from the right. Given a separator, rpartition returns a tuple:
+                #   The part before the separator, the separator, and the part after
+                #   the separator.  If the separator is not found, then the first two
+                #   elements are empty, and the third member contains the original string.
+                # member as the tag name -- this allows tag names with spaces to be
+                # preserved.
+                #
+                separated = headers[idx].rpartition(' ')
+                if not separated[0]:
+                    # No spaces in the header entry. Use the entire thing as the inst name.
+                    instName = separated[2]
+                else:
+                    # Use the first part before the leftmost space as the inst name
+                    instName = separated[0]
+
+                # Take the values of the rows in the slice of the long table, with
+                # the value column converted to numbers. Integer columns stay
+                # integers, so each tag is converted by itself.
+                colNum = colOf[pairNum]
+                rows = slice(colStarts[colNum], colStarts[colNum + 1])
+                tsCol = df_trend.iloc[:, idx]
+                valCol = df_trend.iloc[:, idx + 1]
+                srcTags.append((_instNameOf(instName),
+                                pd.DataFrame({valCol.name: pd.to_numeric(valCol, errors='coerce')
+                                                           .values[rowNums[rows]]},
+                                             index=pd.DatetimeIndex(ts[rows], name=tsCol.name))))
+            # end _trendTags()
+
+        _trendTags(df_source, headerList)
+        # The input file data is now in the source tag list. Done with it. Delete it.
+        del df_source
+
+        # If there are files specified to merge, add the time/value pairs of each
+        # of them to the source tags the same way, one file at a time. Pairs for
+        # the same instrument are combined when the instruments are made below.
+        seenColumns = set(headerList)
+        for fileToMerge in self.mergeFiles:
+            df_merge = _tMerge(fileToMerge, seenColumns,
+                               sep=args.sourceDelimiter, encoding=args.sourceEncoding)
+            seenColumns.update(df_merge.columns.values.tolist())
+            _trendTags(df_merge, df_merge.columns.values.tolist())
+            del df_merge
+        return srcTags
+
+    def _archiveSource(self):
+        """
+        Read and parse the archive data (-a) input and merge files, and return
+        the list of source tags, or None if the input file does not have the
+        archive data columns.
+        """
+        args = self.args
+        df_source, _, headerList = self._readInput()
+        self.profiler.start('parse')
+        if len(headerList) < 6:
+            return None
+        # archive data, and at least the expected number of columns are present
+        # The data is expected to these columns:
+        #     [0] TagId
+        #     [1] TagName
+        #     [2] Timestamp
+        #     [3] DataSource
+        #     [4] Value
+        #     [5] Quality
+        print('\nArchive data file specified. The data is expected to be formatted as \
 follows:\n    TagId, TagName, Timestamp (YYYY-MM-DD HH:MM:SS.mmm), DataSource, Value, Quality\n\
 Where normally there are multiple tags each at multiple timestamps. Timestamps are \
 not necessarily synchronized.\n')
+        srcTags = []
 
-    # Deal with duplicates in the input file.
-    # Duplicates with this data format within the same file are problematic
-    # because they don't make sense, and are an indicator of invalid source
-    # data. Message out and punt.
-    dups = listDuplicates(df_source)
-    if dups:
-        # duplicates have been found.  Notify leave.
-        print('    ERROR: There are column names duplicated in the input file "' + args.inputFileName + '".\n\
-This is not allowed with this type of data because it does not make sense.\n\
-There will be no further processing.\nThe following column names are duplicated:')
-        print(dups)
-        quit()
-
-    # Define a function to merge specified files. Put the internal definition
-    # here, as if only pertains to this file type, and so it can be seen and
-    # understood before use.
-    def _aMerge(fileToMerge, df_base, sep, encoding):
-        """
-        This function merges data from the specified file name (fileToMerge)
-        with the base data (df_base), and returns the merged data.
-        The data to merge is read from a csv file, and must also be in the
-        archive data format (-a).
-
-        Since the file format has rows being unique on
-        TagId and Timestamp combo, this merge simply makes the source data longer
-        by appending rows (pd.concat with axis=0).
-        """
-        try:
-            print('Merging file "' + fileToMerge + '".\n')
-            # use string as the data type for all columns to prevent automatic
-            # datatype detection. We don't know ahead of time how many columns are
-            # being read in, so we don't yet know the types.
-            # We want duplicate column names to be preserved as in.
-            # They will get filtered out as duplicates later.
-            # The default behavior of read_csv is to append a ".n" to the column name
-            # where n is an integer value starting at 1 and incrementing up for each
-            # duplicate found. The problem with this is later, this gets interpreted as
-            # a different tag if using some options.
-            # COMPILER: mangle_dupe_cols=False is supposed to preserve the duplicate
-            # column names by turning off the mangling described above.
-            # It is "not supported yet" but is in the documentation for
-            # Pandas 0.22 and maybe earler as being a feature!!
-            # It throws a ValueError if used.  As a work around, don't use
-            # mangle_dupe_cols=False, and use header=None instead of header=0 in the
-            # read_csv function.  Then manually rename the columns using the 1st row
-            # of the csv.
-            df_merge = pd.read_csv(fileToMerge, sep=sep,
-                                delim_whitespace=False, encoding=encoding,
-                                header=None, dtype = str, skipinitialspace=True)
-                                # mangle_dupe_cols=False)
-            df_merge = df_merge.rename(columns=df_merge.iloc[0], copy=False).iloc[1:].reset_index(drop=True)
-
-        except ValueError as ve:
-            print('    ERROR opening the file specified with the -am1/archiveMerge1 \
-parameter: "' + fileToMerge + '".\n Check file name, file presence, and permissions.  \
-Unexpected encoding can also cause this error.')
-            print(ve)
-            quit()
-
-        # Deal with duplicates in the merge file.
+        # Deal with duplicates in the input file.
         # Duplicates with this data format within the same file are problematic
         # because they don't make sense, and are an indicator of invalid source
         # data. Message out and punt.
-        dups = listDuplicates(df_merge)
+        # Check the whole header row, since not all the columns are read.
+        dups = duplicateNames(headerList)
         if dups:
             # duplicates have been found.  Notify leave.
-            print('    ERROR: There are column names duplicated in the file "' + fileToMerge + '" specified \
+            _fail('    ERROR: There are column names duplicated in the input file "' + args.inputFileName + '".\n\
+This is not allowed with this type of data because it does not make sense.\n\
+There will be no further processing.\nThe following column names are duplicated:',
+                  dups)
+
+        # Define a function to merge specified files. Put the internal definition
+        # here, as if only pertains to this file type, and so it can be seen and
+        # understood before use.
+        def _aMerge(fileToMerge, sep, encoding):
+            """
+            This function reads the data to merge from the specified file name
+            (fileToMerge), checks it for duplicate column names, and returns it.
+            The data to merge is read from a csv file, and must also be in the
+            archive data format (-a).
+
+            Since the file format has rows being unique on
+            TagId and Timestamp combo, the data is merged per tag with the data
+            of the input file and the other merge files.
+            """
+            try:
+                print('Merging file "' + fileToMerge + '".\n')
+                # Read the columns directly into their types (see ftppSchema.py).
+                # The header row is read by itself and used to name the columns, so
+                # duplicate column names are preserved as is (no ".n" mangling).
+                # mergeHeader is all the names in the header row.
+                df_merge, mergeHeader = self.readTyped(fileToMerge, sep=sep, encoding=encoding,
+                                                       schema=archiveSchema,
+                                                       blocks=self._indexBlocks(fileToMerge))
+
+            except ValueError as ve:
+                _fail('    ERROR opening the file specified with the -am1/archiveMerge1 \
+parameter: "' + fileToMerge + '".\n Check file name, file presence, and permissions.  \
+Unexpected encoding can also cause this error.',
+                      ve)
+
+            # Deal with duplicates in the merge file.
+            # Duplicates with this data format within the same file are problematic
+            # because they don't make sense, and are an indicator of invalid source
+            # data. Message out and punt.
+            dups = duplicateNames(mergeHeader)
+            if dups:
+                # duplicates have been found.  Notify leave.
+                _fail('    ERROR: There are column names duplicated in the file "' + fileToMerge + '" specified \
 with the -am1/archiveMerge1 parameter.\nThis is not allowed with this type of data because it does not make sense.\n\
-There will be no further processing.\nThe following column names are duplicated:')
-            print(dups)
-            quit()
+There will be no further processing.\nThe following column names are duplicated:',
+                      dups)
+
+            # Deal with duplicates between the source and merge file.
+            # This is expected (necessary) with this data type. Nothing to do.
+
+            # print diagnostic info if verbose is set
+            if args.verbose:
+                print('**** Merge Data ****')
+                print(df_merge)
+
+            return df_merge
+            # end _aMerge()
+
+        if args.chunkSize or args.memoryMap:
+            # Stream the archive data. Read the input file, and then any files to
+            # merge, a chunk of rows at a time. Each chunk is converted to typed
+            # TagId, Timestamp, and Value data and accumulated per tag, so the raw
+            # string data for the whole file is never held in memory at once.
+            # Reading the files in order and keeping the last duplicate gives the
+            # same result as the _aMerge() concatenation below.
+            if args.memoryMap:
+                print('Reading archive data by scanning the memory mapped files.\n')
+            else:
+                print('Reading archive data in chunks of ' + str(args.chunkSize) + ' rows.\n')
+            # Rows outside the start and end time are dropped as each chunk is read.
+            accumulator = ArchiveTagAccumulator(self.sourceTimeFormat, verbose=args.verbose,
+                                                window=self.window)
+
+            # Internal function to read an archive file into the accumulator. Put the
+            # internal definition here, as it only pertains to this case.
+            def _accumulate(fileName):
+                """
+                Read the archive file into the accumulator. A ValueError is raised
+                if the file cannot be read.
+                """
+                if args.memoryMap:
+                    # The rows of the tags not wanted can be dropped as they are
+                    # scanned, unless the cache is to keep all of them.
+                    accumulator.mapFile(fileName, sep=args.sourceDelimiter,
+                                        encoding=args.sourceEncoding,
+                                        blocks=self._indexBlocks(fileName),
+                                        wantTag=self._wantTag if self.parseCache is None else None)
+                else:
+                    accumulator.readFile(fileName, sep=args.sourceDelimiter,
+                                         encoding=args.sourceEncoding,
+                                         chunkRows=args.chunkSize,
+                                         blocks=self._indexBlocks(fileName))
+
+            # The archive rows are converted as they are read, so time both as
+            # reading in the profile.
+            _accumulate = self.profiler.timed('read', _accumulate)
 
-        # Deal with duplicates between the source and merge file.
-        # This is expected (necessary) with this data type. Nothing to do.
+            try:
+                _accumulate(args.inputFileName)
+            except ValueError as ve:
+                _fail('ERROR opening source file: "' + args.inputFileName + '". Check file \
+name, file presence, and permissions. Unexpected encoding can also cause this \
+error.',
+                      ve)
+
+            for fileToMerge in self.mergeFiles:
+                print('Merging file "' + fileToMerge + '".\n')
+                try:
+                    # Deal with duplicates in the merge file header, the same as
+                    # _aMerge() does.
+                    dups = duplicateNames(readHeader(fileToMerge, sep=args.sourceDelimiter,
+                                                     encoding=args.sourceEncoding))
+                    if dups:
+                        # duplicates have been found.  Notify leave.
+                        _fail('    ERROR: There are column names duplicated in the file "' + fileToMerge + '" specified \
+with the -amx/archiveMergex parameter.\nThis is not allowed with this type of data because it does not make sense.\n\
+There will be no further processing.\nThe following column names are duplicated:',
+                              dups)
+                    _accumulate(fileToMerge)
+                except ValueError as ve:
+                    _fail('    ERROR opening the file specified with the -amx/archiveMergex \
+parameter: "' + fileToMerge + '".\n Check file name, file presence, and permissions.  \
+Unexpected encoding can also cause this error.',
+                          ve)
 
-        # Now merge the data. Append rows (axis = 0), ignoring overlapping
-        # index (row numbers)
-        df_base = pd.concat([df_base, df_merge], axis=0,
-                              ignore_index=True, join='outer', sort=False)
-        # Drop the merge data as a matter of cleanup after it is maybe printed,
-        # and then return the merged data
+            print('    ' + str(accumulator.rowsRead) + ' rows read, ' +
+                  str(accumulator.rowsKept) + ' rows with a valid TagId and Timestamp kept.')
+            self.profiler.addRows('read', rowsOut=accumulator.rowsRead)
 
-        # print diagnostic info if verbose is set
-        if args.verbose:
-            print('**** Merge Data ****')
-            print(df_merge)
-            print('**** Merged Data ****')
-            print(df_base)
-
-        del df_merge
-        return df_base
-        # end _aMerge()
-
-    # If there are files specified to merge, merge them with the input file before
-    # further processing.
-    # Merge File 1
-    if args.archiveMerge1 is not None:
-        df_source = _aMerge(args.archiveMerge1, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 2
-    if args.archiveMerge2 is not None:
-        df_source = _aMerge(args.archiveMerge2, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 3
-    if args.archiveMerge3 is not None:
-        df_source = _aMerge(args.archiveMerge3, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 4
-    if args.archiveMerge4 is not None:
-        df_source = _aMerge(args.archiveMerge4, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-
-    # From the source data, create a data frame with just the
-    # tag id, tag name, time stamp, value
-    # where the tag id and time stamp is a multi-index
-    df_valData = df_source.drop(columns=[headerList[3], headerList[5]],
-                                inplace=False, errors='ignore')
-    # So sorting works as expected, before setting the indexes,
-    # set the tag id to an int, the value to a float, and the timestamp to a datetime
-    df_valData[headerList[0]] = df_valData[headerList[0]].astype('int',errors='ignore')
-    df_valData[headerList[4]] = df_valData[headerList[4]].astype('float',errors='ignore')
-    # force the timestamp to be a datetime
-    # coerce option for errors is marking dates after midnight (next
-    # day) as NaT. Not sure why. Try it with raise, first, and you get
-    # all the values. Put it in a try block, just in case an error is
-    # raised.
-    try:
-        df_valData[headerList[2]] = pd.to_datetime(df_valData[headerList[2]],
-                                                   errors='raise',
-                                                   format=sourceTimeFormat,
-                                                   exact=False,
-                                                   #infer_datetime_format = True,
-                                                   origin = 'unix')
-    except ValueError as ve:
-        print('    WARNING: Problem converting some timestamps from \
-the source data.  Timestamps may be incorrect, and/or some rows may be missing.')
-        print(ve)
-        df_valData[headerList[2]] = pd.to_datetime(df_valData[headerList[2]],
-                                                   errors='coerce',
-                                                   infer_datetime_format = True,
-                                                   origin = 'unix')
-
-
-    # Remove any NaN/NaT values as a result of conversion
-    df_valData.dropna(subset=[headerList[2]], how='any', inplace=True)
-    # Rround the timestamp to the nearest ms. Unseen ns and
-    # fractional ms values are not always displayed, and can cause
-    # unexpected merge and up/downsample results.
-    try:
-        df_valData[headerList[2]] = df_valData[headerList[2]].dt.round('L')
-    except ValueError as ve:
-        print('    WARNING: Timestamp cannot be rounded.')
-        print(ve)
-
-    # Get rid of any duplicate timestamps. Done after rounding in case rouding
-    # introduced dups.
-    df_valData.drop_duplicates(subset=[headerList[0],headerList[2]],
-                               keep='last', inplace=True)
-    # now set the index to a multi-index of TagId,Timestamp
-    df_valData.set_index([headerList[0],headerList[2]], inplace=True)
-    # sort the index for possible better performance later
-    df_valData.sort_index(inplace=True)
-
-    # print diagnostic info if verbose is set
-    if args.verbose:
-        print('**** df_valData ****')
-        print(df_valData)
-
-    # Now create a dataframe to hold a unique list of tag ids and tag names.
-    df_tagList = df_source.drop(columns=[headerList[2],headerList[3],
-                                         headerList[4],headerList[5]],
-                                inplace=False, errors='ignore')
-    # force the id column datatype to an int
-    df_tagList[headerList[0]] = df_tagList[headerList[0]].astype('int',errors='ignore')
-    # drop any NaN/NaT values
-    df_tagList.dropna(how='any', inplace=True)
-    # Drop the duplicate ids
-    df_tagList.drop_duplicates(subset=headerList[0], keep='first', inplace=True)
-    # Set the index to the tagId
-    df_tagList.set_index(headerList[0], inplace=True)
-    # sort the index for possible better performance later
-    df_tagList.sort_index(inplace=True)
-
-    # print diagnostic info if verbose is set
-    if args.verbose:
-        print('**** df_tagList ****')
-        print(df_tagList)
-
-    # done with the source data. Delete it.
-    del df_source
-
-    # Now we have a sorted list of tags and a dataframe full of values.
-    # Go thru the tag list and make an intrument for each tag with the data.
-    # The TsIdxData object is used for each instruments data.
-    for trow in df_tagList.itertuples(index=True, name=None):
-        # itertuples will return a tuple (id, tagname) for a row
-        # For tag, get the id and the name.
-        instId = trow[0]
-        instName = trow[1]
-        # replace the spaces, hyphens, and periods with underscores
-        instName = instName.replace(' ', '_')
-        instName = instName.replace('-', '_')
-        instName = instName.replace('.', '_')
-        #print a message showing what we are processing
-        print('\nProcessing ' + instName)
-        # generate timestamp and value field (column) names
-        # include the instr name in the timestamp column label so it can be
-        # identified standalone
-        tsName = 'timestamp_' + instName
-        # Add the value prefix if it isn't there already.
-        # This is helpful when using an output file as an input file
-        valName = instName if instName.startswith('value') else 'value_' + instName
-        # create a new dataframe for the instrument. Use the id index to get
-        # all the timestamped values for the current id. No need for the
-        # tag name (it is the same for every row, and captured above, so leave
-        # it out.
-        # Create a new instrument object and use the above column names.
-        # Use the id index to get all the timestamped values for the current
-        # id. No need for the tag name (it is the same for every row, and
-        # captured above, so leave it out.
-        tid_inst = TsIdxData(instName, tsName, valName,
-                             df_valData.loc[(instId, ), headerList[4]:],
-                             args.valueQuery, startArg, endArg,
-                             sourceTimeFormat, forceColNames=True)
-
-        # See if instrument is already in the list. If so append the
-        # data to an existing instrument object already in the object list.
-        # If not, then append a new object with the new data to the name and
-        # object lists.
-        if instName in instDataNames:
-            # An instrument with the same name already exists.
-            # Append this data to it
-            idx = instDataNames.index(instName)
-            print('Inst in list at index ' + str(idx) + '. Appending data.')
-            # Appending the data will apply previously specified value queries
-            # and time filtering
-            instData[idx].appendData(tid_inst.data, 0) # don't ignore any rows
-        else:
-            # This instrument is not in the instrument list yet.
-            # Append it to the name list and the object list
-            print('Inst not yet seen. Appending new instrument to list of instruments.')
-            instDataNames.append(instName)
-            # Make an object with the instrument name, labels and data frame
-            # instrument data object, and append it to the list.
-            # Querying of value and filtering of timestamps will happen during
-            # construction of the object
-            instData.append(tid_inst)
-
-        # the instrument data is now captured in the InstData objects.
-        # delete it to free up resources.
-        del tid_inst
-
-    # The value data for all the instruments is now captured in the InstData objects.
-    # Delete the valData and the tagList dataframes to free up resources.
-    del df_valData
-    del df_tagList
-
-elif args.n and len(headerList) >= 3:
-    # normalized time data, and there is at least 1 instrument worth of data.
-    # The data is expected to have these columns:
-    #     [0] Timestamp
-    #     [1] Time Bias
-    #     [2] Tag 1 Value
-    #     ...
-    #     [n+1] Tag n Value
-
-    # In the normalized time data case, the first column is the timestamp, and
-    # every column after the 3rd is instrument data headered with the instrument
-    # name.
-    print('\nNormalized Time Data Specified. The source data is expected to \
-have the following format:\n\
-    TimeStamp, Time Bias, Tag1 Value, Tag2 Value, ...\n')
+            # sorted list of (tag id, tag name) tuples
+            tagList = accumulator.tagList()
 
-    # Deal with duplicates in input file.
-    # Duplicates with this data format within the same file are problematic
-    # because they represent a tag with more than one value at the same timestamp.
-    # While this could be delt with when merging, it is an indication that the
-    # data may not be as expected. Error out so a person needs to take a look.
-    dups = listDuplicates(df_source)
-    if dups:
-        # duplicates have been found.  Notify leave.
-        print('    ERROR: There are column names duplicated in the input file "' + args.inputFileName + '".\n\
-This is not allowed with this type of data because it usually means ambiguous tag values.\n\
-There will be no further processing.\nThe following column names are duplicated:')
-        print(dups)
-        quit()
-
-    # Index the source data time stamp column. Since we know this will be the
-    # index in this case, do this early so we can take advantage of it later.
-    # First make sure the timesamp can be converted to a datetime.
-    tsName = df_source.columns[0]
-    if 'datetime64[ns]' != df_source[tsName].dtype:
-        # For changing to timestamps, coerce option for errors is marking
-        # dates after midnight (next day) as NaT.
-        # Not sure why. Try it with raise, first, and you get
-        # all the values. Put it in a try block, just in case an error is
-        # raised.
-        try:
-            df_source[tsName] = pd.to_datetime(df_source[tsName],
-                                            errors='raise',
-                                            format=sourceTimeFormat,
-                                            exact=False,
-                                            #infer_datetime_format = True,
-                                            origin = 'unix')
-        except ValueError as ve:
-            print('    WARNING: Problem converting some timestamps from \
-the source data.  Timestamps may be incorrect, and/or some rows may be missing.')
-            print(ve)
-            df_source[tsName] = pd.to_datetime(df_source[tsName],
-                                            errors='coerce',
-                                            infer_datetime_format = True,
-                                            origin = 'unix')
-    # Remove any NaN/NaT values as a result of conversion
-    df_source.dropna(subset=[tsName], how='any', inplace=True)
-    # Rround the timestamp to the nearest ms. Unseen ns and
-    # fractional ms values are not always displayed, and can cause
-    # unexpected merge and up/downsample results.
-    try:
-        df_source[tsName] = df_source[tsName].dt.round('L')
-    except ValueError as ve:
-        print('    WARNING: Timestamp cannot be rounded.')
-        print(ve)
-
-    # Get rid of any duplicate timestamps. Done after rounding in case rounding
-    # introduced dups.
-    df_source.drop_duplicates(subset=[tsName], keep='last', inplace=True)
-    # set the timestamp column to be the index
-    df_source.set_index(tsName, inplace=True)
-    # sort the index for possible better performance later
-    df_source.sort_index(inplace=True)
-
-    # Define a function to merge specified files. Put the internal definition
-    # here, as if only pertains to this file type, and so it can be seen and
-    # understood before use.
-    def _nMerge(fileToMerge, df_base, sep, encoding):
+            # print diagnostic info if verbose is set
+            if args.verbose:
+                print('**** tagList ****')
+                print(tagList)
+
+            def _tagData(instId):
+                """
+                Return the timestamp indexed value data for the tag id. The
+                accumulated data for the tag is released as it is returned.
+                """
+                return accumulator.popTagData(instId, headerList[2], headerList[4])
+
+        else:
+            # Internal function to make the typed, sorted value data of one archive
+            # file. Put the internal definition here, as it only pertains to this
+            # case.
+            def _aPrepare(df_raw):
+                """
+                Given the data frame of an archive file (df_raw), return a tuple of
+                the sorted list of (tag id, tag name) tuples, a dictionary of
+                tag id -> (start, stop) rows, and the value data frame. The value
+                data is sorted by tag id and timestamp, so the rows for a tag are
+                the contiguous slice [start:stop].
+                """
+                # From the source data, create a data frame with just the
+                # tag id, tag name, time stamp, value
+                # where the tag id and time stamp is a multi-index
+                df_valData = df_raw.drop(columns=[headerList[3], headerList[5]],
+                                            inplace=False, errors='ignore')
+                # So sorting works as expected, before setting the indexes,
+                # set the tag id to an int, the value to a float, and the timestamp to a datetime
+                df_valData[headerList[0]] = df_valData[headerList[0]].astype('int',errors='ignore')
+                df_valData[headerList[4]] = df_valData[headerList[4]].astype('float',errors='ignore')
+                # force the timestamp to be a datetime
+                # coerce option for errors is marking dates after midnight (next
+                # day) as NaT. Not sure why. Try it with raise, first, and you get
+                # all the values. Put it in a try block, just in case an error is
+                # raised.
+                try:
+                    df_valData[headerList[2]] = self.parseTimestamps(df_valData[headerList[2]],
+                                                                     errors='raise',
+                                                                     timeFormat=self.sourceTimeFormat,
+                                                                     exact=False,
+                                                                     #infer_datetime_format = True,
+                                                                     origin = 'unix')
+                except ValueError as ve:
+                    print('    WARNING: Problem converting some timestamps from \
+    the source data.  Timestamps may be incorrect, and/or some rows may be missing.')
+                    print(ve)
+                    df_valData[headerList[2]] = self.parseTimestamps(df_valData[headerList[2]],
+                                                                     errors='coerce',
+                                                                     infer_datetime_format = True,
+                                                                     origin = 'unix')
+
+
+                # Remove any NaN/NaT values as a result of conversion
+                df_valData.dropna(subset=[headerList[2]], how='any', inplace=True)
+                # Rround the timestamp to the nearest ms. Unseen ns and
+                # fractional ms values are not always displayed, and can cause
+                # unexpected merge and up/downsample results.
+                try:
+                    df_valData[headerList[2]] = df_valData[headerList[2]].dt.round('L')
+                except ValueError as ve:
+                    print('    WARNING: Timestamp cannot be rounded.')
+                    print(ve)
+                # Drop the rows outside the start and end time. The tag list below
+                # is made from all the rows, so every tag is still found.
+                if self.window.active:
+                    df_valData = df_valData[self.window.contains(df_valData[headerList[2]])]
+
+                # Get rid of any duplicate timestamps. Done after rounding in case rouding
+                # introduced dups.
+                df_valData.drop_duplicates(subset=[headerList[0],headerList[2]],
+                                           keep='last', inplace=True)
+                # Sort once by TagId and Timestamp, so the rows for each tag are
+                # contiguous and in time order. The rows for a tag can then be handed
+                # out as a slice, rather than looked up in a multi-index for every tag.
+                df_valData.sort_values([headerList[0],headerList[2]], inplace=True)
+                # Find the start and stop row of each tag in one pass
+                tagIds, tagStarts, tagStops = groupBoundaries(df_valData[headerList[0]].values)
+                tagBounds = dict(zip(tagIds.tolist(), zip(tagStarts, tagStops)))
+                # Keep just the value column, indexed by timestamp
+                df_valData = df_valData[[headerList[4]]].set_index(
+                                pd.DatetimeIndex(df_valData[headerList[2]], name=headerList[2]))
+
+                # print diagnostic info if verbose is set
+                if args.verbose:
+                    print('**** df_valData ****')
+                    print(df_valData)
+
+                # Now create a dataframe to hold a unique list of tag ids and tag names.
+                df_tagList = df_raw.drop(columns=[headerList[2],headerList[3],
+                                                     headerList[4],headerList[5]],
+                                            inplace=False, errors='ignore')
+                # force the id column datatype to an int
+                df_tagList[headerList[0]] = df_tagList[headerList[0]].astype('int',errors='ignore')
+                # drop any NaN/NaT values
+                df_tagList.dropna(how='any', inplace=True)
+                # Drop the duplicate ids
+                df_tagList.drop_duplicates(subset=headerList[0], keep='first', inplace=True)
+                # Set the index to the tagId
+                df_tagList.set_index(headerList[0], inplace=True)
+                # sort the index for possible better performance later
+                df_tagList.sort_index(inplace=True)
+
+                # print diagnostic info if verbose is set
+                if args.verbose:
+                    print('**** df_tagList ****')
+                    print(df_tagList)
+
+                # sorted list of (tag id, tag name) tuples
+                # itertuples will return a tuple (id, tagname) for a row
+                tagList = list(df_tagList.itertuples(index=True, name=None))
+                del df_tagList
+                return tagList, tagBounds, df_valData
+                # end _aPrepare()
+
+            tagList, tagBounds, df_valData = _aPrepare(df_source)
+
+            def _tagData(instId):
+                """
+                Return the timestamp indexed value data for the tag id. The rows for
+                the tag are a contiguous slice of the sorted value data. No need
+                for the tag name (it is the same for every row, and captured above,
+                so leave it out.
+                """
+                start, stop = tagBounds.get(instId, (0, 0))
+                return df_valData.iloc[start:stop]
+
+            # If there are files specified to merge, prepare each of them the same
+            # way, one file at a time, and merge the data per tag. Each file's data
+            # for a tag is already sorted by time, so the sorted runs are merged
+            # (see ftppMerge.py), and for a duplicated tag id and timestamp
+            # the value from the last file is kept. This is the same as appending
+            # all the files and dropping the duplicates, without ever making the
+            # appended data.
+            if self.mergeFiles:
+                merger = TagMerger()
+                tagNames = {}
+
+                def _mergeTags(tagList, tagBounds, df_valData):
+                    """
+                    Add the prepared data of one file to the tag merger.
+                    """
+                    for instId, instName in tagList:
+                        # Use the first tag name found for the id
+                        tagNames.setdefault(instId, instName)
+                    for instId, (start, stop) in tagBounds.items():
+                        merger.add(instId, df_valData.iloc[start:stop])
+                    # end _mergeTags()
+
+                _mergeTags(tagList, tagBounds, df_valData)
+                del tagBounds, df_valData
+                for fileToMerge in self.mergeFiles:
+                    df_merge = _aMerge(fileToMerge, sep=args.sourceDelimiter,
+                                       encoding=args.sourceEncoding)
+                    _mergeTags(*_aPrepare(df_merge))
+                    del df_merge
+
+                # sorted list of (tag id, tag name) tuples
+                tagList = sorted(tagNames.items())
+
+                def _tagData(instId):
+                    """
+                    Return the merged timestamp indexed value data for the tag id.
+                    The data for the tag is released as it is returned.
+                    """
+                    return merger.pop(instId, headerList[2], headerList[4])
+
+        # done with the source data. Delete it.
+        del df_source
+
+        # Add the tags found in the block indexes which had no rows read (see
+        # _indexBlocks()), so they are still in the output. Their data is empty.
+        if self.indexTags:
+            knownTags = dict(tagList)
+            for instId, instName in self.indexTags.items():
+                knownTags.setdefault(instId, instName)
+            tagList = sorted(knownTags.items())
+
+        # Now we have a sorted list of tags and a way to get the values for each.
+        # Go thru the tag list and add the data for each tag to the list of source
+        # tags. The instruments are made from the list further below.
+        for instId, instName in tagList:
+            srcTags.append((_instNameOf(instName), _tagData(instId)))
+        return srcTags
+
+    def _normalizedSource(self):
         """
-        This function merges data from the specified file name (fileToMerge)
-        with the base data (df_base), and returns the merged data.
-        The data to merge is read from a csv file, and must also be in the
-        time normalized data format (-n).
-
-        The file to merge has times and tags that may match or may be additional
-        to the source data. The data merge will make the source data wider if
-        there are new tags, and longer if there are new times. One or both may
-        happen.
+        Read and parse the time normalized (-n) input and merge files, and
+        return the list of source tags, or None if the input file does not
+        have a value column.
         """
-        try:
-            print('Merging file "' + fileToMerge + '".\n')
-            # use string as the data type for all columns to prevent automatic
-            # datatype detection. We don't know ahead of time how many columns are
-            # being read in, so we don't yet know the types.
-            # We want duplicate column names to be preserved as in.
-            # They will get filtered out as duplicates later.
-            # The default behavior of read_csv is to append a ".n" to the column name
-            # where n is an integer value starting at 1 and incrementing up for each
-            # duplicate found. The problem with this is later, this gets interpreted as
-            # a different tag if using some options.
-            # COMPILER: mangle_dupe_cols=False is supposed to preserve the duplicate
-            # column names by turning off the mangling described above.
-            # It is "not supported yet" but is in the documentation for
-            # Pandas 0.22 and maybe earler as being a feature!!
-            # It throws a ValueError if used.  As a work around, don't use
-            # mangle_dupe_cols=False, and use header=None instead of header=0 in the
-            # read_csv function.  Then manually rename the columns using the 1st row
-            # of the csv.
-            df_merge = pd.read_csv(fileToMerge, sep=sep,
-                                delim_whitespace=False, encoding=encoding,
-                                header=None, dtype = str, skipinitialspace=True)
-                                # mangle_dupe_cols=False)
-            df_merge = df_merge.rename(columns=df_merge.iloc[0], copy=False).iloc[1:].reset_index(drop=True)
-
-        except ValueError as ve:
-            print('ERROR opening the file specified with the -amx/archiveMergex \
-parameter: "' + fileToMerge + '".\n Check file name, file presence, and permissions.  \
-Unexpected encoding can also cause this error.')
-            print(ve)
-            quit()
+        args = self.args
+        df_source, _, headerList = self._readInput()
+        self.profiler.start('parse')
+        if len(headerList) < 3:
+            return None
+        # normalized time data, and there is at least 1 instrument worth of data.
+        # The data is expected to have these columns:
+        #     [0] Timestamp
+        #     [1] Time Bias
+        #     [2] Tag 1 Value
+        #     ...
+        #     [n+1] Tag n Value
+
+        # In the normalized time data case, the first column is the timestamp, and
+        # every column after the 3rd is instrument data headered with the instrument
+        # name.
+        print('\nNormalized Time Data Specified. The source data is expected to \
+have the following format:\n\
+    TimeStamp, Time Bias, Tag1 Value, Tag2 Value, ...\n')
+        srcTags = []
 
-        # Deal with duplicates in the merge file.
+        # Deal with duplicates in input file.
         # Duplicates with this data format within the same file are problematic
         # because they represent a tag with more than one value at the same timestamp.
         # While this could be delt with when merging, it is an indication that the
         # data may not be as expected. Error out so a person needs to take a look.
-        dups = listDuplicates(df_merge)
+        # Check the whole header row, since the Bias column is not read.
+        dups = duplicateNames(headerList)
         if dups:
             # duplicates have been found.  Notify leave.
-            print('    ERROR: There are column names duplicated in the file "' + fileToMerge + '" specified \
-with the -amx/archiveMergex parameter.\nThis is not allowed with this type of data because it usually \
-means tag values would be ambiguous at a given time.\n\
-There will be no further processing.\nThe following column names are duplicated:')
-            print(dups)
-            quit()
-
-        # Deal with duplicates between the source and merge file.
-        # Delay this until further below, once the merge data has been indexed by
-        # timestamp. In other words, compare the columns for dups, not the timestamp
-        # column name.
+            _fail('    ERROR: There are column names duplicated in the input file "' + args.inputFileName + '".\n\
+This is not allowed with this type of data because it usually means ambiguous tag values.\n\
+There will be no further processing.\nThe following column names are duplicated:',
+                  dups)
 
-        # Index the merge data time stamp column. Since we know this will be the
+        # Index the source data time stamp column. Since we know this will be the
         # index in this case, do this early so we can take advantage of it later.
         # First make sure the timesamp can be converted to a datetime.
-        tsName = df_merge.columns[0]
-        if 'datetime64[ns]' != df_merge[tsName].dtype:
+        tsName = df_source.columns[0]
+        if 'datetime64[ns]' != df_source[tsName].dtype:
             # For changing to timestamps, coerce option for errors is marking
             # dates after midnight (next day) as NaT.
             # Not sure why. Try it with raise, first, and you get
             # all the values. Put it in a try block, just in case an error is
             # raised.
             try:
-                df_merge[tsName] = pd.to_datetime(df_merge[tsName],
-                                                errors='raise',
-                                                format=sourceTimeFormat,
-                                                exact=False,
-                                                #infer_datetime_format = True,
-                                                origin = 'unix')
+                df_source[tsName] = self.parseTimestamps(df_source[tsName],
+                                                         errors='raise',
+                                                         timeFormat=self.sourceTimeFormat,
+                                                         exact=False,
+                                                         #infer_datetime_format = True,
+                                                         origin = 'unix')
             except ValueError as ve:
                 print('    WARNING: Problem converting some timestamps from \
-    the data to merge.  Timestamps may be incorrect, and/or some rows may be missing.')
+the source data.  Timestamps may be incorrect, and/or some rows may be missing.')
                 print(ve)
-                df_merge[tsName] = pd.to_datetime(df_merge[tsName],
-                                                errors='coerce',
-                                                infer_datetime_format = True,
-                                                origin = 'unix')
+                df_source[tsName] = self.parseTimestamps(df_source[tsName],
+                                                         errors='coerce',
+                                                         infer_datetime_format = True,
+                                                         origin = 'unix')
         # Remove any NaN/NaT values as a result of conversion
-        df_merge.dropna(subset=[tsName], how='any', inplace=True)
+        df_source.dropna(subset=[tsName], how='any', inplace=True)
         # Rround the timestamp to the nearest ms. Unseen ns and
         # fractional ms values are not always displayed, and can cause
         # unexpected merge and up/downsample results.
         try:
-            df_merge[tsName] = df_merge[tsName].dt.round('L')
+            df_source[tsName] = df_source[tsName].dt.round('L')
         except ValueError as ve:
             print('    WARNING: Timestamp cannot be rounded.')
             print(ve)
 
         # Get rid of any duplicate timestamps. Done after rounding in case rounding
         # introduced dups.
-        df_merge.drop_duplicates(subset=[tsName], keep='last', inplace=True)
+        df_source.drop_duplicates(subset=[tsName], keep='last', inplace=True)
         # set the timestamp column to be the index
-        df_merge.set_index(tsName, inplace=True)
+        df_source.set_index(tsName, inplace=True)
         # sort the index for possible better performance later
-        df_merge.sort_index(inplace=True)
+        df_source.sort_index(inplace=True)
+
+        # Define a function to merge specified files. Put the internal definition
+        # here, as if only pertains to this file type, and so it can be seen and
+        # understood before use.
+        def _nMerge(fileToMerge, seenColumns, sep, encoding):
+            """
+            This function reads the data to merge from the specified file name
+            (fileToMerge), and returns it indexed by timestamp. seenColumns is the
+            set of the tags read so far (input file and earlier merge files), and
+            is used to warn about duplicated tags.
+            The data to merge is read from a csv file, and must also be in the
+            time normalized data format (-n).
+
+            The file to merge has times and tags that may match or may be additional
+            to the source data. The data for each tag is merged with the data for
+            the same tag from the other files by the caller (see ftppMerge.py).
+
+            If the file is entirely outside the start and end time (-si only), just
+            the header row is read, and the data frame has no rows.
+            """
+            try:
+                if self.window.fileOutside(fileToMerge, sep, encoding, self._toDatetime):
+                    # Nothing in the time range. Just read the header, so the tags
+                    # are still known.
+                    print('Skipping the data in file "' + fileToMerge + '". It is \
+outside the start and end time.\n')
+                    df_merge, mergeHeader = readHeaderTyped(fileToMerge, sep=sep,
+                                                            encoding=encoding,
+                                                            schema=normalizedSchema)
+                else:
+                    print('Merging file "' + fileToMerge + '".\n')
+                    # Read the columns directly into their types (see ftppSchema.py).
+                    # The header row is read by itself and used to name the columns, so
+                    # duplicate column names are preserved as is (no ".n" mangling).
+                    # mergeHeader is all the names in the header row.
+                    # Rows outside the start and end time are dropped as it is read.
+                    keepChunk = None
+                    if self.window.active:
+                        keepChunk = self.window.chunkFilter(self._toDatetime)
+                    df_merge, mergeHeader = self.readTyped(fileToMerge, sep=sep, encoding=encoding,
+                                                           schema=normalizedSchema,
+                                                           keepChunk=keepChunk,
+                                                           blocks=self._indexBlocks(fileToMerge))
 
-        # Now that the source and merge data have both been indexed by timestamp,
-        # we can deal with duplicate value column names between the source and
-        # merge file.
-        # With this data format, this may or may not be problematic. If there
-        # are duplicated timestamps, they will get removed after merging.
-        # Detect duplicates and warn.
-        dups = listToListIntersection(df_base.columns.values, df_merge.columns.values)
-        if dups:
-            # duplicates have been found.  Notify and continue.
-            print('    WARNING: There are tags in the input file "' + args.inputFileName + '" that are duplicated\n\
-in the file "' + fileToMerge + '" specified with the -amx/archiveMergex parameter.\nThis is allowed, \
-but if the duplicate column or columns contain duplicate timestamps, then only \n\
-one value will be retained.\nThe following tags are duplicated:')
-            print(dups)
-            print()
+            except ValueError as ve:
+                _fail('ERROR opening the file specified with the -amx/archiveMergex \
+parameter: "' + fileToMerge + '".\n Check file name, file presence, and permissions.  \
+Unexpected encoding can also cause this error.',
+                      ve)
+
+            # Deal with duplicates in the merge file.
+            # Duplicates with this data format within the same file are problematic
+            # because they represent a tag with more than one value at the same timestamp.
+            # While this could be delt with when merging, it is an indication that the
+            # data may not be as expected. Error out so a person needs to take a look.
+            dups = duplicateNames(mergeHeader)
+            if dups:
+                # duplicates have been found.  Notify leave.
+                _fail('    ERROR: There are column names duplicated in the file "' + fileToMerge + '" specified \
+with the -amx/archiveMergex parameter.\nThis is not allowed with this type of data because it usually \
+means tag values would be ambiguous at a given time.\n\
+There will be no further processing.\nThe following column names are duplicated:',
+                      dups)
+
+            # Deal with duplicates between the source and merge file.
+            # Delay this until further below, once the merge data has been indexed by
+            # timestamp. In other words, compare the columns for dups, not the timestamp
+            # column name.
+
+            # Index the merge data time stamp column. Since we know this will be the
+            # index in this case, do this early so we can take advantage of it later.
+            # First make sure the timesamp can be converted to a datetime.
+            tsName = df_merge.columns[0]
+            if 'datetime64[ns]' != df_merge[tsName].dtype:
+                # For changing to timestamps, coerce option for errors is marking
+                # dates after midnight (next day) as NaT.
+                # Not sure why. Try it with raise, first, and you get
+                # all the values. Put it in a try block, just in case an error is
+                # raised.
+                try:
+                    df_merge[tsName] = self.parseTimestamps(df_merge[tsName],
+                                                            errors='raise',
+                                                            timeFormat=self.sourceTimeFormat,
+                                                            exact=False,
+                                                            #infer_datetime_format = True,
+                                                            origin = 'unix')
+                except ValueError as ve:
+                    print('    WARNING: Problem converting some timestamps from \
+    the data to merge.  Timestamps may be incorrect, and/or some rows may be missing.')
+                    print(ve)
+                    df_merge[tsName] = self.parseTimestamps(df_merge[tsName],
+                                                            errors='coerce',
+                                                            infer_datetime_format = True,
+                                                            origin = 'unix')
+            # Remove any NaN/NaT values as a result of conversion
+            df_merge.dropna(subset=[tsName], how='any', inplace=True)
+            # Rround the timestamp to the nearest ms. Unseen ns and
+            # fractional ms values are not always displayed, and can cause
+            # unexpected merge and up/downsample results.
+            try:
+                df_merge[tsName] = df_merge[tsName].dt.round('L')
+            except ValueError as ve:
+                print('    WARNING: Timestamp cannot be rounded.')
+                print(ve)
 
-        # Now merge the data. Append rows (axis=0), which actually is appending
-        # to the index. Note that NaN values may result depending on which times
-        # and values are being merged, but these will get removed later.
-        df_base = pd.concat([df_base, df_merge], axis=0, sort=False)
-        # Drop the merge data as a matter of cleanup after it is maybe printed,
-        # and then return the merged data
+            # Get rid of any duplicate timestamps. Done after rounding in case rounding
+            # introduced dups.
+            df_merge.drop_duplicates(subset=[tsName], keep='last', inplace=True)
+            # set the timestamp column to be the index
+            df_merge.set_index(tsName, inplace=True)
+            # sort the index for possible better performance later
+            df_merge.sort_index(inplace=True)
+
+            # Now that the source and merge data have both been indexed by timestamp,
+            # we can deal with duplicate value column names between the source and
+            # merge file.
+            # With this data format, this may or may not be problematic. If there
+            # are duplicated timestamps, they will get removed after merging.
+            # Detect duplicates and warn.
+            dups = commonNames(seenColumns, df_merge.columns.values)
+            if dups:
+                # duplicates have been found.  Notify and continue.
+                print('    WARNING: There are tags in the input or earlier merge files that are duplicated\n\
+in the file "' + fileToMerge + '" specified to merge.\nThis is allowed, \
+but if the duplicate column or columns contain duplicate timestamps, then only \n\
+one value (from the file merged last) will be retained.\nThe following tags are duplicated:')
+                print(dups)
+                print()
+
+            # print diagnostic info if verbose is set
+            if args.verbose:
+                print('**** Merge Data ****')
+                print(df_merge)
+
+            return df_merge
+            # end _nMerge()
+
+        # At this point, the source data has this structure
+        # idx TimeStamp
+        # [0] Tag 1 Value
+        # ...
+        # [n] Tag n Value,
+        # and the header contains the tag names for the value columns.
+
+        if self.mergeFiles:
+            # There are files to merge. Keep the data per tag, from the input file
+            # and then each merge file in order, and merge each tag's time sorted
+            # data at the end (see ftppMerge.py). A later file wins when a tag has
+            # the same timestamp in more than one file.
+            merger = TagMerger()
+
+            def _mergeTags(df_data):
+                """
+                Add the float values of each value column of the timestamp indexed
+                data to the merger.
+                """
+                for idx in range(0, df_data.shape[1]):
+                    # skip the Bias column -- no op in this case
+                    if df_data.columns[idx] != 'Bias':
+                        # Merged values are always floats, the same as when the
+                        # files were appended (which left NaN gaps in the columns).
+                        merger.add(df_data.columns[idx],
+                                   pd.to_numeric(df_data.iloc[:, idx], errors='coerce')
+                                     .astype('float').to_frame())
+                # end _mergeTags()
+
+            _mergeTags(df_source)
+            seenColumns = set(df_source.columns.values.tolist())
+            del df_source
+            for fileToMerge in self.mergeFiles:
+                df_merge = _nMerge(fileToMerge, seenColumns=seenColumns,
+                                   sep=args.sourceDelimiter, encoding=args.sourceEncoding)
+                seenColumns.update(df_merge.columns.values.tolist())
+                _mergeTags(df_merge)
+                del df_merge
+
+            # The merged data for each tag goes to the source tag list, and the
+            # instruments are made from the list further below.
+            for instName in merger.tags():
+                srcTags.append((_instNameOf(instName), merger.pop(instName)))
 
-        # print diagnostic info if verbose is set
-        if args.verbose:
-            print('**** Merge Data ****')
-            print(df_merge)
-            print('**** Merged Data ****')
-            print(df_base)
-
-        del df_merge
-        return df_base
-        # end _nMerge()
-
-    # If there are files specified to merge, merge them with the input file before
-    # further processing.
-    # Merge File 1
-    if args.archiveMerge1 is not None:
-        df_source = _nMerge(args.archiveMerge1, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 2
-    if args.archiveMerge2 is not None:
-        df_source = _nMerge(args.archiveMerge2, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 3
-    if args.archiveMerge3 is not None:
-        df_source = _nMerge(args.archiveMerge3, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 4
-    if args.archiveMerge4 is not None:
-        df_source = _nMerge(args.archiveMerge4, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # At this point, the source data has this structure
-    # idx TimeStamp
-    # [0] Tag 1 Value
-    # ...
-    # [n] Tag n Value,
-    # and the header contains the tag names for the value columns.
-
-    # Update the header list after the merge to make sure new tags are reflected.
-    headerList = df_source.columns.values.tolist()
-
-    # Make sure the data is still sorted by time after the merge. This may be
-    # unnecessary, but just in case.
-    df_source.sort_index(inplace=True)
-
-    # Loop thru the header list. Get the instrument name, create a data frame for
-    # each instrument, get the value to be a float, create a list of
-    # instruments and an list of TsIdxData objects (one per instrument).
-    # If the instrument name is duplicated, the data sets are
-    # merged.
-    for idx in range(0, len(headerList)):
-        instName = headerList[idx]
-        # skip the Bias column -- no op in this case
-        if instName != 'Bias':
-            # replace the spaces, hyphens, and periods with underscores
-            instName = instName.replace(' ', '_')
-            instName = instName.replace('-', '_')
-            instName = instName.replace('.', '_')
-            # Generate timestamp and value field (column) names.
-            # These will be used for the exported data.
-            # Include the instr name in the timestamp column label so it can be
-            # identified standalone
-            tsName = 'timestamp_' + instName
-            # Add the value prefix if it isn't there already.
-            # This is helpful when using an output file as an input file
-            valName = instName if instName.startswith('value') else 'value_' + instName
-            # print a message showing what we are processing
-            print('\nProcessing ' + instName)
-            # Create a new instrument object and use the above column names.
-            tid_inst = TsIdxData(instName, tsName, valName,
-                                 df_source.iloc[:,idx],
-                                 args.valueQuery, startArg, endArg,
-                                 sourceTimeFormat, forceColNames=True)
-            # See if instrument is already in the list. If so append the
-            # data to an existing instrument object already in the object list.
-            # If not, then append a new object with the new data to the name and
-            # object lists.
-            if instName in instDataNames:
-                # An instrument with the same name already exists.
-                # Append this data to it
-                idx = instDataNames.index(instName)
-                print('Inst in list at index ' + str(idx) + '. Appending data.')
-
-                # Appending the data will apply previously specified value queries
-                # and time filtering
-                instData[idx].appendData(tid_inst.data, 0) # don't ignore any rows
-            else:
-                # This instrument is not in the instrument list yet.
-                # Append it to the name list and the object list
-                print('Inst not yet seen. Appending new instrument to list of instruments.')
-                instDataNames.append(instName)
-                # Make an object with the instrument name, labels and data frame
-                # instrument data object, and append it to the list.
-                # Querying of value and filtering of timestamps will happen during
-                # construction of the object
-                instData.append(tid_inst)
-
-            # The instrument data is now contained in the instrument InstData object.
-            # Delete the instrument object to free up resources.
-            del tid_inst
-
-    # The data is now in instData in data frames. Done with the source data. Delete it.
-    del df_source
-
-elif args.s and len(headerList) >= 3:
-    # Strain gauge data, and there are at least three cols.
-    # The header has this structure:
-    # Label                 Column                  Information
-    # "Scan Session:"       0                       Informational.
-    #                                               Not used for processing
-    # "Start Time:"         0                       Data start time.
-    #                                               Data times are elapsed from this
-    # "Assignment:"         0:label, 2-n: names     tag names
-    # "Reduction Method:"   0:label, 2-n: units     units or strain
-    #
-    # Next row is a header of sorts, but it does not contain tag names, so it
-    # won't get used:
-    # "ID", "Seconds Elapsed", Units for value 1, ... Units for value n
-    #
-    # After the header information, the data is expected to have these columns:
-    # [0] ID, Sample Id, row number
-    # [1] Seconds elapsed (from start time)
-    # [2] Tag 1 value
-    # ...
-    # [n+1] Tag n Value
-    #
-    # Internal function to process the header and return a time indexed data frame
-    # with first row headers.
-    def _procHeader(df_raw, anchorLabel = 'ID', startTimeLabel = 'Start Time:',
-                    tagNamesLabel = 'Assignment:', unitsLabel = 'Reduction Method:',
-                    strainUnitPrefix = 'u', elapsedTimeLabel = 'Elapsed'):
+        else:
+            # Loop thru the header list. Get the instrument name, and make a timestamp
+            # indexed data frame with float values for each column. These are added to
+            # the list of source tags, and the instruments are made from the list
+            # further below.
+            headerList = df_source.columns.values.tolist()
+            for idx in range(0, len(headerList)):
+                instName = headerList[idx]
+                # skip the Bias column -- no op in this case
+                if instName != 'Bias':
+                    srcTags.append((_instNameOf(instName),
+                                    pd.to_numeric(df_source.iloc[:, idx], errors='coerce').to_frame()))
+
+            # The data is now in the source tag list. Done with the source data. Delete it.
+            del df_source
+        return srcTags
+
+    def _strainSource(self):
         """
-        Given a data frame (df_raw), and a number of delimiters, this function will
-        parse up the header to determine start time, tag names, and units. The funciton
-        will return a timestamp indexed data frame with first row headers. The
-        header names fit the pattern 'Tag Name (units)'.
-
-        The row and column location of the anchor label is used (default is "ID")
-        to locate raw data. This is done in case there are rows above, or
-        columns to the left of what would be a typical data frame.
+        Read and parse the strain gauge (-s) input and merge files, and return
+        the list of source tags, or None if the input file does not have a
+        value column.
         """
-        # Interate thru columns and find the anchor label marker (exact match).
-        # This is important because it marks the row where it and above is the
-        # header information and below which is the data.
-        # df.shape returns a (row count, column count) tuple
-        markLabel = anchorLabel
-        idCol = -1  # keep track of where mark is found
-        idRow = -1
-        for colNum in range(df_raw.shape[1]):     # 0 to max columns
-            # look for the mark (exact match)
-            markRows = df_raw[colNum].eq(markLabel)
-            if markRows.any():
-                # The mark was found
-                # Keep the row and column, and exit the loop (assume only one 'ID' marker
-                idCol = colNum
-                idRow = markRows.idxmax()
-                break
-        # if we get here, and id col/row are < 0, the id mark was not found. Punt
-        if idCol < 0 or idRow < 0:
-            print('ERROR: Data may be invalid.  Looking for a cell with an exact \
+        args = self.args
+        df_source, df_strainData, headerList = self._readInput()
+        self.profiler.start('parse')
+        if len(headerList) < 3:
+            return None
+        # Strain gauge data, and there are at least three cols.
+        # The header has this structure:
+        # Label                 Column                  Information
+        # "Scan Session:"       0                       Informational.
+        #                                               Not used for processing
+        # "Start Time:"         0                       Data start time.
+        #                                               Data times are elapsed from this
+        # "Assignment:"         0:label, 2-n: names     tag names
+        # "Reduction Method:"   0:label, 2-n: units     units or strain
+        #
+        # Next row is a header of sorts, but it does not contain tag names, so it
+        # won't get used:
+        # "ID", "Seconds Elapsed", Units for value 1, ... Units for value n
+        #
+        # After the header information, the data is expected to have these columns:
+        # [0] ID, Sample Id, row number
+        # [1] Seconds elapsed (from start time)
+        # [2] Tag 1 value
+        # ...
+        # [n+1] Tag n Value
+        #
+        srcTags = []
+        # Internal function to process the header and return a time indexed data frame
+        # with first row headers.
+        def _procHeader(df_raw, df_data = None, anchorLabel = 'ID', startTimeLabel = 'Start Time:',
+                        tagNamesLabel = 'Assignment:', unitsLabel = 'Reduction Method:',
+                        strainUnitPrefix = 'u', elapsedTimeLabel = 'Elapsed'):
+            """
+            Given a data frame (df_raw), and a number of delimiters, this function will
+            parse up the header to determine start time, tag names, and units. The funciton
+            will return a timestamp indexed data frame with first row headers. The
+            header names fit the pattern 'Tag Name (units)'.
+
+            The row and column location of the anchor label is used (default is "ID")
+            to locate raw data. This is done in case there are rows above, or
+            columns to the left of what would be a typical data frame.
+
+            If the data rows were read separately (see readStrain), df_raw is only
+            the header rows, and df_data is the data rows below them.
+            """
+            # Interate thru columns and find the anchor label marker (exact match).
+            # This is important because it marks the row where it and above is the
+            # header information and below which is the data.
+            # df.shape returns a (row count, column count) tuple
+            markLabel = anchorLabel
+            idCol = -1  # keep track of where mark is found
+            idRow = -1
+            for colNum in range(df_raw.shape[1]):     # 0 to max columns
+                # look for the mark (exact match)
+                markRows = df_raw[colNum].eq(markLabel)
+                if markRows.any():
+                    # The mark was found
+                    # Keep the row and column, and exit the loop (assume only one 'ID' marker
+                    idCol = colNum
+                    idRow = markRows.idxmax()
+                    break
+            # if we get here, and id col/row are < 0, the id mark was not found. Punt
+            if idCol < 0 or idRow < 0:
+                _fail('ERROR: Data may be invalid.  Looking for a cell with an exact \
     match to "' + markLabel + '". It is used to delimit the header from the data \
     and to delimit the leftmost column. Unable to process strain data.')
-            quit()
-
-        # Before we deal with the data, we need some important things from
-        # the header: the start time, the tag names (Assignment), and the
-        # the units (Reduction Method).
-        # Note: Use the id column and row determined above for positioning.
-        # Assume the header is this row and above, and the meaningful data
-        # is from this column and to the right.
-        #
-        # Get the start time.
-        # Look for the label in the left column. If it exists, the resulting series
-        # will have a True value in the position corresponding to the row.
-        # If found, break out the non-label part and trim off leading/trailing space.
-        markLabel = startTimeLabel
-        markRows = df_raw[idCol].str.match(markLabel, case=False, na=False)
-        if markRows.any():
-            # The label was found -- the row will be marked as true, which is considered
-            # greater than false, so it will be the index with the max value.
-            # Get the contents, which will include the label.
-            # Split out the label, trim the other part, and save it
-            # as a pandas timestamp
-            startTime = df_raw[idCol][markRows.idxmax()].split(":", 1)
-            try:
-                startTime = pd.Timestamp(startTime[1].strip())
-            except ValueError as ve:
-                print('ERROR: Problem converting Start Time to a timestamp. \
-Unable to process strain data.')
-                print(ve)
-                quit()
-        else:
-            # no start time found.  Gartz to go...
-            print('\nERROR: Data may be invalid.  Looking for a cell which \
+
+            # Before we deal with the data, we need some important things from
+            # the header: the start time, the tag names (Assignment), and the
+            # the units (Reduction Method).
+            # Note: Use the id column and row determined above for positioning.
+            # Assume the header is this row and above, and the meaningful data
+            # is from this column and to the right.
+            #
+            # Get the start time.
+            # Look for the label in the left column. If it exists, the resulting series
+            # will have a True value in the position corresponding to the row.
+            # If found, break out the non-label part and trim off leading/trailing space.
+            markLabel = startTimeLabel
+            markRows = df_raw[idCol].str.match(markLabel, case=False, na=False)
+            if markRows.any():
+                # The label was found -- the row will be marked as true, which is considered
+                # greater than false, so it will be the index with the max value.
+                # Get the contents, which will include the label.
+                # Split out the label, trim the other part, and save it
+                # as a pandas timestamp
+                startTime = df_raw[idCol][markRows.idxmax()].split(":", 1)
+                try:
+                    startTime = pd.Timestamp(startTime[1].strip())
+                except ValueError as ve:
+                    _fail('ERROR: Problem converting Start Time to a timestamp. \
+Unable to process strain data.',
+                          ve)
+            else:
+                # no start time found.  Gartz to go...
+                _fail('\nERROR: Data may be invalid.  Looking for a cell which \
 contains: "' + markLabel + '" in the same column as the anchor label (usually "ID"). \
 This cell should contain the data start time. Unable to process strain data.')
-            quit()
-
-        # Get the tag names (assignments)
-        # Look for the label in the left column. If it exists, the resulting series
-        # will have a True value in the position corresponding to the row.
-        # If found, get the row, removing the first two columns.
-        markLabel = tagNamesLabel
-        markRows = df_raw[idCol].str.match(markLabel, case=False, na=False)
-        if markRows.any():
-            # The label was found -- the row will be marked as true, which is considered
-            # greater than false, so it will be the index with the max value.
-            # Get the data frame row for this location, stripping off the first
-            # two columns which contain the label and a blank location corresponding
-            # to the elapsed time column.
-            tagNames = df_raw.iloc[markRows.idxmax()][idCol + 2:]
-        else:
-            # Tag name label not found.  Gartz to go...
-            print('\nERROR: No Tag Name label "' + markLabel + '" row found. Unable to process strain data.')
-            quit()
-
-        # Get the units (Reduction Method)
-        # Look for the label in the left column. If it exists, the resulting series
-        # will have a True value in the position corresponding to the row.
-        # If found, get the row, removing the first two columns.
-        markLabel = unitsLabel
-        markRows= df_raw[idCol].str.match(markLabel, case=False, na=False)
-        if markRows.any():
-            # The label was found -- the row will be marked as true, which is considered
-            # greater than false, so it will be the index with the max value.
-            # Get the data frame row for this location, stripping off the first
-            # two columns which contain the label and a blank location corresponding
-            # to the elapsed time column.
-            units= df_raw.iloc[markRows.idxmax()][idCol + 2:]
-            # Combine the tag from above, with the units so we don't need two rows
-            # to display both -- display: TagName (units)
-            # Tag name and units should be the same length, but just in case use min len.
-            # If the original data was empty, the contents is nan, but a float type.
-            # Ignore an empty string or a float nan.
-            for colNum in range(min(tagNames.size, units.size)):
-                if units.iloc[colNum] and str(units.iloc[colNum]) != 'nan' and units.iloc[colNum].lower() != 'strain':
-                    # there is a unit specified, and it isn't strain. Concat with tag name
-                    tagNames.iloc[colNum] = tagNames.iloc[colNum] + ' (' + units.iloc[colNum] + ')'
-                elif units.iloc[colNum] and str(units.iloc[colNum]) != 'nan' and units.iloc[colNum].lower() == 'strain':
-                    # there is a unit specified, but it is strain.
-                    # Concat 'uStrain' with tag name (add the u).
-                    tagNames.iloc[colNum] = tagNames.iloc[colNum] + ' (' + strainUnitPrefix + 'Strain)'
-        else:
-            # Units label not found.  Gartz to go...
-            print('\nERROR: No Units label "' + markLabel + '" row found. Unable to process strain data.')
-            quit()
-
-        # Get the units of time used for the time offsets (elapsed label)
-        # Look for the label in the second column. If it exists, the resulting series
-        # will have a True value in the position corresponding to the row.
-        # Since we have the start time from above, once the units are determined below,
-        # we could convert the elapsed times into timestamps here.  Delay this, however,
-        # and do it after the data frame is trimmed down to just a header row and the data.
-        # At this point, we are better prepared to remove NaN/NaT values, and deal
-        # with errors.
-        markLabel = elapsedTimeLabel
-        # note use of contains since the mark is not at the beginning
-        markRows = df_raw[idCol + 1].str.contains(markLabel, case=False, na=False)
-        if markRows.any():
-            # The label was found.
-            # Get the second column of the data frame row for this location to get
-            # the elapsed time label.  This gives us access to time units, "seconds"
-            # for example. Convert to lower case to avoid inconsistency from causing
-            # searching errors.
-            offsetLabel = df_raw.iloc[markRows.idxmax()][idCol + 1].lower()
-        else:
-            # Elapsed time label not found.  Gartz to go...
-            print('\nERROR: No Elapsed Time label ("xxx Elapsed") column found. Unable to process strain data.')
-            quit()
-
-        # At this point, we processed the header, and now need to remove everything
-        # but the data, add the timestamps as an index, and a single header row using
-        # the tagNames as the header.
-        # First drop the rows above the data (the header -- it isn't needed anymore)
-        df_raw.drop(df_raw.index[:idRow + 1], axis=0, inplace=True)
-        # Now make sure all the time offsets are numbers so there are no problems when
-        # making timestamps.  A row without a valid timestamp isn't useful, so
-        # drop any row with an invalid time offset. Use to_numeric to generate
-        # NaN values where they are not numeric, then drop these.
-        df_raw[idCol + 1] = df_raw[idCol + 1].apply(pd.to_numeric, errors='coerce')
-        df_raw.dropna(subset=[idCol + 1], how='any', inplace=True)
-        # Now create a series of timestamps from the start time and the elapsed times.
-        # Use the offsetLabel above and offset values populated above.
-        # :TRICKY: Test for 'millisecond' first since it contains
-        # the string 'seccond'. Labels will usually be plural and full names,
-        # shorten them to be less restrictive, and allow options if they are clear.
-        try:
+
+            # Get the tag names (assignments)
+            # Look for the label in the left column. If it exists, the resulting series
+            # will have a True value in the position corresponding to the row.
+            # If found, get the row, removing the first two columns.
+            markLabel = tagNamesLabel
+            markRows = df_raw[idCol].str.match(markLabel, case=False, na=False)
+            if markRows.any():
+                # The label was found -- the row will be marked as true, which is considered
+                # greater than false, so it will be the index with the max value.
+                # Get the data frame row for this location, stripping off the first
+                # two columns which contain the label and a blank location corresponding
+                # to the elapsed time column.
+                tagNames = df_raw.iloc[markRows.idxmax()][idCol + 2:]
+            else:
+                # Tag name label not found.  Gartz to go...
+                _fail('\nERROR: No Tag Name label "' + markLabel + '" row found. Unable to process strain data.')
+
+            # Get the units (Reduction Method)
+            # Look for the label in the left column. If it exists, the resulting series
+            # will have a True value in the position corresponding to the row.
+            # If found, get the row, removing the first two columns.
+            markLabel = unitsLabel
+            markRows= df_raw[idCol].str.match(markLabel, case=False, na=False)
+            if markRows.any():
+                # The label was found -- the row will be marked as true, which is considered
+                # greater than false, so it will be the index with the max value.
+                # Get the data frame row for this location, stripping off the first
+                # two columns which contain the label and a blank location corresponding
+                # to the elapsed time column.
+                units= df_raw.iloc[markRows.idxmax()][idCol + 2:]
+                # Combine the tag from above, with the units so we don't need two rows
+                # to display both -- display: TagName (units)
+                # Tag name and units should be the same length, but just in case use min len.
+                # If the original data was empty, the contents is nan, but a float type.
+                # Ignore an empty string or a float nan.
+                for colNum in range(min(tagNames.size, units.size)):
+                    if units.iloc[colNum] and str(units.iloc[colNum]) != 'nan' and units.iloc[colNum].lower() != 'strain':
+                        # there is a unit specified, and it isn't strain. Concat with tag name
+                        tagNames.iloc[colNum] = tagNames.iloc[colNum] + ' (' + units.iloc[colNum] + ')'
+                    elif units.iloc[colNum] and str(units.iloc[colNum]) != 'nan' and units.iloc[colNum].lower() == 'strain':
+                        # there is a unit specified, but it is strain.
+                        # Concat 'uStrain' with tag name (add the u).
+                        tagNames.iloc[colNum] = tagNames.iloc[colNum] + ' (' + strainUnitPrefix + 'Strain)'
+            else:
+                # Units label not found.  Gartz to go...
+                _fail('\nERROR: No Units label "' + markLabel + '" row found. Unable to process strain data.')
+
+            # Get the units of time used for the time offsets (elapsed label)
+            # Look for the label in the second column. If it exists, the resulting series
+            # will have a True value in the position corresponding to the row.
+            # Since we have the start time from above, once the units are determined below,
+            # we could convert the elapsed times into timestamps here.  Delay this, however,
+            # and do it after the data frame is trimmed down to just a header row and the data.
+            # At this point, we are better prepared to remove NaN/NaT values, and deal
+            # with errors.
+            markLabel = elapsedTimeLabel
+            # note use of contains since the mark is not at the beginning
+            markRows = df_raw[idCol + 1].str.contains(markLabel, case=False, na=False)
+            if markRows.any():
+                # The label was found.
+                # Get the second column of the data frame row for this location to get
+                # the elapsed time label.  This gives us access to time units, "seconds"
+                # for example. Convert to lower case to avoid inconsistency from causing
+                # searching errors.
+                offsetLabel = df_raw.iloc[markRows.idxmax()][idCol + 1].lower()
+            else:
+                # Elapsed time label not found.  Gartz to go...
+                _fail('\nERROR: No Elapsed Time label ("xxx Elapsed") column found. Unable to process strain data.')
+
+            # At this point, we processed the header, and now need to remove everything
+            # but the data, add the timestamps as an index, and a single header row using
+            # the tagNames as the header.
+            # First drop the rows above the data (the header -- it isn't needed anymore)
+            # or if the data rows were read separately, just use them.
+            if df_data is None:
+                df_raw.drop(df_raw.index[:idRow + 1], axis=0, inplace=True)
+            else:
+                df_raw = df_data
+            # Now make sure all the time offsets are numbers so there are no problems when
+            # making timestamps.  A row without a valid timestamp isn't useful, so
+            # drop any row with an invalid time offset. Use to_numeric to generate
+            # NaN values where they are not numeric, then drop these.
+            df_raw[idCol + 1] = pd.to_numeric(df_raw[idCol + 1], errors='coerce')
+            df_raw.dropna(subset=[idCol + 1], how='any', inplace=True)
+            # Now create the timestamps from the start time and the elapsed times, all
+            # at once rather than one row at a time. Get the offset units from the
+            # offsetLabel above.
+            # :TRICKY: Test for 'millisecond' first since it contains
+            # the string 'seccond'. Labels will usually be plural and full names,
+            # shorten them to be less restrictive, and allow options if they are clear.
             if offsetLabel.find('milli') != -1:
                 # time offset in units of milliseconds
-                timeStamps = df_raw[idCol + 1].apply(lambda d: (startTime + pd.Timedelta(str(d) + 'milli')))
+                offsetUnit = 'ms'
             elif offsetLabel.find('sec') != -1:
                 # time offset in units of seconds
-                timeStamps = df_raw[idCol + 1].apply(lambda d: (startTime + pd.Timedelta(str(d) + 'sec')))
+                offsetUnit = 's'
             elif offsetLabel.find('min') != -1:
                 # time offset in units of minutes
-                timeStamps = df_raw[idCol + 1].apply(lambda d: (startTime + pd.Timedelta(str(d) + 'min')))
+                offsetUnit = 'min'
             elif offsetLabel.find('hour') != -1:
                 # time offset in units of hours
-                timeStamps = df_raw[idCol + 1].appl(lambda d: (startTime + pd.Timedelta(str(d) + 'hr')))
+                offsetUnit = 'h'
             else:
                 # unknown offset units. Can't create timestamps. Print a message and go
-                print('ERROR: Elapsed time units could not be determined. Unalbe to process strain data.')
-                quit()
-        except ValueError as ve:
-            print('ERROR: offset value is not understood, and a start time cannot be determined. \
-Unable to process strain data.')
-            print(ve)
-        # Rround the timestamps to the nearest ms. Unseen ns and
-        # fractional ms values are not always displayed, and can cause
-        # unexpected merge and up/downsample results.
-        try:
-            timeStamps = timeStamps.dt.round('L')
-        except ValueError as ve:
-            print('    WARNING: Timestamp cannot be rounded.')
-            print(ve)
-
-        # Now drop the left most columns, from leftmost to ID + 1 (elapsed time)
-        df_raw.drop(df_raw.columns[:idCol + 2], axis=1, inplace=True)
-        # All the columns are data columns, and the time stamp has not yet been added.
-        # Rename the columns using the tag names.
-        df_raw.rename(columns=tagNames, inplace=True)
-        # Now insert the timestamps as a column. Position does not matter, as it
-        # will become the index.
-        df_raw['timestamp'] = timeStamps
-        # finally, set the timestamp column to be the index
-        df_raw.set_index('timestamp', inplace=True)
-        # Finally drop any column which is all NaN. This can happen if there were
-        # additional columns in the header rows that was to the right of the data.
-        # This would get dropeed with the header, leaving empty columns.
-        # Note: Doing this earlier is tricky if there happens to be empty columns
-        # to the left of the ID column. In thie case, the column value of idCol
-        # would be wrong after dropping the empty left columns.
-        df_raw.dropna(axis='columns',how='all', inplace=True)
-        return df_raw
-        # end _procHeader()
-
-    def _sMerge(fileToMerge, df_base, sep, encoding):
-        """
-        This function merges data from the specified file name (fileToMerge)
-        with the base data (df_base), and returns the merged data.
-        The data to merge is read from a csv file, and must also be in the
-        strain gauge data data format (-s).
-
-        The file to merge has times and tags that may match or may be additional
-        to the source data. The data merge will make the source data wider if
-        there are new tags, and longer if there are new times. One or both may
-        happen.
-
-        This function assumes that the base data (df_base) has been pre-processed,
-        and is a time indexed data frame with column names. In other words, has
-        already been through _procHeader.
-        """
-        try:
-            print('Merging file "' + fileToMerge + '".\n')
-            # use string as the data type for all columns to prevent automatic
-            # datatype detection. We don't know ahead of time how many columns are
-            # being read in, so we don't yet know the types.
-            # We want duplicate column names to be preserved as in.
-            # They will get filtered out as duplicates later.
-            # The default behavior of read_csv is to append a ".n" to the column name
-            # where n is an integer value starting at 1 and incrementing up for each
-            # duplicate found. The problem with this is later, this gets interpreted as
-            # a different tag if using some options.
-            # COMPILER: mangle_dupe_cols=False is supposed to preserve the duplicate
-            # column names by turning off the mangling described above.
-            # It is "not supported yet" but is in the documentation for
-            # Pandas 0.22 and maybe earler as being a feature!!
-            # It throws a ValueError if used.  As a work around, don't use
-            # mangle_dupe_cols=False, and use header=None instead of header=0 in the
-            # read_csv function.
-            df_merge = pd.read_csv(fileToMerge, sep=sep,
-                                delim_whitespace=False, encoding=encoding,
-                                header=None, dtype = str, skipinitialspace=True)
-                                # mangle_dupe_cols=False)
+                _fail('ERROR: Elapsed time units could not be determined. Unalbe to process strain data.')
+            # Convert the offsets to ns, and add the start time. to_timedelta with a
+            # unit converts the numbers the same way as parsing each one as a
+            # Timedelta string did, so the timestamps are the same.
+            offsets = df_raw[idCol + 1].values.astype(np.float64)
+            try:
+                if not np.isfinite(offsets).all():
+                    raise ValueError('Infinite time offset found.')
+                tsNs = startTime.value + pd.to_timedelta(offsets, unit=offsetUnit).values \
+                                           .astype('timedelta64[ns]').view(np.int64)
+            except (ValueError, OverflowError) as ve:
+                _fail('ERROR: offset value is not understood, and a start time cannot be determined. \
+Unable to process strain data.',
+                      ve)
+            # Rround the timestamps to the nearest ms. Unseen ns and
+            # fractional ms values are not always displayed, and can cause
+            # unexpected merge and up/downsample results.
+            # Do this on the ns values, with halfway values rounded to the even ms,
+            # which is the same as dt.round('L').
+            msNs = 10**6
+            tsMs, remNs = np.divmod(tsNs, msNs)
+            tsMs += (remNs > msNs // 2) | ((remNs == msNs // 2) & (tsMs % 2 == 1))
+            timeStamps = pd.Series((tsMs * msNs).view('datetime64[ns]'), index=df_raw.index)
+            del offsets, tsNs, tsMs, remNs
+
+            # Now drop the left most columns, from leftmost to ID + 1 (elapsed time)
+            df_raw.drop(df_raw.columns[:idCol + 2], axis=1, inplace=True)
+            # All the columns are data columns, and the time stamp has not yet been added.
+            # Rename the columns using the tag names.
+            df_raw.rename(columns=tagNames, inplace=True)
+            # Now insert the timestamps as a column. Position does not matter, as it
+            # will become the index.
+            df_raw['timestamp'] = timeStamps
+            # finally, set the timestamp column to be the index
+            df_raw.set_index('timestamp', inplace=True)
+            # Finally drop any column which is all NaN. This can happen if there were
+            # additional columns in the header rows that was to the right of the data.
+            # This would get dropeed with the header, leaving empty columns.
+            # Note: Doing this earlier is tricky if there happens to be empty columns
+            # to the left of the ID column. In thie case, the column value of idCol
+            # would be wrong after dropping the empty left columns.
+            df_raw.dropna(axis='columns',how='all', inplace=True)
+            return df_raw
+            # end _procHeader()
+
+        def _sMerge(fileToMerge, seenColumns, sep, encoding):
+            """
+            This function reads the data to merge from the specified file name
+            (fileToMerge), and returns it as a time indexed data frame with column
+            names, the same as the input data after _procHeader. seenColumns is the
+            set of the tags read so far (input file and earlier merge files), and
+            is used to warn about duplicated tags.
+            The data to merge is read from a csv file, and must also be in the
+            strain gauge data data format (-s).
+
+            The file to merge has times and tags that may match or may be additional
+            to the source data. The data for each tag is merged with the data for
+            the same tag from the other files by the caller (see ftppMerge.py).
+            """
+            try:
+                print('Merging file "' + fileToMerge + '".\n')
+                # Read the header rows as strings, and the data rows directly as
+                # numbers (see ftppSchema.py). Columns are labeled by position, so
+                # duplicate names in the header rows do not matter here.
+                df_merge, df_mergeData = self.readStrain(fileToMerge, sep=sep, encoding=encoding)
 
-        except ValueError as ve:
-            print('ERROR opening the file specified with the -amx/archiveMergex \
+            except ValueError as ve:
+                _fail('ERROR opening the file specified with the -amx/archiveMergex \
 parameter: "' + fileToMerge + '".\n Check file name, file presence, and permissions.  \
-Unexpected encoding can also cause this error.')
-            print(ve)
-            quit()
-
-        # The data to merge has a header. Process it so is in the same format
-        # as the base file.
-        df_merge = _procHeader(df_merge) # Note use of default labels
-        # Deal with duplicates in the merge file.
-        # Duplicates with this data format within the same file are problematic
-        # because they represent a tag with more than one value at the same timestamp.
-        # While this could be delt with when merging, it is an indication that the
-        # data may not be as expected. Error out so a person needs to take a look.
-        dups = listDuplicates(df_merge)
-        if dups:
-            # duplicates have been found.  Notify leave.
-            print('    ERROR: There are column names duplicated in the file "' + fileToMerge + '" specified \
+Unexpected encoding can also cause this error.',
+                      ve)
+
+            # The data to merge has a header. Process it so is in the same format
+            # as the base file.
+            df_merge = _procHeader(df_merge, df_mergeData) # Note use of default labels
+            # Drop the rows outside the start and end time
+            df_merge = self.window.filterIndex(df_merge)
+            # Deal with duplicates in the merge file.
+            # Duplicates with this data format within the same file are problematic
+            # because they represent a tag with more than one value at the same timestamp.
+            # While this could be delt with when merging, it is an indication that the
+            # data may not be as expected. Error out so a person needs to take a look.
+            dups = duplicateNames(df_merge)
+            if dups:
+                # duplicates have been found.  Notify leave.
+                _fail('    ERROR: There are column names duplicated in the file "' + fileToMerge + '" specified \
 with the -amx/archiveMergex parameter.\nThis is not allowed with this type of data because it usually \
 means tag values would be ambiguous at a given time.\n\
-There will be no further processing.\nThe following column names are duplicated:')
-            print(dups)
-            quit()
-
-        # The source and merge data, at this point, have both been indexed by timestamp.
-        # Now deal with duplicate value column names between the source and
-        # merge file.
-        # With this data format, this may or may not be problematic. If there
-        # are duplicated timestamps, they will get removed after merging.
-        # Detect duplicates and warn.
-        dups = listToListIntersection(df_base.columns.values, df_merge.columns.values)
-        if dups:
-            # duplicates have been found.  Notify and continue.
-            print('    WARNING: There are tags in the input file "' + args.inputFileName + '" that are duplicated\n\
-in the file "' + fileToMerge + '" specified with the -amx/archiveMergex parameter.\nThis is allowed, \
+There will be no further processing.\nThe following column names are duplicated:',
+                      dups)
+
+            # The source and merge data, at this point, have both been indexed by timestamp.
+            # Now deal with duplicate value column names between the source and
+            # merge file.
+            # With this data format, this may or may not be problematic. If there
+            # are duplicated timestamps, they will get removed after merging.
+            # Detect duplicates and warn.
+            dups = commonNames(seenColumns, df_merge.columns.values)
+            if dups:
+                # duplicates have been found.  Notify and continue.
+                print('    WARNING: There are tags in the input or earlier merge files that are duplicated\n\
+in the file "' + fileToMerge + '" specified to merge.\nThis is allowed, \
 but if the duplicate column or columns contain duplicate timestamps, then only \n\
-one value will be retained.\nThe following tags are duplicated:')
-            print(dups)
-            print()
-
-        # Now merge the data. Append columns (axis = 1), keeping the header rows.
-        # There may be NaN values present when/if columns are diffenrent length.
-        # This isn't different than in the input file.
-        #df_base = pd.concat([df_base, df_merge], axis=1, join='outer', sort=False)
-        # Drop the merge data as a matter of cleanup after it is maybe printed,
-        # and then return the merged data
-        #
-        # Now merge the data. Append rows (axis=0), which actually is appending
-        # to the index. Note that NaN values may result depending on which times
-        # and values are being merged, but these will get removed later.
-        df_base = pd.concat([df_base, df_merge], axis=0, sort=False)
-        # Drop the merge data as a matter of cleanup after it is maybe printed,
-        # and then return the merged data
+one value (from the file merged last) will be retained.\nThe following tags are duplicated:')
+                print(dups)
+                print()
+
+            # print diagnostic info if verbose is set
+            if args.verbose:
+                print('**** Merge Data ****')
+                print(df_merge)
+
+            return df_merge
+            # end _sMerge()
+
+        df_source = _procHeader(df_source, df_strainData)
+        del df_strainData
+        # Drop the rows outside the start and end time
+        df_source = self.window.filterIndex(df_source)
+
+        # At this point, the source data has this structure
+        # idx TimeStamp
+        # [0] Tag 1 Value
+        # ...
+        # [n] Tag n Value,
+        # and the header contains the tag names for the value columns.
+
+        if self.mergeFiles:
+            # There are files to merge. Keep the data per tag, from the input file
+            # and then each merge file in order, and merge each tag's time sorted
+            # data at the end (see ftppMerge.py). A later file wins when a tag has
+            # the same timestamp in more than one file.
+            merger = TagMerger()
+
+            def _mergeTags(df_data):
+                """
+                Add the float values of each column of the timestamp indexed data
+                to the merger.
+                """
+                for idx in range(0, df_data.shape[1]):
+                    merger.add(df_data.columns[idx],
+                               pd.to_numeric(df_data.iloc[:, idx], errors='coerce').to_frame())
+                # end _mergeTags()
+
+            _mergeTags(df_source)
+            seenColumns = set(df_source.columns.values.tolist())
+            del df_source
+            for fileToMerge in self.mergeFiles:
+                df_merge = _sMerge(fileToMerge, seenColumns=seenColumns,
+                                   sep=args.sourceDelimiter, encoding=args.sourceEncoding)
+                seenColumns.update(df_merge.columns.values.tolist())
+                _mergeTags(df_merge)
+                del df_merge
+
+            # The merged data for each tag goes to the source tag list, and the
+            # instruments are made from the list further below.
+            for instName in merger.tags():
+                srcTags.append((_instNameOf(instName), merger.pop(instName)))
 
-        # print diagnostic info if verbose is set
+        else:
+            # Make sure the data is sorted by time. This may be unnecessary, but
+            # just in case.
+            df_source.sort_index(inplace=True)
+
+            # Loop thru the header list. Get the instrument name, and make a timestamp
+            # indexed data frame with float values for each column. These are added to
+            # the list of source tags, and the instruments are made from the list
+            # further below.
+            headerList = df_source.columns.values.tolist()
+            for idx in range(0, len(headerList)):
+                srcTags.append((_instNameOf(headerList[idx]),
+                                pd.to_numeric(df_source.iloc[:, idx], errors='coerce').to_frame()))
+
+            # The data is now in the source tag list. Done with the source data. Delete it.
+            del df_source
+        return srcTags
+
+    def buildInstruments(self, srcTags):
+        """
+        Make the instruments (TsIdxData objects) from the list of source tags,
+        and return the list of them, sorted by name. The data of the source
+        tags with the same instrument name goes into one instrument. The source
+        tag list is emptied as the instruments are made.
+        """
+        args = self.args
+        # Make a spot for the instrument TsIdxData objects, by name (see
+        # ftppRegistry.py). The name is used to detect data for duplicate
+        # instruments. If a duplicate is found, the data is appended to an
+        # already existing instrument.
+        instRegistry = InstrumentRegistry()
+
+        # **** Make the instrument objects.
+        # Loop thru the source tags. Create a TsIdxData object for each, and keep it
+        # in the instrument registry. If the instrument name is duplicated, the data
+        # sets are merged.
+        # With more than one job, this (and the resampling further below) is done by
+        # a pool of worker processes. The pool returns a stand in object for each
+        # instrument, in the same order as the loop below would make them.
+        self.instPool = None
+        if args.jobs > 1 and srcTags:
+            print('\nMaking the instruments using ' + str(args.jobs) + ' worker processes.')
+            from ftppParallel import InstrumentPool
+            self.instPool = InstrumentPool(args.jobs)
+            try:
+                self.profiler.start('build')
+                self.profiler.addRows('build', rowsIn=sum(len(df_data.index) for instName, df_data in srcTags))
+                instRegistry = InstrumentRegistry(
+                    self.instPool.build(srcTags, args.valueQuery, self.startArg, self.endArg,
+                                        self.sourceTimeFormat))
+                self.profiler.stop('build')
+            except RuntimeError as re:
+                _fail('ERROR: Problem making the instruments.', re)
+        else:
+            # Work from the end of the reversed list so the source data for each tag can
+            # be released once the instrument has it.
+            srcTags.reverse()
+            while srcTags:
+                instName, instSource = srcTags.pop()
+                # Generate timestamp and value field (column) names.
+                # These will be used for the exported data.
+                # Include the instr name in the timestamp column label so it can be
+                # identified standalone
+                tsName = 'timestamp_' + instName
+                # Add the value prefix if it isn't there already.
+                # This is helpful when using an output file as an input file
+                valName = instName if instName.startswith('value') else 'value_' + instName
+                # print a message showing what we are processing
+                print('\nProcessing ' + instName)
+                # Create a new instrument object and use the above column names.
+                with self.profiler.lap('build', instName):
+                    tid_inst = TsIdxData(instName, tsName, valName,
+                                         instSource,
+                                         args.valueQuery, self.startArg, self.endArg,
+                                         self.sourceTimeFormat, forceColNames=True)
+                self.profiler.addRows('build', rowsIn=len(instSource.index))
+                # See if instrument is already in the registry. If so append the
+                # data to the existing instrument object.
+                # If not, then add the new object with the new data to the registry.
+                idx = instRegistry.position(instName)
+                if idx is not None:
+                    # An instrument with the same name already exists.
+                    # Append this data to it
+                    print('Inst in list at index ' + str(idx) + '. Appending data.')
+
+                    # Appending the data will apply previously specified value queries
+                    # and time filtering
+                    instRegistry[idx].appendData(tid_inst.data, 0) # don't ignore any rows
+                else:
+                    # This instrument is not in the registry yet. Add it.
+                    print('Inst not yet seen. Appending new instrument to list of instruments.')
+                    # Add the object with the instrument name, labels and data frame
+                    # instrument data object to the registry.
+                    # Querying of value and filtering of timestamps will happen during
+                    # construction of the object
+                    instRegistry.add(tid_inst)
+
+                # The instrument data is now contained in the instrument InstData object.
+                # Delete the instrument object and the source data to free up resources.
+                del tid_inst, instSource
+
+        # Make the list of instruments, sorted by instrument name.
+        # This is done here, so just the list is made,
+        # and possibly large datasets aren't being changed.
+        # Sort based on the lower case version of the names, so the
+        # sort order is case insensitive.
+        # Do this here so it can be printed this way in verbose mode.
+        instData = instRegistry.sortedList()
+        del instRegistry
+
+        # Note the rows of each instrument in the profile
+        if self.profiler.enabled:
+            for inst in instData:
+                self.profiler.instrumentRows(inst.name, inst.count)
+            self.profiler.addRows('build', rowsOut=sum(inst.count for inst in instData))
+
+        # Print diagnostic info if verbose is set
         if args.verbose:
-            print('**** Merge Data ****')
-            print(df_merge)
-            print('**** Merged Data ****')
-            print(df_base)
-
-        del df_merge
-        return df_base
-        # end _sMerge()
-
-    df_source = _procHeader(df_source)
-
-    # If there are files specified to merge, merge them with the input file before
-    # further processing.
-    # Merge File 1
-    if args.archiveMerge1 is not None:
-        df_source = _sMerge(args.archiveMerge1, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 2
-    if args.archiveMerge2 is not None:
-        df_source = _sMerge(args.archiveMerge2, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 3
-    if args.archiveMerge3 is not None:
-        df_source = _sMerge(args.archiveMerge3, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-    # Merge File 4
-    if args.archiveMerge4 is not None:
-        df_source = _sMerge(args.archiveMerge4, df_base=df_source,
-                sep=args.sourceDelimiter, encoding=args.sourceEncoding)
-
-
-    # At this point, the merges have happened, and the source data has this structure
-    # idx TimeStamp
-    # [0] Tag 1 Value
-    # ...
-    # [n] Tag n Value,
-    # and the header contains the tag names for the value columns.
-
-    # Update the header list after the merge to make sure new tags are reflected.
-    headerList = df_source.columns.values.tolist()
-
-    # Make sure the data is still sorted by time after the merge. This may be
-    # unnecessary, but just in case.
-    df_source.sort_index(inplace=True)
-
-    # Loop thru the header list. Get the instrument name, create a data frame for
-    # each instrument, get the value to be a float, create a list of
-    # instruments and an list of TsIdxData objects (one per instrument).
-    # If the instrument name is duplicated, the data sets are
-    # merged.
-    for idx in range(0, len(headerList)):
-        instName = headerList[idx]
-        # replace the spaces, hyphens, and periods with underscores
-        instName = instName.replace(' ', '_')
-        instName = instName.replace('-', '_')
-        instName = instName.replace('.', '_')
-        # Generate timestamp and value field (column) names.
-        # These will be used for the exported data.
-        # Include the instr name in the timestamp column label so it can be
-        # identified standalone
-        tsName = 'timestamp_' + instName
-        # Add the value prefix if it isn't there already.
-        # This is helpful when using an output file as an input file
-        valName = instName if instName.startswith('value') else 'value_' + instName
-        # print a message showing what we are processing
-        print('\nProcessing ' + instName)
-        # Create a new instrument object and use the above column names.
-        tid_inst = TsIdxData(instName, tsName, valName,
-                             df_source.iloc[:,idx],
-                             args.valueQuery, startArg, endArg,
-                             sourceTimeFormat, forceColNames=True)
-        # See if instrument is already in the list. If so append the
-        # data to an existing instrument object already in the object list.
-        # If not, then append a new object with the new data to the name and
-        # object lists.
-        if instName in instDataNames:
-            # An instrument with the same name already exists.
-            # Append this data to it
-            idx = instDataNames.index(instName)
-            print('Inst in list at index ' + str(idx) + '. Appending data.')
-
-            # Appending the data will apply previously specified value queries
-            # and time filtering
-            instData[idx].appendData(tid_inst.data, 0) # don't ignore any rows
+            print('**** List of Instruments ****')
+            print(instData)
+            print()
+        return instData
+
+    def timeGrid(self, instData):
+        """
+        Return the output timestamps, as a data frame indexed by them with no
+        columns: from the earliest to the latest instrument time, limited by
+        the start and end time (-st/-et), at the resample period (-rs) or the
+        shortest instrument sample period. Return None if the instruments have
+        no data.
+        """
+        # **** Determine the earliest start time, the latest end time, and the minimum
+        # frequency for the instruments. These will be used to generate the master time
+        # series used for merging all the data together.
+        # As long as there is a list of instrument objects,
+        # loop thru the instruments and get the first and last datetime
+        # init the holding areas
+        startTime= pd.NaT
+        endTime= pd.NaT
+        freq= np.NaN
+        if instData:
+            # find the earliest and latest start/end times
+            # Use the isEmpty property, rather than data.empty, because data returns a
+            # copy of the instrument data.
+            for inst in instData:
+                # get the earliest start time
+                if not inst.isEmpty and not pd.isna(inst.startTs) and pd.isna(startTime):
+                    # first valid time
+                    startTime = inst.startTs
+                elif not inst.isEmpty and not pd.isna(inst.startTs) and not pd.isna(startTime):
+                    # get min
+                    startTime = min(startTime, inst.startTs)
+
+                # get the latest end time
+                if not inst.isEmpty and not pd.isna(inst.endTs) and pd.isna(endTime):
+                    # first valid time
+                    endTime = inst.endTs
+                elif not inst.isEmpty and not pd.isna(inst.endTs) and not pd.isna(endTime):
+                    # get the max
+                    endTime = max(endTime, inst.endTs)
+
+                # get the highest frequency in the form of a time offset
+                if not inst.isEmpty and not pd.isna(inst.timeOffset) and pd.isna(freq):
+                    # first valid offset
+                    freq = inst.timeOffset
+                elif not inst.isEmpty and not pd.isna(inst.timeOffset) and not pd.isna(freq):
+                    # get min
+                    freq = min(freq, inst.timeOffset)
+
+        # Use the start and end not a time (NaT) check as a check to see if
+        # there is any data
+        if pd.isna(startTime) or pd.isna(endTime):
+            return None
+        # **** Make the start and end arguments the latest of the first data time
+        # and the specified start time, and the end time should be the earliest
+        # of the last data time and the specified end time.  The arguments were
+        # processed above, so they are valid or set to None if they were invalid
+        # or not specified.
+        # Init the arguments to the instrument times from above if nothing was
+        # specified.
+
+        startArg = self.startArg if self.startArg is not None else startTime
+        endArg = self.endArg if self.endArg is not None else endTime
+
+        # At this point the startArg and endArg have either command line argument
+        # specified values or the data based values.  Now determine the resulting
+        # combination of argument and data values. Make start the later of the two, and
+        # end the earlier of the two. This prevents a bunch of NaN values if the data
+        # is inside the argument values
+        startTime = max(startTime, startArg)
+        # latest source time, before it is limited by the end time argument
+        sourceEnd = endTime
+        endTime = min(endTime, endArg)
+
+        # **** Make sure the resampleArg is either the value specified or the
+        # minimum of the instrument data frequencies if nothing was specified.
+        if self.resampleArg is None:
+            self.resampleArg = freq
+
+        # Force the start time to start on clean "origin" time. The time range
+        # being merged to needs to start on the same time as the date being merged,
+        # or the stats are misleading -- and the resampling function already does
+        # this.
+        # For example, if '5S' is used, the time being merged to needs to start
+        # on a division of 5 seconds, so it needs to start with a timestamp
+        # ending in 0 or 5 seconds.
+        # When appending to the output file (incremental mode), the time range
+        # continues from the last time already written instead. Its row is
+        # written again, as there may be more data for it now.
+        if self.incState is not None and self.incState.appending:
+            startTime = self.incState.watermark
         else:
-            # This instrument is not in the instrument list yet.
-            # Append it to the name list and the object list
-            print('Inst not yet seen. Appending new instrument to list of instruments.')
-            instDataNames.append(instName)
-            # Make an object with the instrument name, labels and data frame
-            # instrument data object, and append it to the list.
-            # Querying of value and filtering of timestamps will happen during
-            # construction of the object
-            instData.append(tid_inst)
-
-        # The instrument data is now contained in the instrument InstData object.
-        # Delete the instrument object to free up resources.
-        del tid_inst
-
-    # The data is now in instData in data frames. Done with the source data. Delete it.
-    del df_source
-
-# As long as there is an instrument list,
-# sort the instrument list by instrument name.
-# This is done here, so just the list is mutated,
-# and possibly large datasets aren't being changed.
-# Sort based on the last name version of the names, so the
-# sort order is case insensitive.
-# Do this here so it can be printed this way in verbose mode.
-if instData:
-    instData.sort(key=lambda x: x.name.lower())
-
-# Print diagnostic info if verbose is set
-if args.verbose:
-    print('**** List of Instruments ****')
-    print(instData)
-    print()
-
-# **** Determine the earliest start time, the latest end time, and the minimum
-# frequency for the instruments. These will be used to generate the master time
-# series used for merging all the data together.
-# As long as there is a list of instrument objects,
-# loop thru the instruments and get the first and last datetime
-# init the holding areas
-startTime= pd.NaT
-endTime= pd.NaT
-freq= np.NaN
-if instData:
-    # find the earliest and latest start/end times
-    for inst in instData:
-        # get the earliest start time
-        if not inst.data.empty and not pd.isna(inst.startTs) and pd.isna(startTime):
-            # first valid time
-            startTime = inst.startTs
-        elif not inst.data.empty and not pd.isna(inst.startTs) and not pd.isna(startTime):
-            # get min
-            startTime = min(startTime, inst.startTs)
-
-        # get the latest end time
-        if not inst.data.empty and not pd.isna(inst.endTs) and pd.isna(endTime):
-            # first valid time
-            endTime = inst.endTs
-        elif not inst.data.empty and not pd.isna(inst.endTs) and not pd.isna(endTime):
-            # get the max
-            endTime = max(endTime, inst.endTs)
-
-        # get the highest frequency in the form of a time offset
-        if not inst.data.empty and not pd.isna(inst.timeOffset) and pd.isna(freq):
-            # first valid offset
-            freq = inst.timeOffset
-        elif not inst.data.empty and not pd.isna(inst.timeOffset) and not pd.isna(freq):
-            # get min
-            freq = min(freq, inst.timeOffset)
-
-# **** From here on, use the start and end not a time (NaT) check as a check to
-# see if there is any data
-if not pd.isna(startTime) and not pd.isna(endTime):
-    # **** Make the start and end arguments the latest of the first data time
-    # and the specified start time, and the end time should be the earliest
-    # of the last data time and the specified end time.  The arguments were
-    # processed above, so they are valid or set to None if they were invalid
-    # or not specified.
-    # Init the arguments to the instrument times from above if nothing was
-    # specified.
-
-    if startArg is None:
-        startArg = startTime
-
-    if endArg is None:
-        endArg = endTime
-
-    # At this point the startArg and endArg have either command line argument
-    # specified values or the data based values.  Now determine the resulting
-    # combination of argument and data values. Make start the later of the two, and
-    # end the earlier of the two. This prevents a bunch of NaN values if the data
-    # is inside the argument values
-    startTime = max(startTime, startArg)
-    endTime = min(endTime, endArg)
-
-    # **** Make sure the resampleArg is either the value specified or the
-    # minimum of the instrument data frequencies if nothing was specified.
-    if resampleArg is None:
-        resampleArg = freq
-
-    # Force the start time to start on clean "origin" time. The time range
-    # being merged to needs to start on the same time as the date being merged,
-    # or the stats are misleading -- and the resampling function already does
-    # this.
-    # For example, if '5S' is used, the time being merged to needs to start
-    # on a division of 5 seconds, so it needs to start with a timestamp
-    # ending in 0 or 5 seconds.
-    startTime = startTime.floor(resampleArg)
-
-    # Print messages so we can see what is going to happen.
-    print('\n**** Initial processing of each instrument done. For the generated \
+            startTime = startTime.floor(self.resampleArg)
+
+        # Print messages so we can see what is going to happen.
+        print('\n**** Initial processing of each instrument done. For the generated \
 dataset:')
-    print('    The start time is:', startTime)
-    print('    The end time is:', endTime)
-    print('    The sampling frequency is:', resampleArg)
-    print('    Note that the start and end times are the earliest and latest \
+        print('    The start time is:', startTime)
+        print('    The end time is:', endTime)
+        print('    The sampling frequency is:', self.resampleArg)
+        print('    Note that the start and end times are the earliest and latest \
 found in the data unless the start and/or end time options are used.')
-    print('    Note that the sample frequency used it the highest found in \
+        print('    Note that the sample frequency used it the highest found in \
 the data unless the resampling option is used.\n')
 
-    # **** Create a daterange data frame to act as the master datetime range.
-    # Use the above determined start, end, and frequency
-    # The data will get left merged using this data frame for time
-    # create the timestamp column name
-    ts_name = 'timestamp'
-    # using the start and end times, build an empty  dataframe with the
-    # date time range as the index. Default sample period to 1 Sec
-    try:
-        df_dateRange = pd.DataFrame({ts_name:pd.date_range(startTime,
-                                                           endTime,
-                                                           freq=resampleArg)})
-    except ValueError as ve:
-        print('ERROR: Problem with generated date/time range. Check the \
-resample argument.')
-        print('Error: ', sys.exc_info())
-        quit()
-
-    # Make sure the date range is sorted. This is needed for the
-    # merge to work as expected.
-    df_dateRange.sort_values(ts_name, ascending=True, inplace=True)
-    # set the timestamp as the index
-    df_dateRange.set_index(ts_name, inplace=True)
-
-    # **** Populate the destination data frame
-    # As long as there is a list of instrument objects,
-    # create a new file, erasing any existing with the same name,
-    # insert the export compliance message (if not shut off), and then
-    # loop thru the instruments and merge the data into the destination data frame
-    if instData:
-        df_dest = df_dateRange
-        # create a new file for writing, deleting any existing version
+        # create the timestamp column name
+        ts_name = 'timestamp'
+        # **** With the events grid, the output timestamps are the sample times of
+        # the instruments, rounded down to the sample period (see ftppGrid.py).
+        # They are the times of the date range below at which an instrument has a sample.
+        if self.args.gridMode == 'events':
+            # output timestamp grid
+            from ftppGrid import fixedNanos, eventTimes, eventGrid
+            periodNanos = fixedNanos(self.resampleArg)
+            if periodNanos is None:
+                print('WARNING: The events grid needs a fixed sample period. Using the \
+dense grid.\n')
+            else:
+                self.profiler.start('grid')
+                if self.instPool is not None:
+                    try:
+                        timeArrays = [self.instPool.eventTimes(periodNanos)]
+                    except RuntimeError as re:
+                        _fail('ERROR: Problem getting the instrument sample times.', re)
+                else:
+                    timeArrays = [eventTimes(inst.data.index, periodNanos)
+                                  for inst in instData if not inst.isEmpty]
+                # When appending, the last time already written is written again.
+                gridIndex = eventGrid(timeArrays, startTime, endTime, self.gridSpacing,
+                                      startTime if self.incState is not None and
+                                      self.incState.appending else None)
+                del timeArrays
+                self.profiler.stop('grid', rowsOut=len(gridIndex))
+                print('    The output timestamps are the ' + str(len(gridIndex)) +
+                      ' instrument sample times (events grid).\n')
+                df_dateRange = pd.DataFrame(index=gridIndex.rename(ts_name))
+                if self.incState is not None and len(df_dateRange.index):
+                    self.incState.keepSource(df_dateRange.index[-1], sourceEnd)
+                return df_dateRange
+
+        # **** Create a daterange data frame to act as the master datetime range.
+        # Use the above determined start, end, and frequency
+        # The data will get left merged using this data frame for time
+        # using the start and end times, build an empty  dataframe with the
+        # date time range as the index. Default sample period to 1 Sec
         try:
-            outFile = open(args.outputFileName, 'w', encoding=args.destEncoding)
+            df_dateRange = pd.DataFrame({ts_name:pd.date_range(startTime,
+                                                               endTime,
+                                                               freq=self.resampleArg)})
         except ValueError as ve:
-            print('ERROR opening the output file. Nothing written.')
-            quit()
+            print('ERROR: Problem with generated date/time range. Check the \
+resample argument.')
+            print('Error: ', sys.exc_info())
+            raise ProcessError(str(ve))
+
+        # Make sure the date range is sorted. This is needed for the
+        # merge to work as expected.
+        df_dateRange.sort_values(ts_name, ascending=True, inplace=True)
+        # set the timestamp as the index
+        df_dateRange.set_index(ts_name, inplace=True)
+        # In incremental mode, keep the source rows needed to write the last row
+        # again next time.
+        if self.incState is not None and len(df_dateRange.index):
+            self.incState.keepSource(df_dateRange.index[-1], sourceEnd)
+        return df_dateRange
+
+    def align(self, instData, df_dateRange):
+        """
+        Resample the instruments, and align them to the output timestamps
+        (see timeGrid()). Return the output data: a data frame indexed by the
+        output timestamps, with the value (or stats) columns of each
+        instrument, and 0 where there is no value. In incremental mode, only
+        the columns of the output file are kept.
+        """
+        args = self.args
+        appending = self.incState is not None and self.incState.appending
+        df_dest = df_dateRange
+        # With more than one job, resample all the instruments in the worker
+        # processes now. The resample() calls below then do nothing.
+        if self.instPool is not None:
+            try:
+                self.profiler.start('resample')
+                self.instPool.resample(self.resampleArg, self.stats, self.valueType)
+                self.profiler.stop('resample')
+            except RuntimeError as re:
+                _fail('ERROR: Problem resampling the instruments.', re)
+
+        def _instData():
+            """
+            Resample each instrument if it needs to be, and yield its data, in
+            order. In incremental mode, the last value of each instrument from
+            the previous run is carried forward into its data, and instruments
+            with no new data are carried forward alone.
+            """
+            def _resampled():
+                for inst in instData:
+                    # first, resample the instrument data if it needs to be
+                    with self.profiler.lap('resample', inst.name):
+                        df_inst = self._resampleInst(inst)
+                    yield inst.name, df_inst
+
+            if self.incState is None:
+                for instName, df_inst in _resampled():
+                    yield df_inst
+            else:
+                for df_inst in self.incState.carryForward(_resampled(),
+                                                          df_dest.index[-1]):
+                    yield df_inst
+            # end _instData()
+
+        # append the instrument data to the destination data frame.
+        # This is where it all comes together ...
+        if args.alignEngine == 'vector':
+            # Fill one preallocated array over the master date range, one
+            # instrument at a time, and make the data frame once at the end.
+            # This gives the same result as the merge_asof loop below, without
+            # copying the growing destination data frame for every instrument.
+            aligner = AsofAligner(df_dest.index, len(instData), dtype=self.valueType)
+            for df_inst in _instData():
+                # take the last instrument value that is on or before each
+                # master date range time
+                with self.profiler.lap('align'):
+                    aligner.add(df_inst)
+            with self.profiler.lap('align'):
+                df_dest = aligner.result()
+            del aligner
+        else:
+            for df_inst in _instData():
+                # Merge the instrument data with the master dataframe.
+                # The backward direction means to take the last instrument value
+                # that is on or before the master date range -- i.e. when merging
+                # to a time not in instrument time, look backward in time to get
+                # the last instrument value
+                # NOTE: Steps were taken during construction to round times to
+                # the nearest msec, so fractional msecs do not affect the merge.
+                with self.profiler.lap('align'):
+                    df_dest = pd.merge_asof(df_dest, df_inst,
+                                            left_index = True, right_index = True,
+                                            direction = 'backward')
+        self.profiler.addRows('align', rowsOut=len(df_dest.index))
 
-        # generate the export compliance warning, unless explicitly omitted
-        if not args.noExportMsg:
+        # replace any NaN values in the resulting data frame with 0s so data users
+        # are not tripped up with NaN
+        df_dest.fillna(0.0, inplace = True)
+        # An integer column with NaN values was made float64 by the merge.
+        # Make it the precision (-pr) wanted, the same as the other values.
+        df_dest = asPrecision(df_dest, self.valueType)
+
+        # In incremental mode, keep the columns of the output file.
+        if self.incState is not None:
+            df_dest, newColumns = self.incState.matchColumns(df_dest)
+            if newColumns:
+                print('WARNING: There are tags which are not in the output file. \
+They are left out. Write the whole output file (without -inc, or delete the \
+state file) to include them. The columns left out are:')
+                print(newColumns)
+            if appending:
+                print('Appending ' + str(len(df_dest.index)) + ' rows to the output file.')
+        return df_dest
+
+    def _openOutput(self):
+        """
+        Open the output file, and write the export control message to it
+        unless -noExportMsg is used. Return a tuple of the open file (None for
+        the binary formats, which are written all at once) and the export
+        control message to keep as metadata in the binary formats (or None).
+        """
+        args = self.args
+        outFile = None
+        # create a new file for writing, deleting any existing version, or
+        # open the existing file to append to it in incremental mode.
+        # The binary (columnar) output formats are written all at once at the
+        # end, so there is no file to open here.
+        appending = self.incState is not None and self.incState.appending
+        if args.outputFormat == 'csv':
+            try:
+                if appending:
+                    # remove the last row written. It is written again by write().
+                    self.incState.truncate(args.outputFileName)
+                outFile = open(args.outputFileName, 'a' if appending else 'w',
+                               encoding=args.destEncoding)
+            except (ValueError, OSError) as ve:
+                _fail('ERROR opening the output file. Nothing written.')
+
+        # generate the export compliance warning, unless explicitly omitted, or
+        # appending to a file which already has it
+        exportMsg = None
+        if not args.noExportMsg and not appending:
             expCompWarn = \
 ['WARNING - This document contains technical data export of which',
 'is restricted by the Export Administration Regulations (EAR).',
@@ -2072,51 +3353,368 @@ resample argument.')
 
             # write to the output file
             print('**** Writing the output file\n')
-            csv.register_dialect('csvDialect', escapechar=' ',
-                                lineterminator='\n', quoting=csv.QUOTE_NONE)
-            csvWriter = csv.writer(outFile, dialect='csvDialect')
-            for row in expCompWarn:
-                print(row)
-                csvWriter.writerow([row])
-
-        # append the instrument data to the destination data frame.
-        # This is where it all comes together ...
-        for inst in instData:
-            # first, resample the instrument data if it needs to be
-            inst.resample(resampleArg, stats)
-            # Merge the instrument data with the master dataframe.
-            # The backward direction means to take the last instrument value
-            # that is on or before the master date range -- i.e. when merging
-            # to a time not in instrument time, look backward in time to get
-            # the last instrument value
-            # NOTE: Steps were taken during construction to round times to
-            # the nearest msec, so fractional msecs do not affect the merge.
-            df_dest = pd.merge_asof(df_dest, inst.data,
-                                    left_index = True, right_index = True,
-                                    direction = 'backward')
-
-        # replace any NaN values in the resulting data frame with 0s so data users
-        # are not tripped up with NaN
-        df_dest.fillna(0.0, inplace = True)
+            if args.outputFormat == 'csv':
+                csv.register_dialect('csvDialect', escapechar=' ',
+                                    lineterminator='\n', quoting=csv.QUOTE_NONE)
+                csvWriter = csv.writer(outFile, dialect='csvDialect')
+                for row in expCompWarn:
+                    print(row)
+                    csvWriter.writerow([row])
+            else:
+                # kept as metadata in the binary formats, written below
+                for row in expCompWarn:
+                    print(row)
+                exportMsg = '\n'.join(expCompWarn).strip()
+        return outFile, exportMsg
 
+    def write(self, df_dest):
+        """
+        Write the output data to the output file in the output format, with
+        the export control message unless -noExportMsg is used. In incremental
+        mode, the new rows are appended to the file, and the state saved.
+        """
+        args = self.args
+        appending = self.incState is not None and self.incState.appending
+        outFile, exportMsg = self._openOutput()
+        self.profiler.start('write')
+        if args.outputFormat == 'csv':
+            try:
+                # **** Write the destination data frame to the output file
+                # Use the specified format for the date/time. The timestamps are
+                # all formatted at once, and the rows written in large chunks (see
+                # ftppWriter.py), rather than using to_csv on the whole data frame.
+                if self.incState is None:
+                    writeFrame(df_dest, outFile, sep=args.destDelimiter,
+                               dateFormat=self.destTimeFormat,
+                               floatDecimals=args.floatPrecision,
+                               threads=args.writeThreads)
+                else:
+                    # In incremental mode, write the last row by itself, and
+                    # keep where it starts, so it can be written again next
+                    # time. When appending, there is already a header row.
+                    writeFrame(df_dest.iloc[:-1], outFile, sep=args.destDelimiter,
+                               dateFormat=self.destTimeFormat,
+                               floatDecimals=args.floatPrecision,
+                               threads=args.writeThreads,
+                               header=not appending)
+                    tailOffset = outFile.tell()
+                    writeFrame(df_dest.iloc[-1:], outFile, sep=args.destDelimiter,
+                               dateFormat=self.destTimeFormat,
+                               floatDecimals=args.floatPrecision,
+                               header=False)
+            except ValueError as ve:
+                print('\nERROR writing data to the file. Output file content is suspect.\n')
+                print('Error: ', sys.exc_info())
+                # Don't save the state for a suspect file
+                self.incState = None
+            outFile.close()
+
+            # Save the incremental mode state, now that the file is written.
+            if self.incState is not None:
+                from ftppIncremental import stateFileName
+                self.incState.update(df_dest.index[-1], tailOffset, self.resampleArg, self.stats)
+                try:
+                    self.incState.save(args.outputFileName)
+                except OSError as oe:
+                    print('WARNING: Unable to save the incremental state file "' +
+                          stateFileName(args.outputFileName) + '".')
+                    print(oe)
+        else:
+            try:
+                # **** Write the destination data frame to the output file in
+                # the binary format, with the timestamps and values typed.
+                writeColumnar(df_dest, args.outputFileName, args.outputFormat,
+                              compression=args.outputCompression,
+                              exportMsg=exportMsg,
+                              floatDecimals=args.floatPrecision)
+            except ImportError as ie:
+                print('\nERROR: The ' + args.outputFormat + ' output format needs a \
+package which is not installed (pyarrow for parquet and feather, tables for \
+hdf5). Nothing written.\n')
+                print(ie)
+            except (ValueError, OSError) as ve:
+                print('\nERROR writing data to the file. Output file content is suspect.\n')
+                print('Error: ', sys.exc_info())
+        self.profiler.stop('write', rowsIn=len(df_dest.index))
+
+    def _writeWindows(self, windows):
+        """
+        Write the output data a time window at a time to the csv output file
+        (-ow), from the iterator of window data frames (see _alignWindows()).
+        Each window is written by a background thread while the next one is
+        aligned.
+        """
+        args = self.args
+        outFile, _ = self._openOutput()
+        rowsOut = 0
         try:
-            # **** Write the destination data frame to the output file
-            # Use the specified format for the date/time
-            df_dest.to_csv(outFile, sep=args.destDelimiter,
-                           encoding=args.destEncoding,
-                           date_format=destTimeFormat)
-        except ValueError as ve:
+            # output window writer thread
+            from ftppWriter import WindowWriter
+            windowWriter = WindowWriter(outFile, sep=args.destDelimiter,
+                                        dateFormat=self.destTimeFormat,
+                                        floatDecimals=args.floatPrecision,
+                                        threads=args.writeThreads)
+            try:
+                for df_window in windows:
+                    # the write time is only the time waiting for the writer
+                    # thread, and queuing the window
+                    with self.profiler.lap('write'):
+                        windowWriter.write(df_window)
+                    rowsOut += len(df_window.index)
+            finally:
+                windowWriter.close()
+        except (ValueError, OSError) as ve:
             print('\nERROR writing data to the file. Output file content is suspect.\n')
             print('Error: ', sys.exc_info())
-        outFile.close()
-    else:
-        print('ERROR: No instrument data found. Nothing written\n')
-
-else:
-    print('ERROR: No data found. Nothing written\n')
-
-#get end  processing time
-procEnd = datetime.now()
-print('\n**** End Processing ****')
-print('    Process end time: ' + procEnd.strftime('%m/%d/%Y %H:%M:%S'))
-print('    Duration: ' + str(procEnd - procStart) + '\n')
+        finally:
+            outFile.close()
+        self.profiler.addRows('write', rowsIn=rowsOut)
+
+    def windows(self, windowPeriod):
+        """
+        Do the stages up to the alignment, and then yield the output data a
+        time window at a time, for windows windowPeriod (a pandas offset or
+        offset string, e.g. '1H' or '1D') long. Each window is a data frame with
+        the same values as the rows of the output data in the window. Windows
+        start on a multiple of the period (e.g. at midnight for '1D'), and
+        windows without output timestamps are skipped. Only the output data of
+        one window is made at a time, so it can be much larger than memory.
+        Nothing is written. Not for incremental mode (-inc).
+        """
+        if self.incState is not None:
+            raise ProcessError('Time windows cannot be used in incremental mode.')
+        try:
+            windowPeriod = to_offset(windowPeriod)
+        except ValueError as ve:
+            raise ProcessError('Invalid time window period: ' + str(ve))
+        try:
+            instData = self.buildInstruments(self.loadSource())
+            df_dateRange = self.timeGrid(instData)
+            if df_dateRange is None or not instData:
+                print('ERROR: No data found.\n')
+                return
+            for df_window in self._alignWindows(instData, df_dateRange, windowPeriod):
+                yield df_window
+        finally:
+            self.close()
+        self.finish()
+
+    def _alignWindows(self, instData, df_dateRange, windowPeriod):
+        """
+        Resample the instruments, and then yield the output data (see align())
+        a time window (windowPeriod, a pandas offset) of the output timestamps
+        at a time. The instrument data is kept for all the windows, so the
+        last value of each instrument carries forward from one window to the
+        next. The instruments in the instData list are released (set to None)
+        as their data is taken.
+        """
+        # Resample each instrument once, and keep its data for all the windows.
+        if self.instPool is not None:
+            try:
+                self.profiler.start('resample')
+                self.instPool.resample(self.resampleArg, self.stats, self.valueType)
+                self.profiler.stop('resample')
+            except RuntimeError as re:
+                _fail('ERROR: Problem resampling the instruments.', re)
+        instFrames = []
+        for instNum, inst in enumerate(instData):
+            with self.profiler.lap('resample', inst.name):
+                instFrames.append(self._resampleInst(inst))
+            instData[instNum] = None
+        # The position, in each instrument's data, of its last row on or before
+        # the start of the window being aligned. The windows are in time order,
+        # so each cursor only moves forward.
+        instCursors = [0] * len(instFrames)
+        def _alignGrid(gridIndex):
+            # Take the last instrument value that is on or before each output
+            # timestamp of the grid, with the alignment engine, the same as
+            # align() does.
+            if self.args.alignEngine == 'vector':
+                aligner = AsofAligner(gridIndex, len(instFrames), dtype=self.valueType)
+                for df_inst in instFrames:
+                    aligner.add(df_inst)
+                df_grid = aligner.result()
+            else:
+                # Give merge_asof only the instrument rows the grid can use:
+                # the last row on or before the first grid timestamp (the value
+                # carried forward), and the rows up to the last grid timestamp.
+                gridStart = gridIndex.values[0]
+                gridEnd = gridIndex.values[-1]
+                df_grid = pd.DataFrame(index=gridIndex)
+                for instNum, df_inst in enumerate(instFrames):
+                    instTimes = df_inst.index.values
+                    cursor = instCursors[instNum]
+                    first = cursor + np.searchsorted(instTimes[cursor:], gridStart,
+                                                     side='right') - 1
+                    first = max(first, cursor)
+                    last = cursor + np.searchsorted(instTimes[cursor:], gridEnd,
+                                                    side='right')
+                    instCursors[instNum] = first
+                    df_grid = pd.merge_asof(df_grid, df_inst.iloc[first:last],
+                                            left_index = True, right_index = True,
+                                            direction = 'backward')
+            df_grid.fillna(0.0, inplace=True)
+            return asPrecision(df_grid, self.valueType)
+            # end _alignGrid()
+
+        gridIndex = df_dateRange.index
+        # The merge engine keeps the type of a column (e.g. integer) unless it
+        # has NaN values, which happens only before the first instrument value,
+        # so at the first output timestamp. Align that timestamp by itself to
+        # get the column types of the whole output, and use them in every
+        # window, so the values are written the same as align() gives them.
+        colTypes = _alignGrid(gridIndex[:1]).dtypes
+        # The first output timestamp of each window
+        if isinstance(windowPeriod, Tick):
+            firstStart = gridIndex[0].floor(windowPeriod)
+        else:
+            firstStart = windowPeriod.rollback(gridIndex[0].normalize())
+        windowStarts = np.searchsorted(
+            gridIndex.values, pd.date_range(firstStart, gridIndex[-1],
+                                            freq=windowPeriod).values)
+        windowStops = np.append(windowStarts[1:], len(gridIndex))
+        for start, stop in zip(windowStarts.tolist(), windowStops.tolist()):
+            if stop <= start:
+                continue
+            with self.profiler.lap('align'):
+                df_window = _alignGrid(gridIndex[start:stop])
+                if not df_window.dtypes.equals(colTypes):
+                    df_window = df_window.astype(colTypes.to_dict())
+            self.profiler.addRows('align', rowsOut=len(df_window.index))
+            yield df_window
+
+    def run(self, write=True):
+        """
+        Do all the stages, and return the output data (see align()), or None
+        if there is no data. The output file is written if write is True. With
+        an output window (-ow), the output data is aligned and written a time
+        window at a time, and None is returned.
+        """
+        df_dest = None
+        try:
+            instData = self.buildInstruments(self.loadSource())
+            df_dateRange = self.timeGrid(instData)
+            if df_dateRange is None:
+                if self.incState is not None and self.incState.appending:
+                    print('No new data found. Nothing written.\n')
+                else:
+                    print('ERROR: No data found. Nothing written\n')
+            elif self.incState is not None and not len(df_dateRange.index):
+                print('No sample times to write. Nothing written.\n')
+            elif not instData:
+                print('ERROR: No instrument data found. Nothing written\n')
+            elif write and self.outputWindow is not None:
+                self._writeWindows(self._alignWindows(instData, df_dateRange,
+                                                      self.outputWindow))
+            else:
+                df_dest = self.align(instData, df_dateRange)
+                del instData, df_dateRange
+                if write:
+                    self.write(df_dest)
+        finally:
+            self.close()
+        self.finish()
+        return df_dest
+
+    def close(self):
+        """
+        Stop the instrument worker processes, if they were used.
+        """
+        if self.instPool is not None:
+            self.instPool.close()
+            self.instPool = None
+
+    def finish(self):
+        """
+        Write the profile report and statistics, if profiling.
+        """
+        args = self.args
+        try:
+            self.profiler.finish()
+            if args.profile is not None:
+                print('Profile report written to "' + args.profile + '".')
+            if args.cprofile is not None:
+                print('cProfile statistics written to "' + args.cprofile + '".')
+        except OSError as oe:
+            print('WARNING: Unable to write the profile files.')
+            print(oe)
+
+
+def process(fileType, inputFileName, outputFileName=None, windowPeriod=None, **options):
+    """
+    Post process the input file of the file type ('t', 'a', 'n' or 's', the
+    same as the -t, -a, -n and -s options) in this process, and return the
+    output data: a timestamp indexed data frame with the value (or stats)
+    columns of each instrument, or None if there is no data. The output file
+    is also written if outputFileName is not None. With the outputWindow option
+    and an output file, the output is written a time window at a time and None
+    is returned.
+
+    The other options are keyword arguments named as the long options (the
+    args.xxx names above), e.g. resample='5S', stats='mx', startTime='2/11/2020
+    8:00', archiveMerge=['merge1.csv', 'merge2.csv'] or noExportMsg=True. The
+    options not given are the same as the command line defaults.
+
+    If windowPeriod is not None, an iterator of the output data a time window
+    at a time is returned instead (see PostProcessor.windows()), and nothing
+    is written.
+
+    A ProcessError is raised if the files cannot be processed, and a
+    ValueError for an unknown file type or option.
+    """
+    if fileType not in ('t', 'a', 'n', 's'):
+        raise ValueError('Unknown file type "' + str(fileType) + '".')
+    if windowPeriod is not None and outputFileName is not None:
+        raise ValueError('An output file cannot be written a time window at a time.')
+    args = parser.parse_args(['-' + fileType, '--', inputFileName,
+                              outputFileName if outputFileName is not None else ''])
+    for optName, optValue in options.items():
+        if optName in ('t', 'a', 'n', 's', 'inputFileName', 'outputFileName') or \
+                not hasattr(args, optName):
+            raise ValueError('Unknown option "' + optName + '".')
+        setattr(args, optName, optValue)
+    if args.incremental and outputFileName is None:
+        raise ValueError('Incremental mode (incremental=True) needs an output file.')
+    _checkArgs(args)
+    processor = PostProcessor(args)
+    if windowPeriod is not None:
+        return processor.windows(windowPeriod)
+    return processor.run(write=outputFileName is not None)
+
+
+def main(argv=None):
+    """
+    Parse the command line arguments argv (default is sys.argv[1:]), and
+    post process the files. Return the process exit code: 0 when the files
+    were processed, and 1 if there was an error.
+    """
+    # parse and check the arguments
+    args = parser.parse_args(argv)
+    try:
+        _checkArgs(args)
+    except ProcessError:
+        return 1
+
+    # Put the begin mark here, after the arg parsing, so argument problems are
+    # reported first.
+    print('**** Begin Processing ****')
+    # get start processing time
+    procStart = datetime.now()
+    print('    Process start time: ' + procStart.strftime('%m/%d/%Y %H:%M:%S'))
+
+    try:
+        PostProcessor(args).run()
+    except ProcessError:
+        # The error was printed when it happened. Nothing more to do.
+        return 1
+
+    #get end  processing time
+    procEnd = datetime.now()
+    print('\n**** End Processing ****')
+    print('    Process end time: ' + procEnd.strftime('%m/%d/%Y %H:%M:%S'))
+    print('    Duration: ' + str(procEnd - procStart) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
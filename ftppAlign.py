@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppAlign.py
+#
+# Alignment engine for ftArchPostProc.
+#
+# The instrument data is aligned to a master timestamp grid by taking, for
+# each grid time, the last instrument value at or before that time (a
+# "backward as of" merge). Doing this with one pd.merge_asof() call per
+# instrument copies the growing destination data frame on every call. The
+# AsofAligner here instead preallocates one 2-D float array for the whole
+# grid, finds the as of positions for each instrument with np.searchsorted(),
+# fills the instrument's column(s) in place, and wraps the array in a data
+# frame once at the end. The result is the same as the merge_asof() loop:
+# an integer (or bool) column keeps its type unless some grid times are
+# before its first value, in which case it is float, with NaN at those times.
+
+# imports
+#
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+
+def _asNs(values):
+    """
+    Return the datetime values as a datetime64[ns] numpy array, without a copy
+    if they already are.
+    """
+    return np.asarray(values, dtype='datetime64[ns]')
+
+
+def asofPositions(dataIndex, gridIndex):
+    """
+    For each timestamp in gridIndex, return the position of the last entry in
+    dataIndex which is at or before it, or -1 if there is no such entry. Both
+    indexes must be sorted in ascending order.
+    """
+    return np.searchsorted(_asNs(dataIndex), _asNs(gridIndex), side='right') - 1
+
+
+class AsofAligner(object):
+    """
+    Aligns any number of timestamp indexed data frames to a timestamp grid.
+
+    The grid (a sorted DatetimeIndex) is given to the constructor, along
+    with the expected number of value columns. The output array grows if more
+    columns than expected are added. Use add() for each data frame, in the
+    order the columns should appear, and then result() to get the aligned data
+    frame. Grid times before the first value of a data frame are NaN.
+
+    Columns are aligned as dtype, except that an integer or bool column with
+    a value at every grid time keeps its type, the same as pd.merge_asof().
+    """
+    def __init__(self, gridIndex, colCapacity=1, dtype=np.float64):
+        self._gridIndex = gridIndex
+        self._gridNs = _asNs(gridIndex.values)
+        self._dtype = dtype
+        self._out = np.empty((self._gridNs.size, max(1, colCapacity)), dtype=dtype)
+        self._colNames = []
+        # column number -> aligned values, of the columns which keep their
+        # (integer or bool) type
+        self._keptCols = {}
+
+    def _reserve(self, numCols):
+        """
+        Make sure there is room for numCols more columns in the output array.
+        """
+        needed = len(self._colNames) + numCols
+        capacity = self._out.shape[1]
+        if needed > capacity:
+            grown = np.empty((self._gridNs.size, max(needed, 2 * capacity)),
+                             dtype=self._dtype)
+            grown[:, :len(self._colNames)] = self._out[:, :len(self._colNames)]
+            self._out = grown
+
+    def add(self, df_data):
+        """
+        Align the columns of df_data to the grid, and add them to the output.
+        The data frame must be indexed by timestamp, sorted ascending.
+        """
+        numCols = len(df_data.columns)
+        self._reserve(numCols)
+        positions = np.searchsorted(_asNs(df_data.index.values), self._gridNs,
+                                    side='right') - 1
+        before = positions < 0
+        # use position 0 as a place holder for the grid times before the data,
+        # and overwrite those with NaN below
+        positions[before] = 0
+        firstCol = len(self._colNames)
+        for colNum in range(numCols):
+            dest = self._out[:, firstCol + colNum]
+            srcValues = df_data.iloc[:, colNum].values
+            if srcValues.size and not before.any() and \
+                    (np.issubdtype(srcValues.dtype, np.integer) or
+                     np.issubdtype(srcValues.dtype, np.bool_)):
+                self._keptCols[firstCol + colNum] = np.take(srcValues, positions)
+                continue
+            values = np.asarray(srcValues, dtype=self._dtype)
+            if values.size:
+                np.take(values, positions, out=dest)
+                dest[before] = np.nan
+            else:
+                dest[:] = np.nan
+        self._colNames.extend(df_data.columns.tolist())
+
+    def result(self):
+        """
+        Return the aligned data as a data frame indexed by the grid.
+        """
+        numCols = len(self._colNames)
+        if not self._keptCols:
+            return pd.DataFrame(self._out[:, :numCols],
+                                index=self._gridIndex, columns=self._colNames)
+        colNums = list(range(numCols))
+        df = pd.DataFrame({colNum: self._keptCols.get(colNum, self._out[:, colNum])
+                           for colNum in colNums},
+                          index=self._gridIndex, columns=colNums)
+        df.columns = self._colNames
+        return df
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppArchive.py
+#
+# Archive export (-a) ingestion helpers for ftArchPostProc.
+#
+# An archive export file has the columns
+#   TagId, TagName, Timestamp, DataSource, Value, Quality
+# and normally holds many tags, each at many timestamps. Reading the whole
+# export into a string data frame, and then making typed copies of it, needs
+# several times the size of the file in memory. The helpers here read the
+# export in fixed size row chunks instead. Each chunk is converted to typed
+# TagId/Timestamp/Value arrays, and then handed to a per tag accumulator. Only
+# the typed per tag data is retained between chunks, so peak memory is
+# proportional to the chunk size plus the retained data, and not to the size
+# of the raw file.
+#
+# mapFile() reads a file mapped into memory instead (see ftppMmap.py), and skips
+# the string data frame altogether. Only the fields needed are converted, and
+# only for the rows needed.
+
+# imports
+#
+# system related
+import io
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# custom libraries
+# memoized, fixed format timestamp parsing
+from ftppTimeParse import parseTimestamps, parseTimeMatrix
+# k-way merge of time sorted runs
+from ftppMerge import mergeSortedRuns
+# rows read at a time when a file cannot be memory mapped
+from ftppWindow import WINDOW_CHUNK_ROWS
+# memory mapped file scanning
+from ftppMmap import (canMap, MappedFile, lineSpans, splitFields, fieldMatrix,
+                      decodeField, parseFloats)
+
+# Column positions in an archive export file
+ARCH_ID_COL = 0
+ARCH_NAME_COL = 1
+ARCH_TS_COL = 2
+ARCH_DS_COL = 3
+ARCH_VAL_COL = 4
+ARCH_QUAL_COL = 5
+
+
+def readHeader(fileName, sep, encoding):
+    """
+    Read just the first row of the specified csv file, and return it as a
+    list of column names. Duplicate column names are preserved as is, so they
+    can be detected by the caller.
+
+    A ValueError is raised if the file cannot be read.
+    """
+    # Use header=None and dtype=str so the header row is returned as data,
+    # and the column names are not mangled when they are duplicated.
+    df_header = pd.read_csv(fileName, sep=sep, encoding=encoding,
+                            header=None, dtype=str,
+                            skipinitialspace=True, nrows=1)
+    return df_header.iloc[0].tolist()
+
+
+def readBlocks(fileName, blocks):
+    """
+    Yield the file name, or if blocks is not None, a buffer of the bytes of
+    each (byte offset, byte length) block of the file (see ftppIndex.py) in
+    turn.
+    """
+    if blocks is None:
+        yield fileName
+        return
+    with open(fileName, 'rb') as srcFile:
+        for offset, length in blocks:
+            srcFile.seek(offset)
+            yield io.BytesIO(srcFile.read(length))
+
+
+def groupBoundaries(keys):
+    """
+    Given an array of keys which is sorted (or at least has equal keys next to
+    each other), return a tuple of three arrays: the key of each group, the
+    start position of each group, and the stop (one past the end) position of
+    each group. Each group is then the contiguous slice [start:stop].
+    """
+    keys = np.asarray(keys)
+    if not keys.size:
+        return keys[:0], np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+    starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = np.insert(starts, 0, 0)
+    stops = np.append(starts[1:], keys.size)
+    return keys[starts], starts, stops
+
+
+class ArchiveTagAccumulator(object):
+    """
+    Accumulates typed, timestamp sorted data for each TagId found in one or
+    more archive export files.
+
+    Data is added one chunk (data frame of strings) at a time using
+    addChunk(), or a whole file at a time using readFile() or mapFile() (which
+    scans the bytes of the file mapped into memory). The chunk data
+    is converted to typed TagId, Timestamp and Value arrays, and the arrays
+    are kept per TagId.  Once all the data is added, tagList() gives the
+    sorted (TagId, TagName) pairs, and popTagData() gives a timestamp indexed
+    data frame for a tag, releasing the accumulated arrays as it goes.
+
+    Duplicate (TagId, Timestamp) rows are resolved by keeping the row added
+    last, which is the same result as concatenating the files in the order
+    they were added and using drop_duplicates(keep='last').
+
+    If a window (TimeWindow, see ftppWindow.py) is given, only the rows in its
+    time range are kept. Tags with no rows in the time range are still listed
+    by tagList().
+    """
+    def __init__(self, sourceTimeFormat, verbose=False, window=None):
+        self._sourceTimeFormat = sourceTimeFormat
+        self._verbose = verbose
+        self._window = window
+        # TagId -> first TagName seen
+        self._names = {}
+        # TagId -> list of timestamp arrays, and list of value arrays
+        self._ts = {}
+        self._vals = {}
+        # count of rows read and rows retained, for messaging
+        self._rowsRead = 0
+        self._rowsKept = 0
+        # only warn once about timestamp problems
+        self._tsWarned = False
+
+    @property
+    def rowsRead(self):
+        return self._rowsRead
+
+    @property
+    def rowsKept(self):
+        return self._rowsKept
+
+    def _toDatetime(self, ts):
+        """
+        Convert a series of timestamp strings to datetimes using the source
+        time format.  If this fails, fall back to a more forgiving conversion,
+        marking values which cannot be converted as NaT.
+        """
+        # coerce option for errors is marking dates after midnight (next
+        # day) as NaT. Try it with raise first, and fall back to coerce.
+        try:
+            return parseTimestamps(ts, errors='raise',
+                                   timeFormat=self._sourceTimeFormat,
+                                   exact=False, origin='unix')
+        except ValueError as ve:
+            if not self._tsWarned:
+                print('    WARNING: Problem converting some timestamps from \
+the source data.  Timestamps may be incorrect, and/or some rows may be missing.')
+                print(ve)
+                self._tsWarned = True
+            return parseTimestamps(ts, errors='coerce', origin='unix')
+
+    def addChunk(self, df_chunk, idCol=ARCH_ID_COL, nameCol=ARCH_NAME_COL,
+                 tsCol=ARCH_TS_COL, valCol=ARCH_VAL_COL):
+        """
+        Add a chunk of archive data. The chunk is a data frame of strings with
+        (at least) the TagId, TagName, Timestamp and Value columns named by
+        idCol, nameCol, tsCol, and valCol.
+
+        Rows without a valid TagId or Timestamp, or outside the time range
+        of the window, are dropped. Values which cannot be converted to a float
+        are kept as NaN.
+        """
+        self._rowsRead += len(df_chunk.index)
+        if df_chunk.empty:
+            return
+
+        # convert the columns of interest
+        ids = pd.to_numeric(df_chunk[idCol], errors='coerce')
+        ts = self._roundMs(self._toDatetime(df_chunk[tsCol]))
+        vals = pd.to_numeric(df_chunk[valCol], errors='coerce')
+
+        # Keep the rows with a valid id and timestamp
+        keep = (ids.notna() & ts.notna()).values
+        if not keep.any():
+            return
+        self._addTyped(ids.values[keep].astype(np.int64), ts.values[keep],
+                       vals.values[keep].astype(np.float64),
+                       df_chunk[nameCol].values[keep])
+
+    def _roundMs(self, ts):
+        """
+        Round the series of datetimes to the nearest ms, and return it. Unseen
+        ns and fractional ms values are not always displayed, and can cause
+        unexpected merge and up/downsample results.
+        """
+        try:
+            return ts.dt.round('ms')
+        except ValueError as ve:
+            print('    WARNING: Timestamp cannot be rounded.')
+            print(ve)
+        return ts
+
+    def _addTyped(self, ids, ts, vals, names):
+        """
+        Add typed rows: arrays of int64 TagIds, datetime64 Timestamps (no
+        NaT), float64 Values, and TagNames (None or NaN where missing). Rows
+        outside the time range of the window are dropped.
+        """
+        # rows in the time range, if filtering by time
+        inWindow = None
+        if self._window is not None and self._window.active:
+            inWindow = self._window.contains(ts)
+
+        # Group the chunk by TagId. A stable sort keeps the rows for each tag
+        # in file order, so the last duplicate added is still the last one.
+        order = np.argsort(ids, kind='mergesort')
+        ids = ids[order]
+        tagIds, starts, stops = groupBoundaries(ids)
+        for tagId, start, stop in zip(tagIds.tolist(), starts, stops):
+            rows = order[start:stop]
+            if tagId not in self._ts:
+                self._ts[tagId] = []
+                self._vals[tagId] = []
+            if tagId not in self._names:
+                # Use the first tag name that is present for the id
+                tagNames = names[rows]
+                tagNames = tagNames[pd.notna(tagNames)]
+                if tagNames.size:
+                    self._names[tagId] = tagNames[0]
+            if inWindow is not None:
+                # The tag is listed even if none of its rows are in the time range
+                rows = rows[inWindow[rows]]
+            self._ts[tagId].append(ts[rows])
+            self._vals[tagId].append(vals[rows])
+            self._rowsKept += rows.size
+
+    def readFile(self, fileName, sep, encoding, chunkRows, blocks=None):
+        """
+        Read the archive export file in chunks of chunkRows rows, and add each
+        chunk. The first row of the file is expected to be a header, and is
+        skipped. If blocks is not None, only those (byte offset, byte length)
+        blocks of data rows are read (see ftppIndex.py). A ValueError is
+        raised if the file cannot be read.
+        """
+        chunkNum = 0
+        for source in readBlocks(fileName, blocks):
+            # use string as the data type for all columns to prevent automatic
+            # datatype detection. The conversion is done per chunk in addChunk().
+            # Only the columns used are read (not DataSource and Quality). They
+            # keep their position in the file as their label.
+            reader = pd.read_csv(source, sep=sep, encoding=encoding,
+                                 header=None, dtype=str, skipinitialspace=True,
+                                 skiprows=1 if blocks is None else None,
+                                 usecols=[ARCH_ID_COL, ARCH_NAME_COL,
+                                          ARCH_TS_COL, ARCH_VAL_COL],
+                                 chunksize=chunkRows)
+            for df_chunk in reader:
+                self.addChunk(df_chunk)
+                if self._verbose:
+                    print('    Chunk ' + str(chunkNum) + ': ' + str(self._rowsRead) +
+                          ' rows read, ' + str(len(self._ts)) + ' tags seen.')
+                chunkNum += 1
+
+    def mapFile(self, fileName, sep, encoding, blocks=None, wantTag=None,
+                chunkRows=WINDOW_CHUNK_ROWS):
+        """
+        Read the archive export file the same as readFile(), but by mapping it
+        into memory and scanning its bytes (see ftppMmap.py). The TagId is
+        converted for every row, the Timestamp for the rows of the tags
+        wanted, and the Value only for the rows in the time range. The TagName
+        is decoded for the first row of each new tag only. If wantTag is not
+        None, it is given a TagName, and returns False if the rows of the tag
+        can be dropped.
+
+        Files which cannot be scanned this way (see canMap()) are read with
+        readFile() instead, in chunks of chunkRows rows. Chunks which cannot be
+        split into fields (e.g. quoted values) are read with read_csv(). A
+        ValueError is raised if the file cannot be read.
+        """
+        if not canMap(sep, encoding):
+            self.readFile(fileName, sep, encoding, chunkRows, blocks)
+            return
+        numFields = len(readHeader(fileName, sep, encoding))
+        try:
+            mapped = MappedFile(fileName)
+        except OSError as oe:
+            raise ValueError(str(oe))
+        with mapped:
+            for chunkNum, (start, stop) in enumerate(mapped.chunks(blocks)):
+                self._mapChunk(mapped.data, start, stop, sep, encoding, numFields, wantTag)
+                if self._verbose:
+                    print('    Chunk ' + str(chunkNum) + ': ' + str(self._rowsRead) +
+                          ' rows read, ' + str(len(self._ts)) + ' tags seen.')
+
+    def _mapChunk(self, data, start, stop, sep, encoding, numFields, wantTag):
+        """
+        Add the rows in data[start:stop] (the bytes of a mapped file, from the
+        start of a line to the end of a line). See mapFile().
+        """
+        lineStarts, lineEnds = lineSpans(data, start, stop)
+        fields = splitFields(data, lineStarts, lineEnds, ord(sep), numFields)
+        if fields is None:
+            # Not simple enough to scan. Let read_csv() do the chunk.
+            self.addChunk(pd.read_csv(io.BytesIO(data[start:stop].tobytes()), sep=sep,
+                                      encoding=encoding, header=None, dtype=str,
+                                      skipinitialspace=True,
+                                      usecols=[ARCH_ID_COL, ARCH_NAME_COL,
+                                               ARCH_TS_COL, ARCH_VAL_COL]))
+            return
+        fieldStarts, fieldEnds = fields
+        self._rowsRead += lineStarts.size
+
+        # Keep the rows with a valid id
+        ids = parseFloats(data, fieldStarts[:, ARCH_ID_COL], fieldEnds[:, ARCH_ID_COL],
+                          encoding)
+        rows = np.flatnonzero(~np.isnan(ids))
+        ids = ids[rows].astype(np.int64)
+
+        # Decode the tag name of each tag not seen before, at its first row with
+        # a name.
+        names = np.full(rows.size, None, dtype=object)
+        chunkNames = {}
+        named = np.flatnonzero(fieldEnds[rows, ARCH_NAME_COL] > fieldStarts[rows, ARCH_NAME_COL])
+        for tagId, first in zip(*[values.tolist() for values in
+                                  np.unique(ids[named], return_index=True)]):
+            if tagId not in self._names:
+                row = named[first]
+                names[row] = decodeField(data, fieldStarts[rows[row], ARCH_NAME_COL],
+                                         fieldEnds[rows[row], ARCH_NAME_COL], encoding)
+                chunkNames[tagId] = names[row]
+
+        # Drop the rows of the tags not wanted
+        if wantTag is not None:
+            unwanted = []
+            for tagId in np.unique(ids).tolist():
+                tagName = self._names.get(tagId, chunkNames.get(tagId))
+                # A tag without a name yet is kept. It is left out later if need be.
+                if tagName is not None and not wantTag(tagName):
+                    unwanted.append(tagId)
+            if unwanted:
+                keep = ~np.isin(ids, unwanted)
+                rows, ids, names = rows[keep], ids[keep], names[keep]
+
+        # Keep the rows with a valid timestamp
+        ts = self._roundMs(pd.Series(self._mapTimestamps(data,
+                                                         fieldStarts[rows, ARCH_TS_COL],
+                                                         fieldEnds[rows, ARCH_TS_COL],
+                                                         encoding))).values
+        keep = ~np.isnat(ts)
+        if not keep.all():
+            rows, ids, names, ts = rows[keep], ids[keep], names[keep], ts[keep]
+        if not rows.size:
+            return
+
+        # Convert the values in the time range. The others are dropped anyway.
+        vals = np.full(rows.size, np.nan)
+        if self._window is not None and self._window.active:
+            need = self._window.contains(ts)
+        else:
+            need = np.ones(rows.size, dtype=bool)
+        vals[need] = parseFloats(data, fieldStarts[rows[need], ARCH_VAL_COL],
+                                 fieldEnds[rows[need], ARCH_VAL_COL], encoding)
+        self._addTyped(ids, ts, vals, names)
+
+    def _mapTimestamps(self, data, starts, ends, encoding):
+        """
+        Return a datetime64 array of the timestamps in the fields from starts
+        to ends of the mapped file. Those the fixed width parser cannot do
+        (see ftppTimeParse.py) are converted by _toDatetime(). NaT where the
+        timestamp is missing or cannot be converted.
+        """
+        parsed = parseTimeMatrix(fieldMatrix(data, starts, ends), self._sourceTimeFormat)
+        if parsed is None:
+            nsValues = np.zeros(starts.size, dtype=np.int64)
+            parsed = np.zeros(starts.size, dtype=bool)
+        else:
+            nsValues, parsed = parsed
+        ts = nsValues.view('datetime64[ns]')
+        ts[~parsed] = np.datetime64('NaT')
+        slow = np.flatnonzero(~parsed & (ends > starts))
+        if slow.size:
+            strings = pd.Series([decodeField(data, start, end, encoding) for start, end in
+                                 zip(starts[slow].tolist(), ends[slow].tolist())], dtype=object)
+            ts[slow] = np.asarray(self._toDatetime(strings), dtype='datetime64[ns]')
+        return ts
+
+    def tagList(self):
+        """
+        Return a list of (TagId, TagName) tuples sorted by TagId. Ids for
+        which no tag name was ever found are left out.
+        """
+        return [(tagId, self._names[tagId]) for tagId in sorted(self._ts)
+                if tagId in self._names]
+
+    def popTagData(self, tagId, tsName, valName):
+        """
+        Return a data frame of the accumulated data for the specified tag id.
+        The data frame is indexed by timestamp (named tsName), is sorted by
+        timestamp, has duplicate timestamps removed (last one added is kept),
+        and has a single value column named valName.
+
+        The accumulated arrays for the tag are released.
+        """
+        # merge the sorted runs (one per chunk), keeping the last of any
+        # duplicated times
+        ts, vals = mergeSortedRuns(self._ts.pop(tagId, []), self._vals.pop(tagId, []))
+        return pd.DataFrame({valName: vals},
+                            index=pd.DatetimeIndex(ts, name=tsName))
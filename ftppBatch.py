@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppBatch.py
+#
+# Batch processing for ftArchPostProc.
+#
+# Runs ftArchPostProc on a list of input files using a pool of worker
+# processes. Each worker imports the heavy libraries (pandas, numpy ...) once
+# and then processes one file after another, so the interpreter startup and
+# import cost is paid once per worker rather than once per file, and all the
+# cores are used.
+#
+# The input files can be given on the command line, as one or more glob
+# patterns (-g), in a manifest file (-m) with one file name per line, or any
+# combination of these. The output file name for each input is made from a
+# template (-o). The template can use these fields:
+#   {stem}  input file name without the directory and extension
+#   {name}  input file name without the directory
+#   {ext}   input file extension, including the period
+#   {dir}   input file directory
+# The default template is "{stem}_ForExport.csv", and the output file is put in
+# the same directory as the input file unless an output directory (-od) is
+# specified.
+#
+# One of -t, -a, -n, or -s must be specified, and is passed on to
+# ftArchPostProc. Any other ftArchPostProc options can be passed after a
+# "--" argument. For example:
+#   ftppBatch.py -a -g "1711*_Mockup.csv" -j 8 -- -rs 1S -noExportMsg
+#
+# An error while processing one file does not stop the others. The console
+# output for each file is captured, and a summary is printed at the end,
+# including the last lines of output for any file that failed. Use -l to keep
+# the full console output of each file in a log file next to the output file.
+
+# imports
+#
+# system related
+import os
+import sys
+import glob
+import io
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# date and time stuff
+from datetime import datetime
+
+# arg parser
+import argparse
+
+# custom libraries
+# the script that does the work, run in this process (see runOne())
+import ftArchPostProc
+
+# number of lines of console output shown for a failed file
+ERROR_TAIL_LINES = 10
+
+
+def readManifest(manifestName):
+    """
+    Return the list of file names in the manifest file. Blank lines and lines
+    starting with "#" are ignored. Relative file names are relative to the
+    directory of the manifest file.
+    """
+    manifestDir = os.path.dirname(os.path.abspath(manifestName))
+    fileNames = []
+    with open(manifestName, 'r') as manifestFile:
+        for line in manifestFile:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fileNames.append(line if os.path.isabs(line) else
+                             os.path.join(manifestDir, line))
+    return fileNames
+
+
+def outputNameFor(inputName, template, outputDir=None):
+    """
+    Return the output file name for the input file name using the template.
+    """
+    inputDir, name = os.path.split(inputName)
+    stem, ext = os.path.splitext(name)
+    outputName = template.format(stem=stem, name=name, ext=ext, dir=inputDir)
+    if os.path.isabs(outputName):
+        return outputName
+    return os.path.join(outputDir if outputDir is not None else inputDir,
+                        outputName)
+
+
+def runOne(ftppArgs, logName=None):
+    """
+    Run ftArchPostProc in this process with the argument list ftppArgs.
+    Return a (succeeded, console output, duration in seconds) tuple.
+
+    ftArchPostProc.main() returns 1 when it hits an error, so that is treated
+    as a failure, as is an argument error (SystemExit) or any other exception.
+    """
+    console = io.StringIO()
+    succeeded = True
+    procStart = datetime.now()
+    with contextlib.redirect_stdout(console):
+        try:
+            succeeded = ftArchPostProc.main(ftppArgs) == 0
+        except SystemExit as se:
+            succeeded = False
+            print('Exited with: ' + str(se))
+        except Exception as ex:
+            succeeded = False
+            print('ERROR: ' + type(ex).__name__ + ': ' + str(ex))
+    duration = (datetime.now() - procStart).total_seconds()
+    output = console.getvalue()
+    if logName is not None:
+        with open(logName, 'w') as logFile:
+            logFile.write(output)
+    return succeeded, output, duration
+
+
+def main(argv=None):
+    """
+    Parse the arguments, run the files, and print a summary. Return the
+    process exit code: 0 when all files succeeded, 1 otherwise.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    # Everything after "--" is passed on to ftArchPostProc as is
+    if '--' in argv:
+        sepIdx = argv.index('--')
+        argv, ftppExtra = argv[:sepIdx], argv[sepIdx + 1:]
+    else:
+        ftppExtra = []
+
+    descrStr = 'Run ftArchPostProc on many files using a pool of worker processes.'
+    parser = argparse.ArgumentParser(description=descrStr,
+        epilog='Options after "--" are passed on to ftArchPostProc.')
+    parser.add_argument('inputFileNames', nargs='*', metavar='inputFileName',
+                        help='Input data file(s) (csv).')
+    parser.add_argument('-g', '--glob', action='append', default=[], metavar='',
+                        help='Glob pattern for input files. Can be repeated.')
+    parser.add_argument('-m', '--manifest', action='append', default=[], metavar='',
+                        help='File listing input file names, one per line. \
+Can be repeated.')
+    parser.add_argument('-o', '--outputTemplate', default='{stem}_ForExport.csv',
+                        metavar='', help='Output file name template. Fields: \
+{stem}, {name}, {ext}, {dir}. Default is "{stem}_ForExport.csv".')
+    parser.add_argument('-od', '--outputDir', default=None, metavar='',
+                        help='Directory for the output files. Default is the \
+directory of each input file.')
+    parser.add_argument('-j', '--jobs', default=os.cpu_count(), type=int, metavar='',
+                        help='Number of worker processes. Default is the \
+number of cores.')
+    parser.add_argument('-l', '--log', action='store_true', default=False,
+                        help='Keep the console output of each file in a \
+".log" file next to its output file.')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False,
+                        help='Print the console output of each file as it \
+completes.')
+    typegroup = parser.add_mutually_exclusive_group(required=True)
+    typegroup.add_argument('-t', action='store_true', default=False,
+                           help='Historical trend input file type (format).')
+    typegroup.add_argument('-a', action='store_true', default=False,
+                           help='Archive data input file type (format).')
+    typegroup.add_argument('-n', action='store_true', default=False,
+                           help='Time normalized input file type (format).')
+    typegroup.add_argument('-s', action='store_true', default=False,
+                           help='Strain gauge input file type (format).')
+    args = parser.parse_args(argv)
+
+    typeFlag = '-t' if args.t else '-a' if args.a else '-n' if args.n else '-s'
+
+    # Gather the input files, in order, without duplicates
+    inputNames = list(args.inputFileNames)
+    for pattern in args.glob:
+        inputNames.extend(sorted(glob.glob(pattern)))
+    for manifestName in args.manifest:
+        try:
+            inputNames.extend(readManifest(manifestName))
+        except OSError as oe:
+            print('ERROR: Unable to read the manifest file "' + manifestName + '".')
+            print(oe)
+            return 1
+    seen = set()
+    jobs = []
+    for inputName in inputNames:
+        if inputName in seen:
+            continue
+        seen.add(inputName)
+        if not os.path.isfile(inputName):
+            print(inputName + ' does not exist. Skipping it.')
+            continue
+        outputName = outputNameFor(inputName, args.outputTemplate, args.outputDir)
+        jobs.append((inputName, outputName))
+
+    if not jobs:
+        print('ERROR: No input files found. Nothing to do.')
+        return 1
+    if args.outputDir is not None:
+        os.makedirs(args.outputDir, exist_ok=True)
+
+    jobCount = max(1, min(args.jobs if args.jobs else 1, len(jobs)))
+    print('**** Begin Batch Processing ****')
+    batchStart = datetime.now()
+    print('    ' + str(len(jobs)) + ' files, ' + str(jobCount) + ' worker processes.')
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobCount) as pool:
+        futures = {}
+        for inputName, outputName in jobs:
+            ftppArgs = [typeFlag, inputName, outputName] + ftppExtra
+            logName = outputName + '.log' if args.log else None
+            futures[pool.submit(runOne, ftppArgs, logName)] = (inputName, outputName)
+        for doneCount, future in enumerate(as_completed(futures), 1):
+            inputName, outputName = futures[future]
+            try:
+                succeeded, output, duration = future.result()
+            except Exception as ex:
+                # the worker itself failed (killed, out of memory ...)
+                succeeded, output, duration = False, 'ERROR: ' + str(ex), 0.0
+            results[inputName] = (succeeded, output, duration)
+            print('[' + str(doneCount) + '/' + str(len(jobs)) + '] ' +
+                  ('ok    ' if succeeded else 'FAILED') + ' ' + inputName +
+                  ' -> ' + outputName + ' (' + '{:.1f}'.format(duration) + ' s)')
+            if args.verbose:
+                print(output)
+
+    # **** Summary
+    failed = [inputName for inputName, _ in jobs if not results[inputName][0]]
+    print('\n**** Batch Summary ****')
+    print('    Succeeded: ' + str(len(jobs) - len(failed)))
+    print('    Failed: ' + str(len(failed)))
+    for inputName in failed:
+        print('\n    ' + inputName + ':')
+        for line in results[inputName][1].rstrip().splitlines()[-ERROR_TAIL_LINES:]:
+            print('        ' + line)
+    print('    Duration: ' + str(datetime.now() - batchStart) + '\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
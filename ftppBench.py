@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppBench.py
+#
+# Benchmarks for ftArchPostProc.
+#
+# Makes synthetic source files of each file type (see ftppSynth.py), runs
+# ftArchPostProc on them with the per stage profiling report (--profile, see
+# ftppProfile.py), and prints the time and peak memory of each run and of each
+# stage (read, timestamps, build, resample, align, write ...).
+#
+# The results can be saved as a baseline (-sb), and later runs compared with
+# it. A run or stage which takes more than the tolerance (-tol, a fraction)
+# longer, or uses more than the tolerance more peak memory, than the baseline
+# is reported as a regression, and the exit code is then 1. Stages which take
+# less than MIN_COMPARE_SECONDS are not compared, since their times are mostly
+# noise. A baseline is only meaningful on the machine it was made on.
+#
+# The size of the files is given by a preset (-sz), and any of its settings can
+# be changed with the other options:
+#
+#   preset   samples  tags
+#   tiny     1e3      10
+#   small    1e5      100
+#   medium   1e6      1000
+#   large    1e7      1000
+#   huge     1e8      10000
+#
+# The samples are split evenly over the input file and the merge files (-mc).
+# The generated files are kept in the work directory (-wd), and used again by
+# later runs with the same settings. Each ftArchPostProc run is a process of
+# its own, so the peak memory of one run does not carry over to the next.
+#
+# Any other ftArchPostProc options can be passed after a "--" argument, and are
+# used for every run. For example, to benchmark memory mapped reading:
+#   ftppBench.py -sz small -f a -- -mm
+#
+# The baseline has an entry for each run, named from the file type, size and
+# ftArchPostProc options, so a baseline can hold the results of several
+# settings, and only the runs in both are compared.
+#
+# The startup time of ftArchPostProc is measured too: the time to print the
+# help (-h), less the time to start python alone, which is mostly the time to
+# import what is needed to parse the arguments. It is checked against a fixed
+# budget (-stb, STARTUP_BUDGET seconds) rather than the baseline, since the
+# heavy libraries are only imported when files are processed, and importing
+# them before the arguments are checked makes it several times longer.
+
+# imports
+#
+# system related
+import os
+import sys
+import json
+import time
+import subprocess
+
+# date and time stuff
+from datetime import datetime
+
+# arg parser
+import argparse
+
+# custom libraries
+# synthetic source files
+from ftppSynth import generateSet, SYNTH_TYPES
+
+# the script that does the work, expected to be next to this one
+FTPP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'ftArchPostProc.py')
+# size presets: (samples, tags)
+BENCH_SIZES = {'tiny': (10**3, 10),
+               'small': (10**5, 100),
+               'medium': (10**6, 1000),
+               'large': (10**7, 1000),
+               'huge': (10**8, 10000)}
+# times shorter than this are not compared with the baseline
+MIN_COMPARE_SECONDS = 0.1
+# number of lines of console output shown for a failed run
+ERROR_TAIL_LINES = 10
+# seconds the help (-h) can take, more than python alone, and times measured
+STARTUP_BUDGET = 0.25
+STARTUP_REPEATS = 5
+
+
+def measureStartup(repeats=STARTUP_REPEATS):
+    """
+    Return a tuple of the shortest of repeats times (seconds) to run
+    ftArchPostProc with the help (-h) option, and to start python alone.
+    """
+    def _shortest(command):
+        times = []
+        for _ in range(repeats):
+            runStart = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - runStart)
+        return min(times)
+
+    return _shortest([sys.executable, FTPP_SCRIPT, '-h']), \
+        _shortest([sys.executable, '-c', 'pass'])
+
+
+def runCase(fileType, inputName, mergeNames, workDir, ftppExtra):
+    """
+    Run ftArchPostProc on the input file and merge files in a process of its
+    own, and return a tuple of the profiling report (a dictionary, None if the
+    run failed) and the console output.
+    """
+    outputName = os.path.join(workDir, 'bench_out.csv')
+    reportName = os.path.join(workDir, 'bench_profile.json')
+    if os.path.exists(reportName):
+        os.remove(reportName)
+    ftppArgs = ['-' + fileType, inputName, outputName]
+    for mergeName in mergeNames:
+        ftppArgs += ['-am', mergeName]
+    ftppArgs += ['-pf', reportName] + ftppExtra
+    completed = subprocess.run([sys.executable, FTPP_SCRIPT] + ftppArgs,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True)
+    report = None
+    # ftArchPostProc exits with 1 when it stops on an error, and then there is
+    # no report
+    if completed.returncode == 0 and os.path.exists(reportName):
+        with open(reportName, 'r') as reportFile:
+            report = json.load(reportFile)
+    return report, completed.stdout
+
+
+def summarize(report):
+    """
+    Return the result of a run from its profiling report: a dictionary with
+    the total wall time and peak memory, and the wall time and peak memory of
+    each stage.
+    """
+    return {'wallSeconds': report['wallSeconds'],
+            'peakRssBytes': report['peakRssBytes'],
+            'tracedPeakBytes': report['tracedPeakBytes'],
+            'stages': {stage['stage']: {'wallSeconds': stage['wallSeconds'],
+                                        'rowsPerSec': stage['rowsPerSec'],
+                                        'tracedPeakBytes': stage['tracedPeakBytes']}
+                       for stage in report['stages']}}
+
+
+def compareResult(result, baseResult, tolerance):
+    """
+    Return a list of the regressions (strings) of a run result compared with
+    its baseline result.
+    """
+    regressions = []
+
+    def _check(label, value, baseValue, isTime):
+        if value is None or baseValue is None:
+            return
+        if isTime and max(value, baseValue) < MIN_COMPARE_SECONDS:
+            return
+        if baseValue > 0 and value > baseValue * (1 + tolerance):
+            regressions.append(label + ' ' + _format(value, isTime) + ' (baseline ' +
+                               _format(baseValue, isTime) + ', +' +
+                               '{:.0f}'.format(100 * (value / baseValue - 1)) + '%)')
+
+    _check('total time', result['wallSeconds'], baseResult['wallSeconds'], True)
+    _check('peak memory', result['peakRssBytes'], baseResult['peakRssBytes'], False)
+    for stage, timings in result['stages'].items():
+        baseTimings = baseResult['stages'].get(stage)
+        if baseTimings is None:
+            continue
+        _check(stage + ' time', timings['wallSeconds'], baseTimings['wallSeconds'], True)
+        _check(stage + ' memory', timings['tracedPeakBytes'],
+               baseTimings['tracedPeakBytes'], False)
+    return regressions
+
+
+def _format(value, isTime):
+    """
+    Return a time (seconds) or memory (bytes) value as a short string.
+    """
+    if value is None:
+        return '-'
+    if isTime:
+        return '{:.3f} s'.format(value)
+    return '{:.1f} MB'.format(value / 2**20)
+
+
+def main(argv=None):
+    """
+    Parse the arguments, make the files, run the benchmarks, and print the
+    results. Return the process exit code: 0 when all the runs succeeded with
+    no regressions and the startup is within its budget, 1 otherwise.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    # Everything after "--" is passed on to ftArchPostProc as is
+    if '--' in argv:
+        sepIdx = argv.index('--')
+        argv, ftppExtra = argv[:sepIdx], argv[sepIdx + 1:]
+    else:
+        ftppExtra = []
+
+    descrStr = 'Benchmark ftArchPostProc on synthetic files of each file type.'
+    parser = argparse.ArgumentParser(description=descrStr,
+        epilog='Options after "--" are passed on to ftArchPostProc.')
+    parser.add_argument('-f', '--fileTypes', default=''.join(SYNTH_TYPES), metavar='',
+                        help='File types to benchmark, any of t, a, n and s. \
+Default is "tans" (all of them).')
+    parser.add_argument('-sz', '--size', default='small', choices=sorted(BENCH_SIZES),
+                        metavar='', help='Size preset: ' + ', '.join(
+                            name + ' (' + str(rows) + ' samples, ' + str(tags) + ' tags)'
+                            for name, (rows, tags) in sorted(BENCH_SIZES.items(),
+                                                             key=lambda item: item[1])) +
+                        '. Default is small.')
+    parser.add_argument('-r', '--rows', default=None, type=int, metavar='',
+                        help='Number of samples, over all the tags and files. \
+Default is from the size preset.')
+    parser.add_argument('-tc', '--tagCount', default=None, type=int, metavar='',
+                        help='Number of tags. Default is from the size preset.')
+    parser.add_argument('-sr', '--sampleRate', default=1.0, type=float, metavar='',
+                        help='Seconds between the samples of a tag. Default is 1.')
+    parser.add_argument('-jt', '--jitter', default=0.0, type=float, metavar='',
+                        help='Random shift of each sample time, up to this \
+fraction of the seconds between samples. Default is 0 (evenly spaced).')
+    parser.add_argument('-mc', '--mergeCount', default=0, type=int, metavar='',
+                        help='Number of merge files, besides the input file. \
+Default is 0.')
+    parser.add_argument('-sd', '--seed', default=0, type=int, metavar='',
+                        help='Random seed for the files. Default is 0.')
+    parser.add_argument('-wd', '--workDir', default='ftppBenchData', metavar='',
+                        help='Directory for the generated and output files. \
+Default is "ftppBenchData".')
+    parser.add_argument('-b', '--baseline', default=None, metavar='',
+                        help='Baseline results (json) file to compare with.')
+    parser.add_argument('-sb', '--saveBaseline', action='store_true', default=False,
+                        help='Save the results in the baseline file (-b), \
+replacing the results of the same runs, instead of comparing with it.')
+    parser.add_argument('-tol', '--tolerance', default=0.25, type=float, metavar='',
+                        help='Fraction a time or memory use can be more than the \
+baseline before it is a regression. Default is 0.25.')
+    parser.add_argument('-stb', '--startupBudget', default=STARTUP_BUDGET, type=float,
+                        metavar='', help='Seconds the ftArchPostProc help (-h) can \
+take, more than starting python alone. Default is ' + str(STARTUP_BUDGET) + '.')
+    parser.add_argument('-o', '--output', default=None, metavar='',
+                        help='Also save the results in this (json) file.')
+    args = parser.parse_args(argv)
+
+    fileTypes = [fileType for fileType in args.fileTypes if fileType in SYNTH_TYPES]
+    if not fileTypes or len(fileTypes) != len(args.fileTypes):
+        print('ERROR: The file types must be some of "' + ''.join(SYNTH_TYPES) + '".')
+        return 1
+    if args.saveBaseline and args.baseline is None:
+        print('ERROR: A baseline file (-b) is needed to save the baseline.')
+        return 1
+    presetRows, presetTags = BENCH_SIZES[args.size]
+    rows = args.rows if args.rows is not None else presetRows
+    tags = args.tagCount if args.tagCount is not None else presetTags
+    if rows < 1 or tags < 1 or args.sampleRate <= 0 or args.mergeCount < 0:
+        print('ERROR: The samples, tags and sample rate must be more than 0, \
+and the merge count can not be negative.')
+        return 1
+
+    baseline = {}
+    if args.baseline is not None and os.path.exists(args.baseline):
+        try:
+            with open(args.baseline, 'r') as baseFile:
+                baseline = json.load(baseFile)
+        except (OSError, ValueError) as ex:
+            print('ERROR: Unable to read the baseline file "' + args.baseline + '".')
+            print(ex)
+            return 1
+    os.makedirs(args.workDir, exist_ok=True)
+
+    print('**** Begin Benchmarks ****')
+    benchStart = datetime.now()
+    print('    ' + str(rows) + ' samples, ' + str(tags) + ' tags, ' +
+          str(args.mergeCount) + ' merge files.')
+    helpTime, pythonTime = measureStartup()
+    startupTime = helpTime - pythonTime
+    overBudget = startupTime > args.startupBudget
+    print('    Startup (-h): ' + _format(helpTime, True) + ', ' + _format(startupTime, True) +
+          ' more than python alone (budget ' + _format(args.startupBudget, True) + ').')
+    results = {}
+    failed = []
+    regressions = {}
+    for fileType in fileTypes:
+        caseName = ' '.join(['-' + fileType, 'r' + str(rows), 't' + str(tags),
+                             'sr' + str(args.sampleRate), 'j' + str(args.jitter),
+                             'm' + str(args.mergeCount)] + ftppExtra)
+        genStart = datetime.now()
+        inputName, mergeNames = generateSet(fileType, args.workDir, rows, tags,
+                                            args.sampleRate, args.jitter,
+                                            args.mergeCount, args.seed)
+        genDuration = (datetime.now() - genStart).total_seconds()
+        report, output = runCase(fileType, inputName, mergeNames, args.workDir, ftppExtra)
+        if report is None:
+            failed.append(caseName)
+            print('\n' + caseName + ': FAILED')
+            for line in output.rstrip().splitlines()[-ERROR_TAIL_LINES:]:
+                print('        ' + line)
+            continue
+        result = summarize(report)
+        results[caseName] = result
+        print('\n' + caseName + ' (files ready in ' + '{:.1f}'.format(genDuration) + ' s)')
+        baseResult = baseline.get(caseName) if not args.saveBaseline else None
+        print('    {:<14}{:>12}{:>14}{:>14}{:>12}'.format(
+            'stage', 'time', 'rows/s', 'traced peak', 'baseline'))
+        for stage, timings in result['stages'].items():
+            baseTime = None
+            if baseResult is not None and stage in baseResult['stages']:
+                baseTime = baseResult['stages'][stage]['wallSeconds']
+            print('    {:<14}{:>12}{:>14}{:>14}{:>12}'.format(
+                stage, _format(timings['wallSeconds'], True),
+                '-' if timings['rowsPerSec'] is None
+                else '{:.0f}'.format(timings['rowsPerSec']),
+                _format(timings['tracedPeakBytes'], False),
+                _format(baseTime, True) if baseTime is not None else ''))
+        print('    {:<14}{:>12}{:>14}{:>14}{:>12}'.format(
+            'total', _format(result['wallSeconds'], True), '',
+            _format(result['peakRssBytes'], False) + ' rss',
+            _format(baseResult['wallSeconds'], True) if baseResult is not None else ''))
+        if baseResult is not None:
+            caseRegressions = compareResult(result, baseResult, args.tolerance)
+            if caseRegressions:
+                regressions[caseName] = caseRegressions
+
+    if args.saveBaseline and results:
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseFile:
+            json.dump(baseline, baseFile, indent=2)
+        print('\nSaved the results in the baseline file "' + args.baseline + '".')
+    if args.output is not None:
+        with open(args.output, 'w') as outFile:
+            json.dump(results, outFile, indent=2)
+
+    # **** Summary
+    print('\n**** Benchmark Summary ****')
+    print('    Runs: ' + str(len(results)))
+    print('    Failed: ' + str(len(failed)))
+    if args.baseline is not None and not args.saveBaseline:
+        compared = [caseName for caseName in results if caseName in baseline]
+        print('    Compared with the baseline: ' + str(len(compared)))
+        print('    Regressions: ' + str(len(regressions)))
+        for caseName, caseRegressions in regressions.items():
+            print('\n    ' + caseName + ':')
+            for regression in caseRegressions:
+                print('        ' + regression)
+    if overBudget:
+        print('    Startup over budget: ' + _format(startupTime, True) + ' (budget ' +
+              _format(args.startupBudget, True) + ')')
+    print('    Duration: ' + str(datetime.now() - benchStart) + '\n')
+    return 1 if failed or regressions or overBudget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppCache.py
+#
+# On disk cache of parsed input data for ftArchPostProc.
+#
+# Reading, merging and converting the source csv files is usually the most
+# expensive part of a run, and the same source files are often processed many
+# times with different -st/-et/-rs/-stats/-vq options. Those options are all
+# applied after the source data has been parsed into typed, per tag data, so
+# the parsed data can be cached and reused.
+#
+# Each cache entry holds the per tag data (instrument name, timestamp
+# index and values) for one combination of source files and parse options,
+# stored in a numpy .npz file as one column per field: all timestamps (int64
+# ns) concatenated, and the offsets where each tag starts. The values keep
+# their type (e.g. the int64 values of an all integer -n or -t tag), so the
+# output is the same with or without the cache. The values of each type are
+# concatenated into one array per type, and each tag has its type and the
+# offset where its values start in that array.
+#
+# The key of an entry is made from the size, modification time and content
+# hash of the input file and each merge file, plus the parse options. A file
+# which changes in any way gets a new key. The total size of the cache is
+# limited, and the least recently used entries are removed to stay under the
+# limit.
+
+# imports
+#
+# system related
+import os
+import json
+import hashlib
+import tempfile
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# cache file name suffix
+CACHE_SUFFIX = '.npz'
+# file holding content hashes of source files, so unchanged files do not
+# need to be hashed again
+HASH_MEMO_NAME = 'fileHashes.json'
+# read size used when hashing a file
+HASH_BLOCK_SIZE = 1 << 20
+# prefix of the entry array names holding the values of each type
+VALS_PREFIX = 'vals_'
+
+
+def replaceFile(fileName, write, mode='w'):
+    """
+    Write a file by way of a temporary file, so a partly written file is
+    never used. write(file) writes the temporary file, which is opened with
+    the mode, and it is then moved into place as fileName. The temporary file
+    has a unique name in the same directory, so processes writing the same
+    file do not write to each other's temporary files. It is removed if the
+    write fails, and the exception raised again.
+    """
+    tmpFd, tmpName = tempfile.mkstemp(suffix='.tmp',
+                                      dir=os.path.dirname(os.path.abspath(fileName)))
+    try:
+        with os.fdopen(tmpFd, mode) as tmpFile:
+            write(tmpFile)
+        os.replace(tmpName, fileName)
+    except BaseException:
+        try:
+            os.remove(tmpName)
+        except OSError:
+            pass
+        raise
+
+
+class ParseCache(object):
+    """
+    On disk cache of parsed (typed, per tag) source data.
+
+    cacheDir -- Directory holding the cache files. It is created if needed.
+
+    maxMB -- Size limit of the cache in megabytes. The least recently used
+             entries are removed when the limit is exceeded.
+    """
+    def __init__(self, cacheDir, maxMB=1024):
+        self._cacheDir = cacheDir
+        self._maxBytes = int(maxMB * (1 << 20))
+        os.makedirs(cacheDir, exist_ok=True)
+        self._memoFile = os.path.join(cacheDir, HASH_MEMO_NAME)
+
+    def _loadHashMemo(self):
+        try:
+            with open(self._memoFile, 'r') as memoFile:
+                return json.load(memoFile)
+        except (OSError, ValueError):
+            return {}
+
+    def _saveHashMemo(self, memo):
+        replaceFile(self._memoFile, lambda memoFile: json.dump(memo, memoFile))
+
+    def fileSignature(self, fileName, memo):
+        """
+        Return a list of [size, modification time (ns), content hash] for the
+        file. The content hash is taken from the memo if the size and
+        modification time have not changed, otherwise the file is hashed and
+        the memo updated. An OSError is raised if the file cannot be read.
+        """
+        stat = os.stat(fileName)
+        memoKey = os.path.abspath(fileName)
+        signature = memo.get(memoKey)
+        if signature is None or signature[0] != stat.st_size \
+                or signature[1] != stat.st_mtime_ns:
+            hasher = hashlib.blake2b(digest_size=20)
+            with open(fileName, 'rb') as srcFile:
+                for block in iter(lambda: srcFile.read(HASH_BLOCK_SIZE), b''):
+                    hasher.update(block)
+            signature = [stat.st_size, stat.st_mtime_ns, hasher.hexdigest()]
+            memo[memoKey] = signature
+        return signature
+
+    def key(self, fileNames, options):
+        """
+        Return the cache key for the list of source files (input file first,
+        then the merge files in order) and the dictionary of parse options.
+        An OSError is raised if a file cannot be read.
+        """
+        memo = self._loadHashMemo()
+        signatures = [self.fileSignature(fileName, memo) for fileName in fileNames]
+        self._saveHashMemo(memo)
+        keySource = json.dumps({'files': signatures, 'options': options},
+                               sort_keys=True)
+        return hashlib.sha256(keySource.encode('utf-8')).hexdigest()
+
+    def _entryName(self, key):
+        return os.path.join(self._cacheDir, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        """
+        Return the cached list of (instrument name, data frame) tuples for the
+        key, or None if there is no (usable) entry. Each data frame is indexed
+        by timestamp and has a single value column, of the type it was stored
+        with. The entry is marked as recently used.
+        """
+        entryName = self._entryName(key)
+        try:
+            with np.load(entryName, allow_pickle=False) as entry:
+                names = entry['names'].tolist()
+                tsLabels = entry['tsLabels'].tolist()
+                valLabels = entry['valLabels'].tolist()
+                starts = entry['starts']
+                ts = entry['ts']
+                valTypes = entry['valTypes'].tolist()
+                valStarts = entry['valStarts']
+                vals = {valType: entry[VALS_PREFIX + valType]
+                        for valType in set(valTypes)}
+        except (OSError, KeyError, ValueError):
+            return None
+        # mark the entry as recently used. Another process sharing the cache
+        # directory may have evicted it since it was read.
+        try:
+            os.utime(entryName)
+        except FileNotFoundError:
+            pass
+
+        srcTags = []
+        for tagNum, instName in enumerate(names):
+            start, stop = starts[tagNum], starts[tagNum + 1]
+            valStart = valStarts[tagNum]
+            index = pd.DatetimeIndex(ts[start:stop].view('datetime64[ns]'),
+                                     name=tsLabels[tagNum])
+            tagVals = vals[valTypes[tagNum]][valStart:valStart + stop - start]
+            srcTags.append((instName,
+                            pd.DataFrame({valLabels[tagNum]: tagVals},
+                                         index=index)))
+        return srcTags
+
+    def store(self, key, srcTags):
+        """
+        Store the list of (instrument name, data frame) tuples for the key,
+        and then remove the least recently used entries if the cache is over
+        its size limit. Integer, bool and float values keep their type, and
+        other values are stored as float64.
+        """
+        names = []
+        tsLabels = []
+        valLabels = []
+        tsParts = []
+        starts = [0]
+        valTypes = []
+        valStarts = []
+        # value type -> list of value arrays, and their total length
+        valParts = {}
+        valSizes = {}
+        for instName, df_data in srcTags:
+            names.append(str(instName))
+            tsLabels.append(str(df_data.index.name))
+            valLabels.append(str(df_data.columns[0]))
+            tsParts.append(np.asarray(df_data.index.values,
+                                      dtype='datetime64[ns]').view(np.int64))
+            starts.append(starts[-1] + len(df_data.index))
+            vals = np.asarray(df_data.iloc[:, 0].values)
+            if vals.dtype.kind not in 'biuf':
+                vals = vals.astype(np.float64)
+            valType = str(vals.dtype)
+            valTypes.append(valType)
+            valStarts.append(valSizes.get(valType, 0))
+            valParts.setdefault(valType, []).append(vals)
+            valSizes[valType] = valStarts[-1] + vals.size
+
+        entryVals = {VALS_PREFIX + valType: np.concatenate(parts)
+                     for valType, parts in valParts.items()}
+        entryName = self._entryName(key)
+        replaceFile(entryName,
+            lambda entryFile: np.savez(entryFile,
+                names=np.array(names, dtype=str),
+                tsLabels=np.array(tsLabels, dtype=str),
+                valLabels=np.array(valLabels, dtype=str),
+                starts=np.array(starts, dtype=np.int64),
+                ts=np.concatenate(tsParts) if tsParts else np.array([], dtype=np.int64),
+                valTypes=np.array(valTypes, dtype=str),
+                valStarts=np.array(valStarts, dtype=np.int64),
+                **entryVals),
+            'wb')
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is within its
+        size limit. Entries removed by another process sharing the cache
+        directory in the meantime are skipped.
+        """
+        entries = []
+        for fileName in os.listdir(self._cacheDir):
+            if fileName.endswith(CACHE_SUFFIX):
+                entryName = os.path.join(self._cacheDir, fileName)
+                try:
+                    stat = os.stat(entryName)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entryName))
+        totalBytes = sum(entry[1] for entry in entries)
+        # oldest (least recently used) first
+        for _, entryBytes, entryName in sorted(entries):
+            if totalBytes <= self._maxBytes:
+                break
+            try:
+                os.remove(entryName)
+            except FileNotFoundError:
+                pass
+            totalBytes -= entryBytes
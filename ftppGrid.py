@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppGrid.py
+#
+# Output timestamp grid (-gm/-gs) for ftArchPostProc.
+#
+# The output timestamps are normally a dense date range: every resample period
+# (-rs, or the shortest instrument sample period) from the start to the end
+# time. One fast tag over a long time span then makes many rows, most of them
+# only repeating the last value of every instrument.
+#
+# The "events" grid here is instead the sorted union of the times at which the
+# instruments have samples, each rounded down (floored) to the resample
+# period, so each is the time of a dense grid row. The output is then the rows
+# of the dense output at which at least one instrument has a sample, and its
+# size follows the number of samples rather than the time span. The grid can
+# also be thinned to a minimum spacing: the first time is kept, then the next
+# time at least the spacing after it, and so on.
+#
+# The resample period and the spacing must be fixed periods (seconds, minutes
+# ...). Calendar periods (months, weeks ...) do not have a fixed length, and
+# cannot be used for the events grid.
+
+# imports
+#
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+# output timestamp grid modes (-gm)
+GRID_MODES = ['dense', 'events']
+
+
+def fixedNanos(period):
+    """
+    Return the length of the period (a pandas offset, Timedelta or offset
+    string) in ns, or None if it is not a fixed period (e.g. months).
+    """
+    try:
+        nanos = pd.Timedelta(to_offset(period)).value
+    except (ValueError, TypeError):
+        return None
+    return nanos if nanos > 0 else None
+
+
+def eventTimes(index, periodNanos):
+    """
+    Return the times of the DatetimeIndex floored to the period (ns), as a
+    sorted int64 ns array without duplicates.
+    """
+    times = np.asarray(index.values, dtype='datetime64[ns]').view(np.int64)
+    # numpy integer division rounds down, so times before 1970 are floored too
+    return np.unique(times // periodNanos * periodNanos)
+
+
+def unionTimes(timeArrays):
+    """
+    Return the sorted union (int64 ns array without duplicates) of the sorted
+    int64 ns arrays.
+    """
+    timeArrays = [times for times in timeArrays if len(times)]
+    if not timeArrays:
+        return np.empty(0, dtype=np.int64)
+    if len(timeArrays) == 1:
+        return timeArrays[0]
+    return np.unique(np.concatenate(timeArrays))
+
+
+def thinTimes(times, spacingNanos):
+    """
+    Return the sorted int64 ns times thinned so no two are closer than the
+    spacing (ns): the first time, then the first time at least the spacing
+    after it, and so on.
+    """
+    keep = []
+    pos = 0
+    while pos < len(times):
+        keep.append(pos)
+        pos = int(np.searchsorted(times, times[pos] + spacingNanos, side='left'))
+    return times[keep]
+
+
+def eventGrid(timeArrays, startTime, endTime, spacingNanos=None, firstTime=None):
+    """
+    Return the events grid as a DatetimeIndex: the union of the sample times
+    (int64 ns arrays, see eventTimes()) from startTime to endTime, inclusive,
+    thinned to the spacing (ns) if it is not None. firstTime, if not None, is
+    always in the grid (e.g. the last time already written in incremental
+    mode).
+    """
+    times = unionTimes(timeArrays)
+    first = np.searchsorted(times, pd.Timestamp(startTime).value, side='left')
+    last = np.searchsorted(times, pd.Timestamp(endTime).value, side='right')
+    times = times[first:last]
+    if firstTime is not None:
+        times = unionTimes([np.array([pd.Timestamp(firstTime).value], dtype=np.int64),
+                            times])
+    if spacingNanos is not None:
+        times = thinTimes(times, spacingNanos)
+    return pd.DatetimeIndex(times.view('datetime64[ns]'))
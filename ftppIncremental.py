@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppIncremental.py
+#
+# Incremental (append) mode for ftArchPostProc.
+#
+# When new exports arrive every few hours, regenerating the whole output file
+# each time costs more with every export. In incremental mode (-inc) the output
+# file is appended to instead. A small state file is kept next to the output
+# file (the output file name plus ".ftppstate"), holding:
+#
+#   - the watermark: the last timestamp written to the output file, and the
+#     position in the file where that row starts
+#   - for each instrument, the latest source timestamp processed
+#   - the sample period (-rs) and stats (-stats) the output was made with
+#   - the output column names and types
+#   - for each instrument, the last resampled row before the watermark
+#
+# The source rows of each instrument at or after the watermark are kept in a
+# numpy .npz file next to the state file (the state file name plus ".npz").
+#
+# The sample period of the last row written may not be complete yet (more
+# source rows for it can arrive in the next export), so the next run removes
+# that row from the output file and writes it again. For each instrument, only
+# the source rows after the latest one processed for it are used, along with
+# the source rows kept for the last row. If an instrument has new source rows
+# before the watermark, the rows already written would change, so the whole
+# output file is written again instead. The output is a backward "as of"
+# merge, so a grid time takes the last instrument value at or before it. The
+# last resampled row of each instrument is carried forward, so grid times
+# before an instrument's first new value get the same value a full
+# regeneration would give them.
+# Instruments with no new data are carried forward as well, so the columns of
+# the output do not change. The appended output is the same as a full run.
+#
+# The state is only used if the output file is the same as when the state was
+# saved (same size and modification time). Otherwise the whole output file is
+# written again, and a new state saved.
+
+# imports
+#
+# system related
+import os
+import json
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+# custom libraries
+# writing a file by way of a temporary file
+from ftppCache import replaceFile
+
+# state file name suffix, added to the output file name
+STATE_SUFFIX = '.ftppstate'
+# source rows file name suffix, added to the state file name
+SOURCES_SUFFIX = '.npz'
+# state file layout version
+STATE_VERSION = 2
+
+
+def stateFileName(outputFileName):
+    """
+    Return the name of the state file for the output file.
+    """
+    return outputFileName + STATE_SUFFIX
+
+
+def sourcesFileName(outputFileName):
+    """
+    Return the name of the file holding the source rows kept for the output
+    file.
+    """
+    return stateFileName(outputFileName) + SOURCES_SUFFIX
+
+
+def _fileSignature(fileName):
+    """
+    Return [size, modification time (ns)] of the file. An OSError is raised
+    if the file cannot be read.
+    """
+    stat = os.stat(fileName)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _jsonValue(value):
+    """
+    Return the numpy or python scalar as a json value. NaN is None.
+    """
+    if pd.isna(value):
+        return None
+    if isinstance(value, (np.integer, int)):
+        return int(value)
+    return float(value)
+
+
+def _packRows(df_data):
+    """
+    Return the timestamp indexed data frame as a json-able dictionary of the
+    index name, timestamps (int ns), and the name, type and values of each
+    column.
+    """
+    return {'tsName': df_data.index.name,
+            'ts': np.asarray(df_data.index.values, dtype='datetime64[ns]')
+                    .view(np.int64).tolist(),
+            'columns': [str(col) for col in df_data.columns],
+            'dtypes': [str(dtype) for dtype in df_data.dtypes],
+            'values': [[_jsonValue(value) for value in df_data[col].tolist()]
+                       for col in df_data.columns]}
+
+
+def _unpackRows(packed):
+    """
+    Return the timestamp indexed data frame of the _packRows() dictionary,
+    with the column types it had.
+    """
+    index = pd.DatetimeIndex(np.array(packed['ts'], dtype=np.int64)
+                               .view('datetime64[ns]'), name=packed['tsName'])
+    return pd.DataFrame({col: np.array([np.nan if value is None else value
+                                        for value in values], dtype=dtype)
+                         for col, dtype, values in zip(packed['columns'],
+                                                       packed['dtypes'],
+                                                       packed['values'])},
+                        index=index)
+
+
+def _saveSources(fileName, sources):
+    """
+    Save the dictionary of instrument name -> timestamp indexed data frame
+    in the numpy .npz file, with the timestamps (int64 ns) and each column of
+    an instrument as arrays named by the instrument's position. Return the
+    json-able list of [instrument name, index name, column names] for
+    _loadSources(), in the same order.
+    """
+    labels = []
+    arrays = {}
+    for instNum, (instName, df_data) in enumerate(sources.items()):
+        labels.append([instName, df_data.index.name,
+                       [str(col) for col in df_data.columns]])
+        arrays['ts' + str(instNum)] = np.asarray(df_data.index.values,
+                                                 dtype='datetime64[ns]').view(np.int64)
+        for colNum in range(len(df_data.columns)):
+            arrays['v' + str(instNum) + '_' + str(colNum)] = \
+                np.asarray(df_data.iloc[:, colNum].values)
+    replaceFile(fileName, lambda srcFile: np.savez(srcFile, **arrays), 'wb')
+    return labels
+
+
+def _loadSources(fileName, labels):
+    """
+    Return the dictionary of instrument name -> timestamp indexed data frame
+    saved by _saveSources() in the numpy .npz file, given the list it returned.
+    An OSError, KeyError or ValueError is raised if the file cannot be read.
+    """
+    sources = {}
+    with np.load(fileName, allow_pickle=False) as srcFile:
+        for instNum, (instName, tsName, columns) in enumerate(labels):
+            index = pd.DatetimeIndex(srcFile['ts' + str(instNum)].view('datetime64[ns]'),
+                                     name=tsName)
+            df_data = pd.DataFrame({colNum: srcFile['v' + str(instNum) + '_' + str(colNum)]
+                                    for colNum in range(len(columns))},
+                                   index=index, columns=range(len(columns)))
+            df_data.columns = columns
+            sources[instName] = df_data
+    return sources
+
+
+class IncrementalState(object):
+    """
+    The state of an output file written in incremental mode.
+
+    A new (empty) state means the whole output file is written. Once loaded
+    from a state file, appending is True, and the watermark, frequency and
+    stats are those the output file was made with.
+
+    The steps of a run are:
+        newSource()    on the source tags, before the instruments are made
+        holdSource()   on the source tags, so their last rows can be kept
+        keepSource()   once the watermark (last grid time) is known
+        truncate()     before appending to the output file
+        carryForward() on the instrument data, when aligning it
+        matchColumns() on the aligned data
+        update() and save() once the data is written
+    """
+    def __init__(self):
+        # last timestamp written to the output file, and the position in the
+        # file where its row starts
+        self.watermark = pd.NaT
+        self._tailOffset = None
+        # instrument name -> latest source timestamp processed (int ns)
+        self._sourceEnds = {}
+        # sample period (offset string) and stats of the output file
+        self.freq = None
+        self.stats = None
+        # output column names and types
+        self._columns = None
+        self._dtypes = None
+        # instrument name -> packed last resampled row before the watermark
+        self._carries = {}
+        # instrument name -> source rows (data frame) at or after the watermark
+        self._sources = {}
+        # source tags held until the watermark is known
+        self._heldSource = []
+
+    @property
+    def appending(self):
+        """
+        True if there is an output file to append to.
+        """
+        return not pd.isna(self.watermark)
+
+    @classmethod
+    def load(cls, outputFileName):
+        """
+        Return the state saved for the output file, or None if there is no
+        state file or output file. A ValueError is raised if the state file
+        cannot be used: it cannot be read, or the output file has changed
+        since the state was saved.
+        """
+        if not os.path.exists(stateFileName(outputFileName)) or \
+                not os.path.exists(outputFileName):
+            return None
+        try:
+            with open(stateFileName(outputFileName), 'r') as stateFile:
+                saved = json.load(stateFile)
+            if saved.get('version') != STATE_VERSION:
+                raise ValueError('Unknown state file version.')
+            if saved['output'] != _fileSignature(outputFileName):
+                raise ValueError('The output file "' + outputFileName +
+                                 '" has changed since the state was saved.')
+            state = cls()
+            state.watermark = pd.Timestamp(saved['watermark'])
+            state._tailOffset = saved['tailOffset']
+            state._sourceEnds = saved['sourceEnds']
+            state.freq = saved['freq']
+            state.stats = saved['stats']
+            state._columns = saved['columns']
+            state._dtypes = saved['dtypes']
+            state._carries = saved['carries']
+            if saved['sourcesFile'] != _fileSignature(sourcesFileName(outputFileName)):
+                raise ValueError('The source rows file has changed since the \
+state was saved.')
+            state._sources = _loadSources(sourcesFileName(outputFileName),
+                                          saved['sources'])
+        except (OSError, KeyError, TypeError) as ex:
+            raise ValueError('Unable to read the state file "' +
+                             stateFileName(outputFileName) + '". ' + str(ex))
+        return state
+
+    def save(self, outputFileName):
+        """
+        Save the state for the output file, which must already be written.
+        The source rows file is written first, and the state file records its
+        size and modification time, so the two are only used together. An
+        OSError is raised if either file cannot be written.
+        """
+        sourceLabels = _saveSources(sourcesFileName(outputFileName), self._sources)
+        saved = {'version': STATE_VERSION,
+                 'output': _fileSignature(outputFileName),
+                 'sourcesFile': _fileSignature(sourcesFileName(outputFileName)),
+                 'watermark': int(self.watermark.value),
+                 'tailOffset': self._tailOffset,
+                 'sourceEnds': self._sourceEnds,
+                 'freq': self.freq,
+                 'stats': self.stats,
+                 'columns': self._columns,
+                 'dtypes': self._dtypes,
+                 'carries': self._carries,
+                 'sources': sourceLabels}
+        replaceFile(stateFileName(outputFileName),
+                    lambda stateFile: json.dump(saved, stateFile))
+
+    def offset(self):
+        """
+        Return the sample period of the output file as an offset.
+        """
+        return to_offset(self.freq)
+
+    def newSource(self, srcTags):
+        """
+        Given the list of (instrument name, timestamp indexed data frame)
+        source tags, return the list to make the instruments from: the source
+        rows kept from the previous run, followed by the rows after the latest
+        source time already processed for the instrument.
+
+        If an instrument has new rows before the watermark, the rows already
+        written would change, so the state is reset (appending is then False),
+        and the source tags are returned as they are, to write the whole
+        output file again.
+        """
+        if not self.appending:
+            return srcTags
+        newTags = []
+        for instName, df_data in srcTags:
+            sourceEnd = self._sourceEnds.get(instName)
+            if sourceEnd is not None:
+                df_data = df_data[df_data.index > pd.Timestamp(sourceEnd)]
+                if len(df_data.index) and df_data.index.min() < self.watermark:
+                    print('WARNING: There are new source rows for "' + str(instName) +
+                          '" before the last time written to the output file. Writing \
+the whole output file.')
+                    # start a new state
+                    self.__init__()
+                    return srcTags
+            newTags.append((instName, df_data))
+        kept = dict(self._sources)
+        for tagNum, (instName, df_data) in enumerate(newTags):
+            if instName in kept:
+                newTags[tagNum] = (instName, pd.concat([kept.pop(instName), df_data],
+                                                       axis=0, sort=False))
+        for instName, df_kept in kept.items():
+            newTags.append((instName, df_kept))
+        return newTags
+
+    def holdSource(self, srcTags):
+        """
+        Hold on to the source tags (not copied) until keepSource() is called.
+        """
+        self._heldSource = list(srcTags)
+
+    def keepSource(self, watermark, sourceEnd):
+        """
+        Keep the source rows at or after the watermark (the last grid time to
+        be written), which are needed to write its row again next time, and
+        release the source tags held. sourceEnd is the latest source time
+        used (the end time), and the latest source time processed for each
+        instrument is its last row up to sourceEnd.
+        """
+        sources = {}
+        for instName, df_data in self._heldSource:
+            df_used = df_data[df_data.index <= sourceEnd]
+            if len(df_used.index):
+                instEnd = int(df_used.index.max().value)
+                if instName not in self._sourceEnds or \
+                        instEnd > self._sourceEnds[instName]:
+                    self._sourceEnds[instName] = instEnd
+            df_tail = df_data[df_data.index >= watermark]
+            if instName in sources:
+                df_tail = pd.concat([sources[instName], df_tail],
+                                    axis=0, sort=False).sort_index(kind='mergesort')
+            if not df_tail.empty:
+                sources[instName] = df_tail
+        self._sources = sources
+        self._heldSource = []
+
+    def truncate(self, outputFileName):
+        """
+        Remove the last row written from the output file, so it can be
+        written again. An OSError is raised if the file cannot be changed.
+        """
+        with open(outputFileName, 'r+b') as outFile:
+            outFile.truncate(self._tailOffset)
+
+    def carryForward(self, namedData, watermark):
+        """
+        Given an iterable of (instrument name, timestamp indexed data frame)
+        tuples, yield the data frame to align for each: the carried last row
+        from the previous run, followed by the data after it. Then yield the
+        carried last row alone for each instrument which had no data this
+        time. For each instrument, the last row before the watermark (the
+        last grid time to be written) is kept for next time.
+        """
+        seen = set()
+        for instName, df_data in namedData:
+            seen.add(instName)
+            carry = self._carries.get(instName)
+            if carry is not None:
+                df_carry = _unpackRows(carry)
+                df_carry.index.name = df_data.index.name
+                df_data = pd.concat([df_carry,
+                                     df_data[df_data.index > df_carry.index[-1]]],
+                                    axis=0, sort=False)
+            df_before = df_data[df_data.index < watermark]
+            if not df_before.empty:
+                self._carries[instName] = _packRows(df_before.iloc[-1:])
+            yield df_data
+        for instName, carry in list(self._carries.items()):
+            if instName not in seen:
+                yield _unpackRows(carry)
+
+    def matchColumns(self, df_dest):
+        """
+        Return a tuple of the aligned data frame with the columns of the
+        output file, and the list of its columns which are not in the output
+        file (left out). For a new output file, the columns are kept as is
+        and remembered.
+
+        Columns are converted to the type they have in the output file when
+        this does not change any values, so the numbers are written the same.
+        """
+        if not self.appending:
+            self._columns = [str(col) for col in df_dest.columns]
+            self._dtypes = [str(dtype) for dtype in df_dest.dtypes]
+            return df_dest, []
+
+        outColumns = set(self._columns)
+        newColumns = [col for col in df_dest.columns if col not in outColumns]
+        df_dest = df_dest.reindex(columns=self._columns, fill_value=0.0)
+        for col, dtype in zip(self._columns, self._dtypes):
+            if str(df_dest[col].dtype) == dtype:
+                continue
+            try:
+                converted = df_dest[col].astype(dtype)
+            except (ValueError, TypeError):
+                continue
+            if (converted == df_dest[col]).all():
+                df_dest[col] = converted
+        return df_dest, newColumns
+
+    def update(self, watermark, tailOffset, freq, stats):
+        """
+        Set the watermark (the last time written) and the position in the
+        output file where its row starts, and remember the sample period and
+        stats.
+        """
+        self.watermark = pd.Timestamp(watermark)
+        self._tailOffset = tailOffset
+        self.freq = to_offset(freq).freqstr
+        self.stats = stats
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppIndex.py
+#
+# Block index (sidecar) files for the ftArchPostProc source files.
+#
+# Every run reads a source file from the start, even when only a short time
+# range (-st/-et) or a few tags (-tg) are wanted. A block index lets a run read
+# just the parts of the file it needs. The index is kept next to the source
+# file (the source file name plus ".ftppidx"), and holds, for each block of
+# rows (INDEX_BLOCK_ROWS rows after the header row):
+#
+#   - the byte offset and length of the block. Blocks start and end on a line
+#     boundary, so a block can be read by itself.
+#   - the first and last timestamp in the block (of any timestamp column)
+#   - for archive files (-a), the TagIds in the block
+#
+# plus the TagId -> TagName of every tag in an archive file. select() gives the
+# blocks which can have rows in the time range and for the tags wanted, and the
+# readers (readTyped() in ftppSchema.py and ArchiveTagAccumulator.readFile() in
+# ftppArchive.py) read only those blocks.
+#
+# The index is made by openIndex() the first time it is needed, which reads the
+# whole file once, and is then saved. It is used again until the file changes
+# (a different size or modification time), or it is used with different read
+# options (delimiter, encoding, time format or file type), and is then made
+# again. Files in encodings which cannot be split on a newline byte (utf_16 and
+# utf_32) are not indexed. Values with line breaks in them (inside quotes) are
+# not supported.
+#
+# The TagIds of a block are kept as a plain sorted list. Archive exports are
+# grouped by tag, so a block only has a few of them.
+
+# imports
+#
+# system related
+import io
+import os
+import json
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# custom libraries
+# header row reading, and the archive file column positions
+from ftppArchive import readHeader, ARCH_ID_COL, ARCH_NAME_COL, ARCH_TS_COL
+# writing a file by way of a temporary file
+from ftppCache import replaceFile
+
+# index file name suffix, added to the source file name
+INDEX_SUFFIX = '.ftppidx'
+# index file layout version
+INDEX_VERSION = 1
+# rows per block
+INDEX_BLOCK_ROWS = 100000
+# bytes read at a time when finding the block boundaries
+SCAN_BYTES = 1 << 24
+
+
+def indexFileName(fileName):
+    """
+    Return the name of the index file for the source file.
+    """
+    return fileName + INDEX_SUFFIX
+
+
+def _fileSignature(fileName):
+    """
+    Return [size, modification time (ns)] of the file. An OSError is raised
+    if the file cannot be read.
+    """
+    stat = os.stat(fileName)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _lineBlocks(fileName, blockRows):
+    """
+    Return a list of (byte offset, byte length) of each block of blockRows
+    lines after the first (header) line of the file. The last block has the
+    lines left over.
+    """
+    blocks = []
+    with open(fileName, 'rb') as srcFile:
+        pos = len(srcFile.readline())
+        start = pos
+        # lines in the block being found so far
+        count = 0
+        while True:
+            buffer = srcFile.read(SCAN_BYTES)
+            if not buffer:
+                break
+            newLines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == ord('\n'))
+            # the line ending each block found in this buffer
+            for lineNum in range(blockRows - count - 1, newLines.size, blockRows):
+                end = pos + int(newLines[lineNum]) + 1
+                blocks.append((start, end - start))
+                start = end
+            count = (count + newLines.size) % blockRows
+            pos += len(buffer)
+        if pos > start:
+            blocks.append((start, pos - start))
+    return blocks
+
+
+class BlockIndex(object):
+    """
+    The block index of a source file of a file type (layout): 'a' for
+    archive, 'n' for time normalized, or 't' for historical trend data.
+
+    Use openIndex() to get the index of a file, and then select() to get the
+    blocks to read.
+    """
+    def __init__(self, fileName, sep, encoding, layout, timeFormat):
+        self._fileName = fileName
+        # read options the index was made with
+        self._options = {'sep': sep, 'encoding': encoding, 'layout': layout,
+                         'timeFormat': timeFormat, 'blockRows': INDEX_BLOCK_ROWS}
+        self._signature = None
+        # list of [offset, length, first ts (ns), last ts (ns), TagIds] per
+        # block. The times are None if they are not known, and the TagIds are
+        # None except for archive files.
+        self._blocks = []
+        # TagId (as a string, for json) -> TagName, for archive files
+        self._tagNames = {}
+
+    @property
+    def blockCount(self):
+        return len(self._blocks)
+
+    def tagNames(self):
+        """
+        Return a dictionary of TagId -> TagName of the tags in the file
+        (archive files only).
+        """
+        return {int(tagId): tagName for tagId, tagName in self._tagNames.items()}
+
+    @classmethod
+    def load(cls, fileName, sep, encoding, layout, timeFormat):
+        """
+        Return the index saved for the source file, or None if there is no
+        index file, or it cannot be used (it cannot be read, the source file
+        has changed, or it was made with different read options).
+        """
+        index = cls(fileName, sep, encoding, layout, timeFormat)
+        try:
+            with open(indexFileName(fileName), 'r') as idxFile:
+                saved = json.load(idxFile)
+            if saved.get('version') != INDEX_VERSION or \
+                    saved['options'] != index._options or \
+                    saved['source'] != _fileSignature(fileName):
+                return None
+            index._signature = saved['source']
+            index._blocks = saved['blocks']
+            index._tagNames = saved['tagNames']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return index
+
+    def save(self):
+        """
+        Save the index next to the source file. An OSError is raised if the
+        index file cannot be written.
+        """
+        saved = {'version': INDEX_VERSION,
+                 'source': self._signature,
+                 'options': self._options,
+                 'blocks': self._blocks,
+                 'tagNames': self._tagNames}
+        replaceFile(indexFileName(self._fileName),
+                    lambda idxFile: json.dump(saved, idxFile))
+
+    @classmethod
+    def build(cls, fileName, sep, encoding, layout, timeFormat, toDatetime):
+        """
+        Make the index of the source file, reading all of it. toDatetime
+        converts a series of timestamp strings to datetimes, with NaT for those
+        it cannot convert. A ValueError is raised if the file cannot be read.
+        """
+        index = cls(fileName, sep, encoding, layout, timeFormat)
+        try:
+            index._signature = _fileSignature(fileName)
+            header = readHeader(fileName, sep, encoding)
+            if layout == 'a':
+                tsCols = [ARCH_TS_COL]
+                usecols = [ARCH_ID_COL, ARCH_NAME_COL, ARCH_TS_COL]
+            elif layout == 't':
+                tsCols = list(range(0, len(header), 2))
+                usecols = tsCols
+            else:
+                tsCols = [0]
+                usecols = tsCols
+            with open(fileName, 'rb') as srcFile:
+                for offset, length in _lineBlocks(fileName, INDEX_BLOCK_ROWS):
+                    srcFile.seek(offset)
+                    df_block = pd.read_csv(io.BytesIO(srcFile.read(length)), sep=sep,
+                                           encoding=encoding, header=None, dtype=str,
+                                           skipinitialspace=True,
+                                           names=list(range(len(header))),
+                                           usecols=usecols)
+                    index._blocks.append([offset, length] +
+                                         index._blockTimes(df_block, tsCols, toDatetime) +
+                                         [index._blockTags(df_block, layout)])
+        except OSError as oe:
+            raise ValueError(str(oe))
+        return index
+
+    def _blockTimes(self, df_block, tsCols, toDatetime):
+        """
+        Return [first, last] timestamp (int ns) of the block, or
+        [None, None] if any of its timestamps cannot be converted.
+        """
+        first = last = None
+        for col in tsCols:
+            present = df_block[col].dropna()
+            if present.empty:
+                continue
+            ts = toDatetime(present)
+            if ts.isna().any():
+                return [None, None]
+            low = int(ts.min().value)
+            high = int(ts.max().value)
+            first = low if first is None else min(first, low)
+            last = high if last is None else max(last, high)
+        return [first, last]
+
+    def _blockTags(self, df_block, layout):
+        """
+        Return the sorted list of TagIds in the block of an archive file,
+        and remember the tag names. None for the other file types.
+        """
+        if layout != 'a':
+            return None
+        ids = pd.to_numeric(df_block[ARCH_ID_COL], errors='coerce')
+        df_tags = pd.DataFrame({'id': ids, 'name': df_block[ARCH_NAME_COL]}) \
+                    .dropna().drop_duplicates(subset='id', keep='first')
+        for tagId, tagName in zip(df_tags['id'].astype(np.int64).tolist(),
+                                  df_tags['name'].tolist()):
+            # Use the first tag name found for the id
+            self._tagNames.setdefault(str(tagId), tagName)
+        return sorted(set(ids.dropna().astype(np.int64).tolist()))
+
+    def select(self, window=None, tagIds=None):
+        """
+        Return a list of (byte offset, byte length) of the blocks which can
+        have rows in the time range of the window (a TimeWindow, see
+        ftppWindow.py), and for any of the TagIds in tagIds. None for either
+        means no limit.
+        """
+        if tagIds is not None:
+            tagIds = set(tagIds)
+        blocks = []
+        for offset, length, first, last, blockTags in self._blocks:
+            if window is not None and window.active and first is not None and \
+                    not window.overlaps(pd.Timestamp(first), pd.Timestamp(last)):
+                continue
+            if tagIds is not None and blockTags is not None and \
+                    tagIds.isdisjoint(blockTags):
+                continue
+            blocks.append((offset, length))
+        return blocks
+
+
+def openIndex(fileName, sep, encoding, layout, timeFormat, toDatetime):
+    """
+    Return a tuple of the index of the source file, and True if it was just
+    made (and needs to be saved). The saved index is used if it is up to date.
+    Otherwise the index is made by reading the file. The index is None if the
+    file cannot be indexed (utf_16 or utf_32 encoding). A ValueError is
+    raised if the file cannot be read.
+    """
+    codec = encoding.lower().replace('-', '_')
+    if codec.startswith('utf_16') or codec.startswith('utf_32'):
+        return None, False
+    index = BlockIndex.load(fileName, sep, encoding, layout, timeFormat)
+    if index is not None:
+        return index, False
+    return BlockIndex.build(fileName, sep, encoding, layout, timeFormat, toDatetime), True
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppMerge.py
+#
+# Merging of the input file with any number of merge files, for ftArchPostProc.
+#
+# The files to merge are given by name (-am1..-am4 and the repeatable -am),
+# by glob pattern (-amg), or listed in a text file (-aml). collectMergeFiles()
+# puts these together into one list, in order.
+#
+# TagMerger holds, for each tag, the time sorted (timestamp, value) arrays from
+# each file, in file order. When the data for a tag is taken, these sorted runs
+# are merged in pairs until one is left (see mergeSortedRuns()). A timestamp in
+# more than one file keeps the value from the last file, as the later file
+# always wins.
+
+# imports
+#
+# system related
+import os
+import glob
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+
+def collectMergeFiles(fileNames=None, globPatterns=None, listFiles=None):
+    """
+    Return the list of files to merge, in order: the named files, then the
+    files matching each glob pattern (sorted by name, for each pattern), then
+    the files listed in each list file. A list file has one file name per
+    line. Blank lines and lines starting with # are ignored, and relative
+    names are relative to the directory of the list file.
+
+    None entries are ignored, and a file is only included the first time it
+    is found. A ValueError is raised if a list file cannot be read.
+    """
+    mergeFiles = []
+
+    def _add(fileName):
+        if fileName is not None and fileName not in mergeFiles:
+            mergeFiles.append(fileName)
+
+    for fileName in fileNames or []:
+        _add(fileName)
+    for pattern in globPatterns or []:
+        for fileName in sorted(glob.glob(pattern)):
+            _add(fileName)
+    for listFile in listFiles or []:
+        try:
+            with open(listFile, 'r') as mergeList:
+                lines = mergeList.read().splitlines()
+        except (OSError, UnicodeDecodeError) as ex:
+            raise ValueError('Unable to read the merge list file "' + listFile +
+                             '". ' + str(ex))
+        listDir = os.path.dirname(listFile)
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            _add(os.path.join(listDir, line))
+    return mergeFiles
+
+
+def _sortedRun(ts, vals):
+    """
+    Return the timestamp and value arrays as a run: sorted by time (stable, if
+    they are not already in order), with the last value kept for any duplicated
+    timestamp.
+    """
+    if ts.size > 1 and (ts[1:] < ts[:-1]).any():
+        order = np.argsort(ts, kind='mergesort')
+        ts = ts[order]
+        vals = vals[order]
+    if ts.size > 1:
+        keep = np.ones(ts.size, dtype=bool)
+        keep[:-1] = ts[1:] != ts[:-1]
+        if not keep.all():
+            ts = ts[keep]
+            vals = vals[keep]
+    return ts, vals
+
+
+def _mergeRuns(early, late):
+    """
+    Merge two runs (timestamp array, value array) into one. The timestamps of
+    the early run which are also in the late run are dropped, so the value from
+    the late run wins, and then the late run is inserted into the early one.
+    """
+    earlyTs, earlyVals = early
+    lateTs, lateVals = late
+    if not lateTs.size:
+        return early
+    if not earlyTs.size:
+        return late
+    # drop the early times which are also late times
+    pos = np.searchsorted(lateTs, earlyTs)
+    dup = lateTs[np.minimum(pos, lateTs.size - 1)] == earlyTs
+    if dup.any():
+        earlyTs = earlyTs[~dup]
+        earlyVals = earlyVals[~dup]
+    valType = np.result_type(earlyVals, lateVals)
+    pos = np.searchsorted(earlyTs, lateTs)
+    return (np.insert(earlyTs, pos, lateTs),
+            np.insert(earlyVals.astype(valType, copy=False), pos,
+                      lateVals.astype(valType, copy=False)))
+
+
+def mergeSortedRuns(tsParts, valParts):
+    """
+    Merge lists of timestamp arrays and value arrays. Each timestamp array is
+    normally sorted (a run), but it does not need to be. Return a tuple of the
+    merged timestamp array, which is sorted and has no duplicates, and the
+    value array. For duplicated timestamps, the value from the last array
+    (latest run) is kept.
+
+    The runs are merged in pairs, in order, and the merged pairs again, until
+    there is one run left, so each row is moved about log2(number of runs)
+    times. Duplicated timestamps are dropped as the runs are merged.
+    """
+    if not tsParts:
+        return np.array([], dtype='datetime64[ns]'), np.array([], dtype=np.float64)
+    runs = [_sortedRun(ts, vals) for ts, vals in zip(tsParts, valParts)]
+    while len(runs) > 1:
+        merged = [_mergeRuns(runs[runNum], runs[runNum + 1])
+                  for runNum in range(0, len(runs) - 1, 2)]
+        if len(runs) % 2:
+            merged.append(runs[-1])
+        runs = merged
+    return runs[0]
+
+
+class TagMerger(object):
+    """
+    Merges timestamp indexed value data, per tag, from any number of files.
+
+    For each file, in order, add() each tag's data: a data frame indexed by
+    timestamp with one value column. The data does not need to be sorted.
+    Once all the files are added, tags() gives the tags in the order they
+    were first added, and pop() gives the merged data for a tag, releasing it
+    as it goes.
+
+    Duplicate (tag, timestamp) rows are resolved by keeping the row added
+    last, so a later file wins over an earlier one.
+    """
+    def __init__(self):
+        # tag -> list of timestamp arrays, and list of value arrays
+        self._ts = {}
+        self._vals = {}
+        # tag -> (timestamp name, value name) of the first data added
+        self._labels = {}
+
+    def add(self, tag, df):
+        """
+        Add the data frame (timestamp index, one value column) for the tag.
+        """
+        ts = df.index.values
+        vals = df.iloc[:, 0].values
+        if tag not in self._ts:
+            self._ts[tag] = []
+            self._vals[tag] = []
+            self._labels[tag] = (df.index.name, df.columns[0])
+        self._ts[tag].append(ts)
+        self._vals[tag].append(vals)
+
+    def tags(self):
+        """
+        Return a list of the tags, in the order they were first added.
+        """
+        return list(self._ts)
+
+    def pop(self, tag, tsName=None, valName=None):
+        """
+        Return a data frame of the merged data for the tag: indexed by
+        timestamp, sorted, with duplicate timestamps removed (last one added
+        is kept), and with the index and value column named as in the first
+        data added. If no data was added for the tag, an empty data frame
+        with the index and value column named tsName and valName is returned.
+
+        The data for the tag is released.
+        """
+        tsName, valName = self._labels.pop(tag, (tsName, valName))
+        ts, vals = mergeSortedRuns(self._ts.pop(tag, []), self._vals.pop(tag, []))
+        return pd.DataFrame({valName: vals},
+                            index=pd.DatetimeIndex(ts, name=tsName))
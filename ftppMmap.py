@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppMmap.py
+#
+# Memory mapped scanning of source files, for ftArchPostProc.
+#
+# Reading a source file with read_csv() copies every byte of it into python
+# strings, one per field, even the fields which are never used (DataSource and
+# Quality), and the TagName which is the same on every row of a tag. The
+# helpers here map the file into memory instead, and work on its raw bytes as
+# a numpy array, without copying them:
+#
+#   - The row boundaries are found with a vectorized search for the newlines,
+#     and the field boundaries with a search for the delimiter.
+#   - Only the fields needed are copied, into a zero padded matrix of character
+#     codes (one row per line), which numpy can convert to numbers, and which
+#     ftppTimeParse.py can convert to timestamps, without making a string for
+#     each one.
+#   - Other fields (e.g. the TagName) can be decoded one at a time, for just
+#     the rows where they are needed.
+#
+# This only works when a row can be split on single bytes: a single character
+# delimiter in an ascii compatible encoding (not utf_16 or utf_32). Values with
+# quotes, and rows with a different number of fields than the header, are not
+# handled here. The caller checks with canMap(), and reads the file (or the
+# chunk, for splitFields()) with read_csv() instead when these do not apply.
+
+# imports
+#
+# system related
+import mmap
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# bytes scanned at a time. Each chunk ends at the end of a line.
+MMAP_CHUNK_BYTES = 1 << 23
+# character codes
+NEWLINE = ord('\n')
+CARRIAGE_RETURN = ord('\r')
+SPACE = ord(' ')
+QUOTE = ord('"')
+
+
+def canMap(sep, encoding):
+    """
+    Return True if files with the delimiter and encoding can be scanned as
+    bytes: the delimiter is a single ascii character, and the encoding is
+    one in which ascii characters are single bytes which are never part of
+    another character.
+    """
+    if len(sep) != 1 or ord(sep) > 127 or sep in '\r\n" ':
+        return False
+    codec = encoding.lower().replace('-', '_')
+    return codec in ('utf_8', 'utf8', 'utf_8_sig', 'ascii', 'us_ascii',
+                     'latin_1', 'latin1', 'l1') or \
+        codec.startswith('iso8859') or codec.startswith('iso_8859') or \
+        codec.startswith('cp125') or codec.startswith('windows_125')
+
+
+class MappedFile(object):
+    """
+    A source file mapped (read only) into memory. data is a numpy uint8 array
+    of its bytes, and headerEnd is the position just after its first (header)
+    line. Use it as a context manager, or call close() when done. Arrays made
+    from data (other than copies) must not be used after it is closed.
+    """
+    def __init__(self, fileName):
+        self._mm = None
+        with open(fileName, 'rb') as srcFile:
+            # an empty file cannot be mapped
+            if srcFile.seek(0, 2):
+                self._mm = mmap.mmap(srcFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm is None:
+            self.data = np.zeros(0, dtype=np.uint8)
+            self.headerEnd = 0
+        else:
+            self.data = np.frombuffer(self._mm, dtype=np.uint8)
+            self.headerEnd = self._lineEnd(0, self.data.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Release the mapping.
+        """
+        # The array refers to the mapping, which cannot be closed while it does.
+        self.data = np.zeros(0, dtype=np.uint8)
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def _lineEnd(self, pos, stop):
+        """
+        Return the position just after the newline at or after pos, or stop
+        if there is none before it.
+        """
+        newLine = self._mm.find(b'\n', pos, stop)
+        return stop if newLine < 0 else newLine + 1
+
+    def chunks(self, blocks=None, chunkBytes=MMAP_CHUNK_BYTES):
+        """
+        Return a list of (start, stop) byte positions of the chunks of the data
+        rows to scan, each about chunkBytes long, and ending at the end of a
+        line. If blocks is not None, only those (byte offset, byte length)
+        blocks are scanned (see ftppIndex.py), otherwise everything after the
+        header line.
+        """
+        if blocks is None:
+            blocks = [(self.headerEnd, self.data.size - self.headerEnd)]
+        spans = []
+        for offset, length in blocks:
+            stop = min(offset + length, self.data.size)
+            pos = offset
+            while pos < stop:
+                end = self._lineEnd(min(pos + chunkBytes, stop), stop)
+                spans.append((pos, end))
+                pos = end
+        return spans
+
+
+def lineSpans(data, start, stop):
+    """
+    Return a tuple of arrays of the start and end positions of the lines in
+    data[start:stop], which starts at the start of a line. The ends are at the
+    newline (or a carriage return just before it). Blank lines are left out,
+    the same as read_csv() does.
+    """
+    newLines = np.flatnonzero(data[start:stop] == NEWLINE) + start
+    starts = np.concatenate(([start], newLines + 1))
+    ends = np.append(newLines, stop)
+    # drop the carriage return of a \r\n line ending
+    hasChars = ends > starts
+    ends[hasChars] -= data[ends[hasChars] - 1] == CARRIAGE_RETURN
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+def splitFields(data, starts, ends, sepByte, numFields):
+    """
+    Return a tuple of (lines x numFields) arrays of the start and end positions
+    of each field of the lines given by lineSpans(). Leading spaces are not
+    part of a field, the same as read_csv(skipinitialspace=True).
+
+    Return None if the lines cannot be split this way: a line does not have
+    numFields fields, or there are quotes in the lines.
+    """
+    if not starts.size:
+        return np.zeros((0, numFields), dtype=np.int64), np.zeros((0, numFields), dtype=np.int64)
+    region = data[starts[0]:ends[-1]]
+    if (region == QUOTE).any():
+        return None
+    seps = np.flatnonzero(region == sepByte) + starts[0]
+    # every line needs numFields - 1 delimiters
+    lineNums = np.searchsorted(starts, seps, side='right') - 1
+    if seps.size != starts.size * (numFields - 1) or \
+            (np.bincount(lineNums, minlength=starts.size) != numFields - 1).any():
+        return None
+    seps = seps.reshape(starts.size, numFields - 1)
+    fieldStarts = np.hstack((starts[:, np.newaxis], seps + 1))
+    fieldEnds = np.hstack((seps, ends[:, np.newaxis]))
+    # skip leading spaces
+    while True:
+        spaces = fieldStarts < fieldEnds
+        spaces[spaces] = data[fieldStarts[spaces]] == SPACE
+        if not spaces.any():
+            break
+        fieldStarts += spaces
+    return fieldStarts, fieldEnds
+
+
+def fieldMatrix(data, starts, ends):
+    """
+    Return a (fields x width) uint8 matrix of the character codes of the
+    fields from starts to ends (arrays of positions), padded with zeros on
+    the right. width is the widest field.
+    """
+    widths = ends - starts
+    width = int(widths.max()) if widths.size else 0
+    chars = np.zeros((starts.size, width), dtype=np.uint8)
+    last = data.size - 1
+    # one column at a time, to keep the index arrays small
+    for charNum in range(width):
+        inField = charNum < widths
+        chars[inField, charNum] = data[np.minimum(starts[inField] + charNum, last)]
+    return chars
+
+
+def decodeField(data, start, end, encoding):
+    """
+    Return the field from start to end decoded as a string, or None if it is
+    empty.
+    """
+    if end <= start:
+        return None
+    return data[start:end].tobytes().decode(encoding)
+
+
+def parseFloats(data, starts, ends, encoding):
+    """
+    Return a float64 array of the numbers in the fields from starts to ends.
+    Fields which are not numbers are NaN. The numbers are correctly rounded,
+    the same as read_csv(float_precision='round_trip').
+    """
+    values = np.full(starts.size, np.nan)
+    present = ends > starts
+    if not present.any():
+        return values
+    chars = fieldMatrix(data, starts[present], ends[present])
+    try:
+        values[present] = chars.view('S' + str(chars.shape[1])).ravel().astype(np.float64)
+    except ValueError:
+        # Something is not a number. Convert them one at a time.
+        strings = [data[start:end].tobytes().decode(encoding, errors='replace')
+                   for start, end in zip(starts[present].tolist(), ends[present].tolist())]
+        converted = pd.to_numeric(pd.Series(strings, dtype=object),
+                                  errors='coerce').astype(np.float64).values
+        # Convert the numbers found again, correctly rounded, if numpy can.
+        numbers = ~np.isnan(converted)
+        try:
+            converted[numbers] = chars[numbers].view('S' + str(chars.shape[1])) \
+                                     .ravel().astype(np.float64)
+        except ValueError:
+            pass
+        values[present] = converted
+    return values
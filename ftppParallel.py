@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppParallel.py
+#
+# Parallel instrument construction and resampling for ftArchPostProc.
+#
+# Once the source data is parsed, each instrument is independent: making the
+# TsIdxData object (which applies the value query and the start/end time
+# filter), and later resampling it, does not depend on any other instrument.
+# The InstrumentPool here spreads that work over a number of worker processes.
+#
+# Data is passed to and from the workers through memory mapped files rather
+# than by pickling data frames. The parsed source data (timestamps and values
+# of every tag) is written once to one file, and each worker maps the file and
+# builds its instruments from its slices of it. After resampling, each worker
+# writes the data of its instruments to a result file in the same way, and the
+# main process maps that file and makes the data frames from it. The files are
+# put in /dev/shm (shared memory) when it exists, so on Linux they never touch
+# the disk. Only small descriptions of the data (names, offsets, data types)
+# go through the pipes between the processes.
+#
+# The work is done in two phases, because the resample frequency is not known
+# until the start/end time and frequency of every instrument is known:
+#   build() -- make (and filter) every instrument in the workers, and return
+#              a PooledInstrument stand in for each, which has the instrument
+#              name, start/end times, time offset, count and empty flag.
+#   resample() -- resample every instrument in the worker that holds it, and
+#                 bring the resampled data back to the PooledInstrument.
+# Each worker keeps the instruments it made between the phases. For the events
+# output grid (see ftppGrid.py), eventTimes() gets the sample times of the
+# instruments from the workers between the phases.
+#
+# Instruments with the same name are made in the same worker, and appended in
+# source order, the same as when done serially. The instruments are returned
+# in the order the names were first seen, so the results (and the output file)
+# are the same as when done serially.
+#
+# The workers are started with fork, so the worker processes do not import
+# (and run) the main script again. On platforms without fork, available()
+# returns False and the caller should do the work serially.
+
+# imports
+#
+# system related
+import os
+import io
+import shutil
+import tempfile
+import traceback
+import contextlib
+import multiprocessing
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# custom libraries
+# TimeStamped Indexed Data Class
+from bpsTsIdxData import TsIdxData
+# sample times for the events output grid
+from ftppGrid import eventTimes, unionTimes
+# value precision
+from ftppPrecision import resampleAs
+
+# preferred directory for the memory mapped files
+SHARED_MEM_DIR = '/dev/shm'
+# array data in the files is padded to a multiple of this many bytes
+PACK_ALIGN = 8
+
+
+def _tempParentDir():
+    """
+    Return the directory in which to make the temporary directory for the
+    memory mapped files: the shared memory directory if it is usable, or the
+    default temporary directory if not (None).
+    """
+    if os.path.isdir(SHARED_MEM_DIR) and os.access(SHARED_MEM_DIR, os.W_OK):
+        return SHARED_MEM_DIR
+    return None
+
+
+def _packFrames(fileName, frames):
+    """
+    Write the index and columns of each data frame to the file as raw arrays.
+    Return a list with a layout entry for each data frame, which is used by
+    _unpackFrame() to make the data frame again.
+
+    Data frames with a non datetime index or non numeric columns are not
+    written to the file, and are put in the layout entry as is (and so are
+    pickled).
+    """
+    layout = []
+    offset = 0
+    with open(fileName, 'wb') as packFile:
+        for df in frames:
+            packable = isinstance(df.index, pd.DatetimeIndex) and \
+                df.index.tz is None and \
+                all(dtype.kind in 'biufM' for dtype in df.dtypes)
+            if not packable:
+                layout.append({'frame': df})
+                continue
+            entry = {'rows': len(df.index), 'indexName': df.index.name,
+                     'arrays': []}
+            # keep the index datetime unit as is, so the data frame is the same
+            arrays = [np.asarray(df.index.values)]
+            arrays.extend(df.iloc[:, colNum].values for colNum in range(len(df.columns)))
+            for array in arrays:
+                array = np.ascontiguousarray(array)
+                entry['arrays'].append((offset, array.dtype.str))
+                packFile.write(array.view(np.uint8).data)
+                offset += array.nbytes
+                # pad so the next array starts aligned
+                padding = -offset % PACK_ALIGN
+                if padding:
+                    packFile.write(b'\0' * padding)
+                    offset += padding
+            entry['columns'] = df.columns.tolist()
+            layout.append(entry)
+    return layout
+
+
+def _mapFile(fileName):
+    """
+    Return the file as a read only memory mapped uint8 array.
+    """
+    if not os.path.getsize(fileName):
+        # an empty file cannot be mapped
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(fileName, dtype=np.uint8, mode='r')
+
+
+def _unpackFrame(buf, entry):
+    """
+    Make a data frame from its layout entry and the mapped file it was
+    written to. The data is copied out of the mapped file.
+    """
+    if 'frame' in entry:
+        return entry['frame']
+    rows = entry['rows']
+    arrays = []
+    for offset, dtypeStr in entry['arrays']:
+        dtype = np.dtype(dtypeStr)
+        arrays.append(np.array(buf[offset:offset + rows * dtype.itemsize].view(dtype)))
+    index = pd.DatetimeIndex(arrays[0], name=entry['indexName'])
+    # make the columns by position, so duplicate column names are kept
+    df = pd.DataFrame(dict(zip(range(len(entry['columns'])), arrays[1:])),
+                      index=index, columns=range(len(entry['columns'])))
+    df.columns = entry['columns']
+    return df
+
+
+def _summary(inst):
+    """
+    Return a dictionary with the instrument information used by the main
+    process before resampling.
+    """
+    return {'startTs': inst.startTs, 'endTs': inst.endTs,
+            'timeOffset': inst.timeOffset, 'count': inst.count,
+            'isEmpty': inst.isEmpty}
+
+
+def _workerBuild(insts, dataFile, groups, valueQuery, startArg, endArg,
+                 sourceTimeFormat):
+    """
+    Make the instruments for the groups given. Each group is a
+    (group number, list of items) tuple, where an item is a (source position,
+    layout entry, instrument name, timestamp name, value name) tuple. The
+    items of a group all have the same instrument name, and are appended in
+    order. The instruments are kept in insts by group number.
+
+    Return a list of (group number, summary, console output) tuples, where the
+    console output is a list of (source position, text) tuples.
+    """
+    buf = _mapFile(dataFile)
+    results = []
+    for groupNum, items in groups:
+        inst = None
+        texts = []
+        for srcPos, entry, instName, tsName, valName in items:
+            console = io.StringIO()
+            with contextlib.redirect_stdout(console):
+                tid_inst = TsIdxData(instName, tsName, valName,
+                                     _unpackFrame(buf, entry),
+                                     valueQuery, startArg, endArg,
+                                     sourceTimeFormat, forceColNames=True)
+                if inst is None:
+                    inst = tid_inst
+                else:
+                    inst.appendData(tid_inst.data, 0) # don't ignore any rows
+                del tid_inst
+            texts.append((srcPos, console.getvalue()))
+        insts[groupNum] = inst
+        results.append((groupNum, _summary(inst), texts))
+    del buf
+    return results
+
+
+def _workerResample(insts, resultFile, groupNums, resampleArg, stats, valueType):
+    """
+    Resample the instruments for the group numbers given, and write their data,
+    with the float values as the valueType, to the result file. The
+    instruments are released.
+
+    Return a (layout, console output) tuple, with a layout entry and console
+    output text for each group number, in order.
+    """
+    frames = []
+    texts = []
+    for groupNum in groupNums:
+        console = io.StringIO()
+        with contextlib.redirect_stdout(console):
+            inst = insts.pop(groupNum)
+            frames.append(resampleAs(inst, resampleArg, stats, valueType))
+            del inst
+        texts.append(console.getvalue())
+    return _packFrames(resultFile, frames), texts
+
+
+def _workerTimes(insts, resultFile, periodNanos):
+    """
+    Write the union of the sample times of all the instruments held, floored
+    to the period (ns), to the result file, as the index of a data frame with
+    no columns. Return its layout entry.
+    """
+    times = unionTimes([eventTimes(insts[groupNum].data.index, periodNanos)
+                        for groupNum in sorted(insts)])
+    return _packFrames(resultFile, [pd.DataFrame(index=pd.DatetimeIndex(
+        times.view('datetime64[ns]')))])[0]
+
+
+def _workerMain(conn, parentConn):
+    """
+    Worker process loop. Receive (command, arguments ...) messages, do the
+    work, and send back an ('ok', result) or ('error', traceback) message.
+    """
+    # the parent end of the pipe is not used here
+    parentConn.close()
+    insts = {}
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg[0] == 'stop':
+            break
+        try:
+            if msg[0] == 'build':
+                reply = _workerBuild(insts, *msg[1:])
+            elif msg[0] == 'times':
+                reply = _workerTimes(insts, *msg[1:])
+            else:
+                reply = _workerResample(insts, *msg[1:])
+            conn.send(('ok', reply))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
+class PooledInstrument(object):
+    """
+    Stands in for a TsIdxData instrument object held by a worker process.
+
+    Has the same name, startTs, endTs, timeOffset, count, isEmpty and data
+    properties used by ftArchPostProc. The data is only available once the
+    pool has resampled the instrument. Calling resample() afterwards does
+    nothing, as long as it is with the same arguments the pool used.
+    """
+    def __init__(self, name, summary):
+        self._name = name
+        self._summary = summary
+        self._data = None
+        self._resampleArgs = None
+
+    def __repr__(self):
+        return 'PooledInstrument(' + repr(self._name) + ')'
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def startTs(self):
+        return self._summary['startTs']
+
+    @property
+    def endTs(self):
+        return self._summary['endTs']
+
+    @property
+    def timeOffset(self):
+        return self._summary['timeOffset']
+
+    @property
+    def count(self):
+        return self._summary['count']
+
+    @property
+    def isEmpty(self):
+        return self._summary['isEmpty']
+
+    @property
+    def data(self):
+        if self._data is None:
+            raise RuntimeError('The data for "' + self._name + '" is not \
+available until the instrument pool has resampled it.')
+        return self._data.copy()
+
+    def resample(self, resampleArg, stats):
+        if self._resampleArgs != (resampleArg, stats):
+            raise RuntimeError('"' + self._name + '" was not resampled by the \
+instrument pool with these arguments.')
+
+    def _setData(self, data, resampleArg, stats):
+        self._data = data
+        self._resampleArgs = (resampleArg, stats)
+
+
+class InstrumentPool(object):
+    """
+    A pool of worker processes which make and resample instruments.
+
+    jobs -- The number of worker processes.
+
+    Use build() and then resample(), and then close() to stop the workers and
+    remove the temporary files. A RuntimeError is raised if a worker fails.
+    """
+    def __init__(self, jobs):
+        self._dir = tempfile.mkdtemp(prefix='ftpp', dir=_tempParentDir())
+        ctx = multiprocessing.get_context('fork')
+        self._workers = []
+        for _ in range(max(1, jobs)):
+            parentConn, childConn = ctx.Pipe()
+            proc = ctx.Process(target=_workerMain, args=(childConn, parentConn),
+                               daemon=True)
+            proc.start()
+            childConn.close()
+            self._workers.append((proc, parentConn))
+        # group numbers held by each worker
+        self._assigned = [[] for _ in self._workers]
+        # PooledInstrument for each group number
+        self._insts = []
+
+    @staticmethod
+    def available():
+        """
+        Return True if the pool can be used on this platform.
+        """
+        return 'fork' in multiprocessing.get_all_start_methods()
+
+    def _exchange(self, messages):
+        """
+        Send a message to each worker (None for no message), and return the
+        list of replies (None where no message was sent).
+        """
+        for (proc, conn), msg in zip(self._workers, messages):
+            if msg is not None:
+                conn.send(msg)
+        replies = []
+        for (proc, conn), msg in zip(self._workers, messages):
+            if msg is None:
+                replies.append(None)
+                continue
+            try:
+                status, reply = conn.recv()
+            except EOFError:
+                raise RuntimeError('An instrument worker process stopped \
+unexpectedly (exit code ' + str(proc.exitcode) + ').')
+            if status != 'ok':
+                raise RuntimeError('An instrument worker process failed:\n' + reply)
+            replies.append(reply)
+        return replies
+
+    def build(self, srcTags, valueQuery, startArg, endArg, sourceTimeFormat):
+        """
+        Make an instrument from each (instrument name, data frame) tuple in
+        srcTags, in the workers. Source data with the same instrument name is
+        appended to the same instrument. The srcTags list is emptied as the
+        data is handed off.
+
+        Return a list of PooledInstrument objects, in the order the names
+        were first seen.
+        """
+        # Group the source tags by instrument name, keeping the source order
+        groupOf = {}
+        groups = []
+        for srcPos, (instName, _) in enumerate(srcTags):
+            if instName not in groupOf:
+                groupOf[instName] = len(groups)
+                groups.append([])
+            groups[groupOf[instName]].append(srcPos)
+
+        # Write the source data to the shared file, and release it
+        dataFile = os.path.join(self._dir, 'source.bin')
+        layout = _packFrames(dataFile, (df for _, df in srcTags))
+        names = [instName for instName, _ in srcTags]
+        del srcTags[:]
+
+        # Spread the groups over the workers, biggest first, each to the
+        # worker with the fewest rows so far.
+        def _rows(srcPos):
+            entry = layout[srcPos]
+            return entry['rows'] if 'rows' in entry else len(entry['frame'].index)
+        load = [0] * len(self._workers)
+        work = [[] for _ in self._workers]
+        for groupNum in sorted(range(len(groups)),
+                               key=lambda g: -sum(_rows(p) for p in groups[g])):
+            workerNum = load.index(min(load))
+            load[workerNum] += sum(_rows(p) for p in groups[groupNum])
+            self._assigned[workerNum].append(groupNum)
+            work[workerNum].append((groupNum, [
+                (srcPos, layout[srcPos], names[srcPos],
+                 # Generate timestamp and value field (column) names, the
+                 # same way as when done serially.
+                 'timestamp_' + names[srcPos],
+                 names[srcPos] if names[srcPos].startswith('value')
+                 else 'value_' + names[srcPos])
+                for srcPos in groups[groupNum]]))
+
+        replies = self._exchange([('build', dataFile, groupWork, valueQuery,
+                                   startArg, endArg, sourceTimeFormat)
+                                  if groupWork else None for groupWork in work])
+        os.remove(dataFile)
+
+        # Collect the results, and print the messages in source order
+        summaries = {}
+        texts = {}
+        for reply in replies:
+            for groupNum, summary, groupTexts in (reply or []):
+                summaries[groupNum] = summary
+                texts.update(groupTexts)
+        seen = set()
+        for srcPos, instName in enumerate(names):
+            print('\nProcessing ' + instName)
+            groupNum = groupOf[instName]
+            if groupNum in seen:
+                print('Inst in list at index ' + str(groupNum) + '. Appending data.')
+            else:
+                print('Inst not yet seen. Appending new instrument to list of instruments.')
+                seen.add(groupNum)
+            if texts[srcPos]:
+                print(texts[srcPos], end='')
+
+        self._insts = [PooledInstrument(names[group[0]], summaries[groupNum])
+                       for groupNum, group in enumerate(groups)]
+        return list(self._insts)
+
+    def eventTimes(self, periodNanos):
+        """
+        Return the union of the sample times of all the instruments, floored to
+        the period (ns), as a sorted int64 ns array (see ftppGrid.py). Call
+        after build(), and before resample().
+        """
+        resultFiles = [os.path.join(self._dir, 'times' + str(workerNum) + '.bin')
+                       for workerNum in range(len(self._workers))]
+        replies = self._exchange([('times', resultFile, periodNanos) if groupNums else None
+                                  for resultFile, groupNums
+                                  in zip(resultFiles, self._assigned)])
+        timeArrays = []
+        for resultFile, reply in zip(resultFiles, replies):
+            if reply is None:
+                continue
+            buf = _mapFile(resultFile)
+            timeArrays.append(_unpackFrame(buf, reply).index.values.view(np.int64))
+            del buf
+            os.remove(resultFile)
+        return unionTimes(timeArrays)
+
+    def resample(self, resampleArg, stats, valueType=np.float64):
+        """
+        Resample all the instruments in the workers, and bring the resampled
+        data back to the PooledInstrument objects returned by build(), with
+        the float values as the valueType (see ftppPrecision.py).
+        """
+        resultFiles = [os.path.join(self._dir, 'result' + str(workerNum) + '.bin')
+                       for workerNum in range(len(self._workers))]
+        replies = self._exchange([('resample', resultFile, groupNums,
+                                   resampleArg, stats, valueType) if groupNums else None
+                                  for resultFile, groupNums
+                                  in zip(resultFiles, self._assigned)])
+        for resultFile, groupNums, reply in zip(resultFiles, self._assigned, replies):
+            if reply is None:
+                continue
+            layout, texts = reply
+            buf = _mapFile(resultFile)
+            for groupNum, entry, text in zip(groupNums, layout, texts):
+                if text:
+                    print(text, end='')
+                self._insts[groupNum]._setData(_unpackFrame(buf, entry),
+                                               resampleArg, stats)
+            del buf
+            os.remove(resultFile)
+        self._assigned = [[] for _ in self._workers]
+
+    def close(self):
+        """
+        Stop the workers, and remove the temporary files.
+        """
+        for proc, conn in self._workers:
+            try:
+                conn.send(('stop',))
+            except (OSError, ValueError):
+                pass
+            conn.close()
+        for proc, conn in self._workers:
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+        self._workers = []
+        shutil.rmtree(self._dir, ignore_errors=True)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppPrecision.py
+#
+# Value precision (-pr) for ftArchPostProc.
+#
+# The values are normally float64 from the parse through the resampling and
+# the alignment to the output. The source values come from 32-bit PLC tags,
+# so float32 holds them without losing anything, in half the memory. With the
+# float32 precision, the float value columns of the source tags are made
+# float32 once parsed, and the resampled data and the output data are kept
+# float32. Integer (and other non float) columns are left as they are.
+#
+# The mean (a/m) and standard deviation (s) stats add up many values, and a
+# float32 sum loses digits as it grows. So when they are calculated, the data
+# of the instrument is made float64 just before it is resampled (one
+# instrument at a time), and the stats are made float32 afterwards. The value,
+# min and max stats pick one of the values, so they are the same either way.
+#
+# The output values are written with the fewest digits which read back as the
+# same float32, so at most 9 significant digits (e.g. 1/3 is 0.33333334
+# rather than 0.3333333333333333). Source values with more than about 7
+# significant digits are rounded to the nearest float32 (e.g. 123456.789 is
+# written as 123456.79).
+
+# imports
+#
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# value precisions (-pr). The first is the default.
+PRECISIONS = ['float64', 'float32']
+# stats (-stats) which are sums of the values, calculated in float64
+ACCUMULATED_STATS = 'ams'
+
+
+def asPrecision(df, valueType):
+    """
+    Return the data frame with its float columns as the valueType (a numpy
+    float type). The data frame is returned as is if they already are, and
+    other columns are left as they are.
+    """
+    convert = {colName: valueType for colName, dtype in df.dtypes.items()
+               if pd.api.types.is_float_dtype(dtype) and dtype != valueType}
+    if not convert:
+        return df
+    return df.astype(convert, copy=False)
+
+
+def resampleAs(inst, resampleArg, stats, valueType):
+    """
+    Resample the instrument (a TsIdxData object), with the mean and standard
+    deviation stats calculated from float64 values. Return its resampled data,
+    with the float columns as the valueType.
+    """
+    if valueType != np.float64 and \
+            any(stat in ACCUMULATED_STATS for stat in str(stats).lower()):
+        inst.replaceData(asPrecision(inst.data, np.float64))
+    inst.resample(resampleArg, stats)
+    return asPrecision(inst.data, valueType)
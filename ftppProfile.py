@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppProfile.py
+#
+# Per stage profiling report for ftArchPostProc.
+#
+# The only timing a run prints is its total duration, which does not tell
+# whether a slow run was spent reading the source files, converting the
+# timestamps, making the instruments, resampling, aligning or writing. With the
+# --profile option, StageProfiler here times each stage of the run, and writes
+# a json report at the end of it with, for each stage:
+#
+#   - the wall clock and CPU time
+#   - the number of calls (stages like resampling are done one instrument at a
+#     time, in between the other stages, and their time is added up)
+#   - the rows going in and out, and the rows per second
+#   - the peak resident memory (RSS) of the process at the end of the stage,
+#     and the peak memory allocated by python (tracemalloc) during the stage
+#
+# plus the time spent on each instrument in each stage, and its row count.
+# Tracing memory allocations slows a run down, so the times are a little
+# longer than without --profile.
+#
+# With the --cprofile option, the whole run is also profiled with cProfile, and
+# the statistics saved to a file, which can be looked at with the pstats module
+# (python -m pstats FILE) or a viewer such as snakeviz.
+#
+# When neither option is used, the profiler does nothing.
+
+# imports
+#
+# system related
+import os
+import sys
+import json
+import time
+import tracemalloc
+import cProfile
+from contextlib import contextmanager
+
+try:
+    # not on all platforms (e.g. not on Windows)
+    import resource
+except ImportError:
+    resource = None
+
+# report layout version
+PROFILE_VERSION = 1
+
+
+def _peakRss():
+    """
+    Return the peak resident memory of the process in bytes, or None if this
+    is not available on the platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kB elsewhere
+    return int(peak) if sys.platform == 'darwin' else int(peak) * 1024
+
+
+class StageProfiler(object):
+    """
+    Times the stages of a run. reportFile is the json report file name, and
+    cprofileFile the cProfile statistics file name. Either can be None, and
+    the profiler does nothing if both are.
+
+    Mark a stage with start() and stop(), or with lap() or timed() for a
+    stage done a piece at a time, and call begin() at the start of the run,
+    and finish() at the end of it to write the files.
+    """
+    def __init__(self, reportFile=None, cprofileFile=None):
+        self._reportFile = reportFile
+        self._cprofileFile = cprofileFile
+        self.enabled = reportFile is not None or cprofileFile is not None
+        # stage name -> record, in the order the stages were first seen
+        self._stages = {}
+        # instrument name -> dictionary of timings and row count
+        self._instruments = {}
+        # stage name -> (wall, cpu) at start(), and the traced memory peak
+        # since, of the stages started and not stopped yet
+        self._open = {}
+        self._openPeak = {}
+        self._wallStart = None
+        self._cpuStart = None
+        self._cProfile = None
+
+    def begin(self):
+        """
+        Start profiling the run.
+        """
+        if not self.enabled:
+            return
+        self._wallStart = time.perf_counter()
+        self._cpuStart = time.process_time()
+        if self._reportFile is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self._cprofileFile is not None:
+            self._cProfile = cProfile.Profile()
+            self._cProfile.enable()
+
+    def _record(self, stage):
+        """
+        Return the record of the stage, making it if needed.
+        """
+        if stage not in self._stages:
+            self._stages[stage] = {'stage': stage, 'calls': 0, 'wallSeconds': 0.0,
+                                   'cpuSeconds': 0.0, 'rowsIn': None, 'rowsOut': None,
+                                   'rowsPerSec': None, 'peakRssBytes': None,
+                                   'tracedPeakBytes': None}
+        return self._stages[stage]
+
+    def _foldPeak(self):
+        """
+        Fold the traced memory peak since the last start or stop into the
+        peaks of the stages started, and start a new peak.
+        """
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for stage in self._open:
+            self._openPeak[stage] = max(self._openPeak.get(stage, 0), peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            # python 3.9 and later. Otherwise the peak is since the run started.
+            tracemalloc.reset_peak()
+
+    def start(self, stage):
+        """
+        Mark the start of the stage. Stages can be started inside each other
+        (e.g. the timestamps of a file converted while parsing it), and the
+        time and memory of the inner stage are then part of the outer one too.
+        """
+        if not self.enabled:
+            return
+        self._record(stage)
+        self._foldPeak()
+        self._open[stage] = (time.perf_counter(), time.process_time())
+        self._openPeak[stage] = 0
+
+    def stop(self, stage, rowsIn=None, rowsOut=None):
+        """
+        Mark the end of the stage, and add its time. rowsIn and rowsOut are
+        the rows going into and out of the stage, if known (see addRows()).
+        """
+        if not self.enabled or stage not in self._open:
+            return
+        self._foldPeak()
+        wallStart, cpuStart = self._open.pop(stage)
+        record = self._record(stage)
+        record['calls'] += 1
+        record['wallSeconds'] += time.perf_counter() - wallStart
+        record['cpuSeconds'] += time.process_time() - cpuStart
+        record['peakRssBytes'] = _peakRss()
+        traced = self._openPeak.pop(stage)
+        if tracemalloc.is_tracing():
+            record['tracedPeakBytes'] = max(record['tracedPeakBytes'] or 0, traced)
+        self.addRows(stage, rowsIn, rowsOut)
+
+    def addRows(self, stage, rowsIn=None, rowsOut=None):
+        """
+        Add to the rows going into and out of the stage. None is not known.
+        """
+        if not self.enabled:
+            return
+        record = self._record(stage)
+        for key, rows in (('rowsIn', rowsIn), ('rowsOut', rowsOut)):
+            if rows is not None:
+                record[key] = (record[key] or 0) + int(rows)
+
+    @contextmanager
+    def lap(self, stage, instName=None):
+        """
+        Context manager timing a piece of the stage, e.g. one instrument.
+        The time is added to the stage, and to the instrument if instName
+        is not None.
+        """
+        if not self.enabled:
+            yield
+            return
+        wallStart = time.perf_counter()
+        self.start(stage)
+        try:
+            yield
+        finally:
+            self.stop(stage)
+            if instName is not None:
+                timings = self._instruments.setdefault(instName, {'name': instName})
+                key = stage + 'Seconds'
+                timings[key] = timings.get(key, 0.0) + time.perf_counter() - wallStart
+
+    def timed(self, stage, func, rowsIn=None, rowsOut=None):
+        """
+        Return the function func wrapped so each call is timed as a lap of the
+        stage, or func itself if the profiler is not enabled. rowsIn, if not
+        None, is a function giving the rows in from the first argument of the
+        call, and rowsOut a function giving the rows out from its result.
+        """
+        if not self.enabled:
+            return func
+
+        def _timed(*args, **kwargs):
+            with self.lap(stage):
+                result = func(*args, **kwargs)
+            self.addRows(stage, rowsIn(args[0]) if rowsIn is not None and args else None,
+                         rowsOut(result) if rowsOut is not None else None)
+            return result
+        return _timed
+
+    def instrumentRows(self, instName, rows):
+        """
+        Set the row count of the instrument.
+        """
+        if self.enabled:
+            self._instruments.setdefault(instName, {'name': instName})['rows'] = int(rows)
+
+    def report(self):
+        """
+        Return the report as a json-able dictionary.
+        """
+        stages = []
+        for record in self._stages.values():
+            record = dict(record)
+            rows = record['rowsIn'] if record['rowsIn'] is not None else record['rowsOut']
+            if rows is not None and record['wallSeconds'] > 0:
+                record['rowsPerSec'] = rows / record['wallSeconds']
+            stages.append(record)
+        return {'version': PROFILE_VERSION,
+                'command': sys.argv,
+                'pid': os.getpid(),
+                'wallSeconds': time.perf_counter() - self._wallStart,
+                'cpuSeconds': time.process_time() - self._cpuStart,
+                'peakRssBytes': _peakRss(),
+                'tracedPeakBytes': tracemalloc.get_traced_memory()[1]
+                                   if tracemalloc.is_tracing() else None,
+                'stages': stages,
+                'instruments': list(self._instruments.values())}
+
+    def finish(self):
+        """
+        Stop profiling, and write the report and cProfile statistics files.
+        An OSError is raised if a file cannot be written.
+        """
+        if not self.enabled:
+            return
+        if self._cProfile is not None:
+            self._cProfile.disable()
+        report = self.report() if self._reportFile is not None else None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self._cProfile is not None:
+            self._cProfile.dump_stats(self._cprofileFile)
+        if report is not None:
+            with open(self._reportFile, 'w') as reportFile:
+                json.dump(report, reportFile, indent=2)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppRegistry.py
+#
+# Instrument registry and duplicate name detection for ftArchPostProc.
+#
+# InstrumentRegistry keeps the instruments in a list, in the order they are
+# added, with a dictionary from name to position, so finding the instrument
+# for a source tag takes the same time however many instruments there are.
+#
+# The duplicate column name checks of the input and merge files are also done
+# with sets here: duplicateNames() finds the names repeated in a header, and
+# commonNames() the names of a header which are already in another one (e.g.
+# the columns of the files before it). Both take time proportional to the
+# number of names. The names are returned in the order they are in the
+# header, so the warnings are printed the same way every time.
+
+
+class InstrumentRegistry(object):
+    """
+    The instruments (TsIdxData, or PooledInstrument, objects), by name.
+
+    insts -- Instruments to add, in order. They must have different names.
+
+    The instruments are kept in the order they are added, and the position of
+    an instrument does not change. len(), iteration, indexing by position and
+    "name in registry" work as for a list of the instruments.
+    """
+    def __init__(self, insts=()):
+        self._insts = []
+        self._posOf = {}
+        for inst in insts:
+            self.add(inst)
+
+    def __len__(self):
+        return len(self._insts)
+
+    def __iter__(self):
+        return iter(self._insts)
+
+    def __getitem__(self, pos):
+        return self._insts[pos]
+
+    def __contains__(self, name):
+        return name in self._posOf
+
+    def position(self, name):
+        """
+        Return the position of the instrument with the name, or None if there
+        is not one.
+        """
+        return self._posOf.get(name)
+
+    def get(self, name, default=None):
+        """
+        Return the instrument with the name, or the default if there is not
+        one.
+        """
+        pos = self._posOf.get(name)
+        return default if pos is None else self._insts[pos]
+
+    def add(self, inst):
+        """
+        Add the instrument after the others, and return its position. A
+        ValueError is raised if there already is one with the same name.
+        """
+        if inst.name in self._posOf:
+            raise ValueError('There already is an instrument named "' + str(inst.name) + '".')
+        self._posOf[inst.name] = len(self._insts)
+        self._insts.append(inst)
+        return self._posOf[inst.name]
+
+    def sortedList(self):
+        """
+        Return a list of the instruments sorted by name. The sort is case
+        insensitive, and instruments with names which only differ by case are
+        kept in the order they were added.
+        """
+        return sorted(self._insts, key=lambda inst: inst.name.lower())
+
+
+def duplicateNames(names):
+    """
+    Return a list of the names (an iterable, e.g. a header list, or a data
+    frame for its column names) which are in it more than once. Each is in the
+    list once, in the order its second appearance is in the names.
+    """
+    seen = set()
+    dups = []
+    dupSet = set()
+    for name in names:
+        if name in seen:
+            if name not in dupSet:
+                dupSet.add(name)
+                dups.append(name)
+        else:
+            seen.add(name)
+    return dups
+
+
+def commonNames(seenNames, names):
+    """
+    Return a list of the names (an iterable, e.g. a header list, or a data
+    frame for its column names) which are also in seenNames (a set, or any
+    iterable of names). Each is in the list once, in the order it first
+    appears in the names.
+    """
+    if not isinstance(seenNames, (set, frozenset, dict)):
+        seenNames = set(seenNames)
+    common = []
+    commonSet = set()
+    for name in names:
+        if name in seenNames and name not in commonSet:
+            commonSet.add(name)
+            common.append(name)
+    return common
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppSchema.py
+#
+# Typed (schema aware) reading of the ftArchPostProc input files.
+#
+# Reading a whole file with dtype=str makes a python string object for every
+# cell, which takes several times the memory of the typed data, and then the
+# strings are converted to numbers anyway. Here each input format (-t, -a, -n)
+# has a schema which gives the columns to read, and the type of each, so
+# read_csv() parses the numbers directly:
+#
+#   -a  TagId int32, TagName categorical (it repeats on every row), Timestamp
+#       string, Value float64. The DataSource and Quality columns are not read.
+#   -t  Timestamp columns string, value columns numbers.
+#   -n  Timestamp string, tag value columns numbers. The Bias column is not read.
+#
+# Timestamps are left as strings, and parsed by parseTimestamps() later.
+#
+# Number columns are int64 or float64, as read_csv() infers them. This is the
+# same type pd.to_numeric() gives for the strings (int64 when every value is an
+# integer), so the output is formatted the same as before. A number column
+# read_csv() does not infer as numbers (text, or True/False which it makes
+# booleans) is read again as strings, and converted later as it always was.
+#
+# The header row is read separately (as strings, with header=None) so
+# duplicate column names are preserved as is and can be detected, the same as
+# the previous read everything and rename workaround. If the typed read fails
+# (e.g. text in a value column), the data is read as strings instead, and
+# converted later the same way it always was. Floats are parsed with the
+# round_trip precision so the values are the same as converting the strings.
+#
+# With keepChunk (see ftppWindow.py), the data rows are read a chunk at a time,
+# and only the rows of each chunk it selects are kept. Reading stops early if
+# it says so. With blocks (see ftppIndex.py), only those blocks of the file are
+# read.
+#
+# Strain gauge files (-s) have a block of header rows above the data. The
+# anchor row (a cell which is exactly "ID") is found first, and the header
+# rows are read as strings, and the data rows as numbers.
+
+# imports
+#
+# system related
+import csv
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# custom libraries
+# archive helpers, for reading a header row
+from ftppArchive import readHeader, readBlocks, ARCH_ID_COL, ARCH_NAME_COL, ARCH_TS_COL, ARCH_VAL_COL
+# rows read at a time when filtering by time range
+from ftppWindow import WINDOW_CHUNK_ROWS
+
+# float parsing which gives the same value as converting the string
+FLOAT_PRECISION = 'round_trip'
+# value type for archive (-a) values, which have always been made floats
+VALUE_DTYPE = np.float64
+
+
+def archiveSchema(header):
+    """
+    Return the (usecols, dtypes) schema for archive data (-a) with the
+    header list given. A usecols of None reads all the columns, and columns
+    not in dtypes are number columns.
+    """
+    usecols = [ARCH_ID_COL, ARCH_NAME_COL, ARCH_TS_COL, ARCH_VAL_COL]
+    dtypes = {ARCH_ID_COL: np.int32, ARCH_NAME_COL: 'category',
+              ARCH_TS_COL: str, ARCH_VAL_COL: VALUE_DTYPE}
+    return usecols, dtypes
+
+
+def trendSchema(header):
+    """
+    Return the (usecols, dtypes) schema for historical trend data (-t) with the
+    header list given. Even columns are timestamps, odd columns are values.
+    """
+    dtypes = {colNum: str for colNum in range(0, len(header), 2)}
+    return None, dtypes
+
+
+def normalizedSchema(header):
+    """
+    Return the (usecols, dtypes) schema for time normalized data (-n) with the
+    header list given. The first column is the timestamp, the Bias column is
+    left out, and the others are values.
+    """
+    usecols = [colNum for colNum in range(len(header))
+               if colNum == 0 or header[colNum] != 'Bias']
+    dtypes = {0: str}
+    return usecols, dtypes
+
+
+def _readCsv(fileName, readArgs, keepChunk, chunkRows, blocks=None, **typeArgs):
+    """
+    Read the csv file, or just its blocks if blocks is not None, with the
+    read_csv() arguments. With keepChunk, read it chunkRows rows at a time,
+    and keep the rows of each chunk it selects, stopping when it says so.
+    """
+    if keepChunk is None and blocks is None:
+        return pd.read_csv(fileName, **typeArgs, **readArgs)
+    kept = []
+    stop = False
+    for source in readBlocks(fileName, blocks):
+        if keepChunk is None:
+            kept.append(pd.read_csv(source, **typeArgs, **readArgs))
+            continue
+        for df_chunk in pd.read_csv(source, chunksize=chunkRows, **typeArgs, **readArgs):
+            keep, stop = keepChunk(df_chunk)
+            kept.append(df_chunk if keep is None else df_chunk[keep])
+            if stop:
+                break
+        if stop:
+            break
+    if not kept:
+        raise pd.errors.EmptyDataError('No blocks to read.')
+    return pd.concat(kept, axis=0, ignore_index=True)
+
+
+def _readData(fileName, sep, encoding, numCols, usecols, dtypes, skiprows,
+              keepChunk=None, chunkRows=None, blocks=None):
+    """
+    Read the data rows of the file, typed per dtypes, with the other columns
+    read as numbers. If a value cannot be converted to its dtypes type, read
+    them all as strings instead. The columns are labeled with their position
+    in the file. With keepChunk, only the rows it selects are kept. With
+    blocks, only those blocks of data rows are read (skiprows is not used).
+    """
+    if blocks is not None:
+        skiprows = None
+    readArgs = dict(sep=sep, encoding=encoding, header=None, skipinitialspace=True,
+                    skiprows=skiprows, names=list(range(numCols)), usecols=usecols)
+    try:
+        df = _readCsv(fileName, readArgs, keepChunk, chunkRows, blocks, dtype=dtypes,
+                      float_precision=FLOAT_PRECISION)
+    except pd.errors.EmptyDataError:
+        # no data rows
+        return pd.DataFrame({colNum: pd.Series([], dtype=str)
+                             for colNum in (usecols or range(numCols))})
+    except (ValueError, OverflowError, TypeError):
+        # something is not of the schema type. Read it all as strings.
+        return _readCsv(fileName, readArgs, keepChunk, chunkRows, blocks, dtype=str)
+
+    # Number columns which did not come out as numbers are read again as strings.
+    # Read the same columns as before, so keepChunk selects the same rows.
+    strCols = [colNum for colNum in df.columns if colNum not in dtypes and
+               not (pd.api.types.is_integer_dtype(df[colNum]) or
+                    pd.api.types.is_float_dtype(df[colNum]))]
+    if strCols:
+        if keepChunk is None:
+            readArgs['usecols'] = strCols
+        df_str = _readCsv(fileName, readArgs, keepChunk, chunkRows, blocks, dtype=str)
+        for colNum in strCols:
+            df[colNum] = df_str[colNum]
+    return df
+
+
+def readTyped(fileName, sep, encoding, schema, keepChunk=None,
+              chunkRows=WINDOW_CHUNK_ROWS, blocks=None):
+    """
+    Read the csv file using the schema function (archiveSchema, trendSchema or
+    normalizedSchema). Return a tuple of the data frame and the list of all
+    the column names in the header row (including any columns not read).
+
+    With keepChunk (e.g. from TimeWindow.chunkFilter()), the file is read
+    chunkRows rows at a time, and only the rows it selects are kept. With
+    blocks (e.g. from BlockIndex.select()), only those blocks of the file are
+    read.
+
+    The data frame columns are named from the header row, and duplicate names
+    are preserved. A ValueError is raised if the file cannot be read.
+    """
+    header = readHeader(fileName, sep, encoding)
+    usecols, dtypes = schema(header)
+    df = _readData(fileName, sep, encoding, len(header), usecols, dtypes, skiprows=1,
+                   keepChunk=keepChunk, chunkRows=chunkRows, blocks=blocks)
+    # name the columns from the header row. Set the list rather than using
+    # rename() so duplicate names are kept.
+    df.columns = [header[colNum] for colNum in df.columns]
+    return df, header
+
+
+def readHeaderTyped(fileName, sep, encoding, schema):
+    """
+    The same as readTyped(), but only the header row is read. The data frame
+    has the columns readTyped() would give, with their types, and no rows.
+    Used for a file with no data of interest (e.g. outside the time range).
+    """
+    header = readHeader(fileName, sep, encoding)
+    usecols, dtypes = schema(header)
+    df = pd.DataFrame({colNum: pd.Series([], dtype=dtypes.get(colNum, np.float64))
+                       for colNum in (usecols or range(len(header)))})
+    df.columns = [header[colNum] for colNum in df.columns]
+    return df, header
+
+
+def readStrain(fileName, sep, encoding, anchorLabel='ID'):
+    """
+    Read a strain gauge data (-s) file. Return a tuple of two data frames: the
+    header rows, up to and including the first row with a cell matching the
+    anchor label exactly, read as strings, and the data rows after that, read
+    as numbers. Columns are labeled with their position in the file in both.
+
+    If the anchor label is not found, or the delimiter is a regular expression
+    so it cannot be looked for here, the whole file is returned as strings in
+    the first data frame, and None for the second. This is the same as it was
+    always read, and the header processing deals with it.
+
+    A ValueError is raised if the file cannot be read.
+    """
+    # Find the anchor row. Keep the number of rows read_csv() will see up to
+    # and including it (read_csv skips blank lines), and the number of lines in
+    # the file up to and including it (read_csv skiprows counts lines).
+    headRows = None
+    headLines = None
+    if len(sep) == 1:
+        try:
+            with open(fileName, 'r', encoding=encoding, newline='') as srcFile:
+                reader = csv.reader(srcFile, delimiter=sep, skipinitialspace=True)
+                rowCount = 0
+                for row in reader:
+                    if not row:
+                        continue
+                    rowCount += 1
+                    if anchorLabel in row:
+                        headRows = rowCount
+                        headLines = reader.line_num
+                        break
+        except (OSError, csv.Error) as ex:
+            raise ValueError(str(ex))
+
+    if headRows is None:
+        df_raw = pd.read_csv(fileName, sep=sep, encoding=encoding, header=None,
+                             dtype=str, skipinitialspace=True)
+        return df_raw, None
+
+    df_head = pd.read_csv(fileName, sep=sep, encoding=encoding, header=None,
+                          dtype=str, skipinitialspace=True, nrows=headRows)
+    # The first row sets the number of columns, the same as reading the whole file.
+    df_data = _readData(fileName, sep, encoding, df_head.shape[1], usecols=None,
+                        dtypes={}, skiprows=headLines)
+    return df_head, df_data
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppSynth.py
+#
+# Synthetic source file generators for ftArchPostProc, used by the benchmarks
+# (ftppBench.py).
+#
+# The sample files in this repository are a few dozen rows, which is too small
+# to measure the speed or memory use of a change. The generators here write
+# files of any size in each of the four source formats:
+#
+#   -t  historical trend: a Time and Value column pair for each tag. The tags
+#       have their own timestamps, and the columns are not all the same length.
+#   -a  archive: TagId, TagName, TimeStamp, DataSource, Value, Quality rows,
+#       grouped by tag.
+#   -n  time normalized: a Time_Stamp column, a Bias column, and a value column
+#       for each tag.
+#   -s  strain gauge: the header rows (Scan Session, Start Time, Assignment and
+#       Reduction Method), an ID row, and then ID, Seconds Elapsed and a value
+#       column for each tag.
+#
+# The size is given as the number of samples (one value of one tag), so the
+# files of each format hold the same data: rows samples, spread over tags tags.
+# A tag has a sample every rate seconds, with the time of each sample moved by
+# up to jitter sample periods (0 for evenly spaced samples). The files are the
+# same every time for the same arguments (and seed).
+#
+# The rows are made and written a block at a time, so files much larger than
+# memory can be made.
+
+# imports
+#
+# system related
+import io
+import os
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# custom libraries
+# fast timestamp formatting
+from ftppWriter import formatTimestamps
+
+# file types (ftArchPostProc options)
+SYNTH_TYPES = ['t', 'a', 'n', 's']
+# time of the first sample
+SYNTH_START = pd.Timestamp('2020-01-01 00:00:00')
+# samples made and written at a time
+SYNTH_BLOCK_ROWS = 200000
+# default source time format of each file type (the ftArchPostProc defaults)
+SYNTH_TIME_FORMATS = {'t': '%m/%d/%Y %H:%M:%S.%f',
+                      'a': '%Y-%m-%d %H:%M:%S.%f',
+                      'n': '%Y-%m-%d %H:%M:%S.%f',
+                      's': '%m/%d/%Y %I:%M:%S %p'}
+NS_PER_SEC = 10**9
+
+
+def _tagCounts(rows, tags):
+    """
+    Return an array of the number of samples of each tag: rows spread as
+    evenly as possible over tags tags, with at least one each.
+    """
+    counts = np.full(tags, rows // tags, dtype=np.int64)
+    counts[:rows % tags] += 1
+    return np.maximum(counts, 1)
+
+
+def _sampleTimes(randState, start, first, count, rate, jitter):
+    """
+    Return an int64 array of the times (ns) of samples first to first + count
+    of a tag, rate seconds apart starting at start, each moved by up to jitter
+    sample periods. The times are rounded to the ms, and stay in order when
+    jitter is less than 1.
+    """
+    offsets = (np.arange(first, first + count) +
+               jitter * randState.random_sample(count)) * rate
+    return pd.Timestamp(start).value + \
+        np.round(offsets * 1000).astype(np.int64) * (NS_PER_SEC // 1000)
+
+
+def _values(randState, tagNum, count):
+    """
+    Return a float array of count values of the tag: a sine wave of its own
+    period with noise, rounded to 3 decimal places.
+    """
+    phase = np.arange(count) * (2 * np.pi / (50 + tagNum % 97))
+    return np.round(100 * np.sin(phase) + tagNum + randState.standard_normal(count), 3)
+
+
+def _writeBlock(outFile, df_block):
+    """
+    Write the data frame of strings and numbers to the open file as csv rows,
+    without a header or index.
+    """
+    buffer = io.StringIO()
+    df_block.to_csv(buffer, header=False, index=False)
+    outFile.write(buffer.getvalue())
+
+
+def _tagNames(tags):
+    """
+    Return the list of tag names.
+    """
+    return ['SynTag' + str(tagNum).zfill(5) for tagNum in range(tags)]
+
+
+def _writeArchive(outFile, rows, tags, rate, jitter, randState, start, timeFormat):
+    """
+    Write an archive (-a) file: the rows of each tag, a tag at a time.
+    """
+    outFile.write('TagId,TagName,TimeStamp,DataSource,Value,Quality\n')
+    for tagNum, (tagName, count) in enumerate(zip(_tagNames(tags), _tagCounts(rows, tags))):
+        for first in range(0, count, SYNTH_BLOCK_ROWS):
+            blockRows = min(SYNTH_BLOCK_ROWS, count - first)
+            times = _sampleTimes(randState, start, first, blockRows, rate, jitter)
+            _writeBlock(outFile, pd.DataFrame({
+                'id': np.full(blockRows, 1000 + tagNum),
+                'name': tagName,
+                'ts': formatTimestamps(times.view('datetime64[ns]'), timeFormat),
+                'ds': 'DS1',
+                'val': _values(randState, tagNum, blockRows),
+                'qual': 192}))
+
+
+def _writeNormalized(outFile, rows, tags, rate, jitter, randState, start, timeFormat):
+    """
+    Write a time normalized (-n) file: a row of all the tag values at each time.
+    """
+    outFile.write(','.join(['Time_Stamp', 'Bias'] + _tagNames(tags)) + '\n')
+    lines = int(_tagCounts(rows, tags).max())
+    blockLines = max(1, SYNTH_BLOCK_ROWS // tags)
+    for first in range(0, lines, blockLines):
+        count = min(blockLines, lines - first)
+        times = _sampleTimes(randState, start, first, count, rate, jitter)
+        columns = {'ts': formatTimestamps(times.view('datetime64[ns]'), timeFormat),
+                   'bias': 420}
+        for tagNum in range(tags):
+            columns[tagNum] = _values(randState, tagNum, count)
+        _writeBlock(outFile, pd.DataFrame(columns))
+
+
+def _writeTrend(outFile, rows, tags, rate, jitter, randState, start, timeFormat):
+    """
+    Write a historical trend (-t) file: a time and value column pair for each
+    tag. Each tag has its own times, and the columns of the tags with fewer
+    samples are empty at the bottom.
+    """
+    names = _tagNames(tags)
+    outFile.write(','.join(name + suffix for name in names
+                           for suffix in (' Time', ' ValueY')) + '\n')
+    counts = _tagCounts(rows, tags)
+    lines = int(counts.max())
+    blockLines = max(1, SYNTH_BLOCK_ROWS // tags)
+    for first in range(0, lines, blockLines):
+        count = min(blockLines, lines - first)
+        columns = {}
+        for tagNum in range(tags):
+            present = int(np.clip(counts[tagNum] - first, 0, count))
+            times = _sampleTimes(randState, start, first, present, rate, jitter)
+            stamps = np.full(count, '', dtype=object)
+            stamps[:present] = formatTimestamps(times.view('datetime64[ns]'), timeFormat)
+            values = np.full(count, np.nan)
+            values[:present] = _values(randState, tagNum, present)
+            columns[2 * tagNum] = stamps
+            columns[2 * tagNum + 1] = values
+        _writeBlock(outFile, pd.DataFrame(columns))
+
+
+def _writeStrain(outFile, rows, tags, rate, jitter, randState, start, timeFormat):
+    """
+    Write a strain gauge (-s) file: the header rows, and then a row of all the
+    tag values at each time, as seconds elapsed from the start time.
+    """
+    names = _tagNames(tags)
+    width = tags + 2
+    pad = ',' * (width - 1)
+    outFile.write('Scan Session:  Synthetic' + pad + '\n')
+    outFile.write('Start Time:  ' + pd.Timestamp(start).strftime(timeFormat) + pad + '\n')
+    outFile.write(','.join(['Assignment:', ''] + names) + '\n')
+    outFile.write(','.join(['Reduction Method:', ''] +
+                           ['Strain' if tagNum % 2 else 'mm' for tagNum in range(tags)]) + '\n')
+    outFile.write(','.join(['ID', 'Seconds Elapsed'] +
+                           ['[' + str(tagNum + 1) + ']' for tagNum in range(tags)]) + '\n')
+    lines = int(_tagCounts(rows, tags).max())
+    blockLines = max(1, SYNTH_BLOCK_ROWS // tags)
+    startNs = pd.Timestamp(start).value
+    for first in range(0, lines, blockLines):
+        count = min(blockLines, lines - first)
+        times = _sampleTimes(randState, start, first, count, rate, jitter)
+        columns = {'id': np.arange(first + 1, first + count + 1),
+                   'elapsed': (times - startNs) / NS_PER_SEC}
+        for tagNum in range(tags):
+            columns[tagNum] = _values(randState, tagNum, count)
+        _writeBlock(outFile, pd.DataFrame(columns))
+
+
+def generateFile(fileType, fileName, rows, tags, rate=1.0, jitter=0.0, seed=0,
+                 start=SYNTH_START, encoding='utf_8'):
+    """
+    Write a synthetic source file of the file type ('t', 'a', 'n' or 's')
+    with rows samples spread over tags tags. Each tag has a sample every rate
+    seconds from the start time, each moved by up to jitter sample periods.
+    The file is the same for the same arguments. The timestamps are in the
+    default source time format of the file type.
+
+    A ValueError is raised for an unknown file type, or sizes less than 1.
+    """
+    writers = {'t': _writeTrend, 'a': _writeArchive, 'n': _writeNormalized,
+               's': _writeStrain}
+    if fileType not in writers:
+        raise ValueError('Unknown file type "' + str(fileType) + '".')
+    if rows < 1 or tags < 1 or rate <= 0:
+        raise ValueError('The rows, tags and rate must be more than 0.')
+    randState = np.random.RandomState(seed)
+    with open(fileName, 'w', encoding=encoding, newline='') as outFile:
+        writers[fileType](outFile, int(rows), int(tags), float(rate), float(jitter),
+                          randState, start, SYNTH_TIME_FORMATS[fileType])
+
+
+def generateSet(fileType, dirName, rows, tags, rate=1.0, jitter=0.0, merges=0,
+                seed=0, encoding='utf_8'):
+    """
+    Write an input file, and merges files to merge with it, to the directory,
+    and return a tuple of the input file name and the list of merge file
+    names. The samples are split evenly over the files, and each file follows
+    on in time from the one before. The file names are made from the
+    arguments, and files which already exist are not written again.
+    """
+    stem = fileType + '_r' + str(rows) + '_t' + str(tags) + '_sr' + str(rate) + \
+        '_j' + str(jitter) + '_s' + str(seed) + '_' + encoding
+    fileRows = max(1, rows // (merges + 1))
+    # time span of the samples of each file
+    span = pd.Timedelta(int(_tagCounts(fileRows, tags).max()) * rate, unit='s')
+    fileNames = []
+    for fileNum in range(merges + 1):
+        fileName = os.path.join(dirName, stem + '_f' + str(fileNum) + '_of' +
+                                str(merges + 1) + '.csv')
+        if not os.path.exists(fileName):
+            # write to a temporary file, and then move it into place, so a
+            # partly written file is never used
+            generateFile(fileType, fileName + '.tmp', fileRows, tags, rate, jitter,
+                         seed + fileNum, SYNTH_START + fileNum * span, encoding)
+            os.replace(fileName + '.tmp', fileName)
+        fileNames.append(fileName)
+    return fileNames[0], fileNames[1:]
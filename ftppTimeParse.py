@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppTimeParse.py
+#
+# Timestamp parsing for ftArchPostProc.
+#
+# Converting the source timestamp strings to datetimes is one of the biggest
+# costs of a run. parseTimestamps() here is used in place of pd.to_datetime()
+# for a column of timestamp strings, and gives the same result. It is faster in
+# two ways:
+#
+#   1) Each unique string is only parsed once, and the result is mapped back to
+#      every row using it. In archive exports the same timestamp is repeated
+#      for every tag, so most of the strings are repeats.
+#
+#   2) For the default source time formats ("%Y-%m-%d %H:%M:%S.%f" and
+#      "%m/%d/%Y %H:%M:%S.%f"), the strings are parsed as fixed width fields,
+#      straight from the string bytes into int64 ns values, using numpy array
+#      operations rather than a regular expression per string. Strings which
+#      do not fit the fixed width layout (e.g. a month without a leading zero),
+#      or which do not make a valid date and time, are handed to pd.to_datetime()
+#      so they are parsed (or rejected) exactly as before.
+#
+# Any other time format is parsed by pd.to_datetime(), one unique string at a
+# time.
+
+# imports
+#
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# Fixed width layouts of the time formats with a fast path. Each letter is a
+# digit of the field with the same letter in the format (Y year, m month,
+# d day, H hour, M minute, S second), and any other character must be present
+# as is. The layout is followed by 1 to 9 fractional second digits (%f).
+FAST_LAYOUTS = {
+    '%Y-%m-%d %H:%M:%S.%f': 'YYYY-mm-dd HH:MM:SS.',
+    '%m/%d/%Y %H:%M:%S.%f': 'mm/dd/YYYY HH:MM:SS.',
+}
+# most fractional second digits (ns resolution)
+MAX_FRAC_DIGITS = 9
+# years which fit in a datetime64[ns]. Others are left to pd.to_datetime().
+MIN_FAST_YEAR = 1678
+MAX_FAST_YEAR = 2261
+# days in each month of a non leap year
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+NS_PER_SEC = 10**9
+# int64 value used for NaT
+NAT_INT = np.iinfo(np.int64).min
+
+
+def _fieldValue(digits, positions):
+    """
+    Return the integer value of the decimal digits at the column positions of
+    the digit matrix (one row per string).
+    """
+    value = np.zeros(digits.shape[0], dtype=np.int64)
+    for pos in positions:
+        value *= 10
+        value += digits[:, pos]
+    return value
+
+
+def _parseFixedWidth(strings, layout):
+    """
+    Parse the array of strings using the fixed width layout. Return a tuple of
+    an int64 array of ns since the epoch, and a boolean array which is True
+    where the string fit the layout and made a valid date and time. The ns
+    values where the boolean is False are meaningless.
+    """
+    count = len(strings)
+    nsValues = np.zeros(count, dtype=np.int64)
+    parsed = np.zeros(count, dtype=bool)
+    try:
+        # non ascii strings cannot be fixed width timestamps. Leave them all.
+        byteStrings = np.array(strings, dtype=bytes)
+    except (UnicodeEncodeError, ValueError, TypeError):
+        return nsValues, parsed
+    if not count or not byteStrings.dtype.itemsize:
+        return nsValues, parsed
+    # One row of character codes per string, padded with zeros on the right.
+    charMatrix = byteStrings.view(np.uint8).reshape(count, byteStrings.dtype.itemsize)
+    del byteStrings
+    return _parseCharMatrix(charMatrix, layout)
+
+
+def parseTimeMatrix(charMatrix, timeFormat):
+    """
+    Parse timestamps given as a matrix of character codes (uint8, one row per
+    timestamp, padded with zeros on the right), for a time format with a fast
+    path. Return a tuple of an int64 array of ns since the epoch, and a
+    boolean array which is True where the timestamp fit the format and made a
+    valid date and time (the others are meaningless, and are left for
+    parseTimestamps()). Return None if the time format has no fast path.
+    """
+    layout = FAST_LAYOUTS.get(timeFormat)
+    if layout is None:
+        return None
+    if not charMatrix.shape[0] or not charMatrix.shape[1]:
+        return (np.zeros(charMatrix.shape[0], dtype=np.int64),
+                np.zeros(charMatrix.shape[0], dtype=bool))
+    return _parseCharMatrix(charMatrix, layout)
+
+
+def _parseCharMatrix(charMatrix, layout):
+    """
+    Parse the matrix of character codes (one row per string, padded with
+    zeros) using the fixed width layout. Return the same as _parseFixedWidth().
+    """
+    count = charMatrix.shape[0]
+    nsValues = np.zeros(count, dtype=np.int64)
+    parsed = np.zeros(count, dtype=bool)
+    lengths = np.count_nonzero(charMatrix, axis=1)
+    # Subtracting the code for '0' (with uint8 wrap around) makes every digit
+    # 0 to 9, and anything else bigger than 9.
+    digitMatrix = charMatrix - np.uint8(ord('0'))
+    del charMatrix
+
+    fieldPositions = {}
+    for pos, char in enumerate(layout):
+        if char.isalpha():
+            fieldPositions.setdefault(char, []).append(pos)
+    literalPositions = [(pos, np.uint8((ord(char) - ord('0')) % 256))
+                        for pos, char in enumerate(layout) if not char.isalpha()]
+
+    # Do the strings of each length together, since the number of fractional
+    # second digits depends on the length.
+    uniqueLengths = np.unique(lengths).tolist()
+    for length in uniqueLengths:
+        fracDigits = length - len(layout)
+        if fracDigits < 1 or fracDigits > MAX_FRAC_DIGITS:
+            continue
+        if len(uniqueLengths) == 1:
+            # all the same length (the usual case). No need to pick the rows.
+            rows = slice(None)
+            digits = digitMatrix[:, :length]
+        else:
+            rows = np.flatnonzero(lengths == length)
+            digits = digitMatrix[rows, :length]
+        good = np.ones(digits.shape[0], dtype=bool)
+        for pos, code in literalPositions:
+            good &= digits[:, pos] == code
+        for positions in list(fieldPositions.values()) + [range(len(layout), length)]:
+            for pos in positions:
+                good &= digits[:, pos] <= 9
+
+        year = _fieldValue(digits, fieldPositions['Y'])
+        month = _fieldValue(digits, fieldPositions['m'])
+        day = _fieldValue(digits, fieldPositions['d'])
+        hour = _fieldValue(digits, fieldPositions['H'])
+        minute = _fieldValue(digits, fieldPositions['M'])
+        second = _fieldValue(digits, fieldPositions['S'])
+        # fractional seconds, right padded to ns
+        frac = _fieldValue(digits, range(len(layout), length)) * \
+            10**(MAX_FRAC_DIGITS - fracDigits)
+
+        # check the field ranges, including the days in the month
+        good &= (year >= MIN_FAST_YEAR) & (year <= MAX_FAST_YEAR)
+        good &= (month >= 1) & (month <= 12)
+        leapYear = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        monthDays = DAYS_IN_MONTH[np.clip(month, 1, 12) - 1] + \
+            (leapYear & (month == 2))
+        good &= (day >= 1) & (day <= monthDays)
+        good &= (hour <= 23) & (minute <= 59) & (second <= 59)
+        if not good.any():
+            continue
+
+        # days since the epoch, from the month since the epoch and the day
+        months = (year - 1970) * 12 + month - 1
+        months[~good] = 0
+        epochDays = months.astype('datetime64[M]').astype('datetime64[D]') \
+                          .view(np.int64) + day - 1
+        nsValues[rows] = ((epochDays * 24 + hour) * 60 + minute) * 60 * NS_PER_SEC + \
+            second * NS_PER_SEC + frac
+        parsed[rows] = good
+    return nsValues, parsed
+
+
+def parseTimestamps(values, timeFormat=None, errors='raise', **kwargs):
+    """
+    Convert the timestamp strings in values (a series or array) to datetimes.
+    This gives the same result as
+        pd.to_datetime(values, errors=errors, format=timeFormat, **kwargs)
+    but each unique string is only parsed once, and the default source time
+    formats are parsed without regular expressions.
+
+    A series is returned for a series, with the same index and name, and a
+    DatetimeIndex otherwise. Errors are raised (or coerced) by pd.to_datetime(),
+    the same as if it were used directly.
+    """
+    isSeries = isinstance(values, pd.Series)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        # nothing to parse
+        return pd.to_datetime(values, errors=errors, format=timeFormat, **kwargs)
+
+    # codes[i] is the position of values[i] in uniques, or -1 for a missing value
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    uniques = np.asarray(uniques, dtype=object)
+    nsValues = np.full(len(uniques), NAT_INT, dtype=np.int64)
+    toParse = np.ones(len(uniques), dtype=bool)
+
+    layout = FAST_LAYOUTS.get(timeFormat)
+    if layout is not None and len(uniques) and \
+            pd.api.types.infer_dtype(uniques, skipna=False) == 'string':
+        fastNs, parsed = _parseFixedWidth(uniques, layout)
+        nsValues[parsed] = fastNs[parsed]
+        toParse = ~parsed
+
+    if toParse.any():
+        generic = pd.to_datetime(uniques[toParse], errors=errors,
+                                 format=timeFormat, **kwargs)
+        if getattr(generic, 'tz', None) is not None:
+            # time zone aware results cannot be put in the ns array. Let
+            # pd.to_datetime() do it all.
+            return pd.to_datetime(values, errors=errors, format=timeFormat, **kwargs)
+        nsValues[toParse] = np.asarray(generic, dtype='datetime64[ns]').view(np.int64)
+
+    # map the parsed unique values back to each row. Missing values are NaT.
+    # (Index with just the present codes, as there may be no uniques at all.)
+    present = codes >= 0
+    result = np.full(len(codes), NAT_INT, dtype=np.int64)
+    result[present] = nsValues[codes[present]]
+    result = result.view('datetime64[ns]')
+    if isSeries:
+        return pd.Series(result, index=values.index, name=values.name)
+    return pd.DatetimeIndex(result)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppWindow.py
+#
+# Start/end time (-st/-et) filtering at read time, for ftArchPostProc.
+#
+# TimeWindow applies the start and end times while the files are read, so
+# rows outside the time range are dropped before they are typed and split up:
+#
+#   - The -n and -t files are read in chunks, and rows outside the time range
+#     are dropped as each chunk is read (see readTyped() in ftppSchema.py).
+#   - Archive (-a) and strain gauge (-s) rows outside the time range are
+#     dropped as soon as their timestamps are converted.
+#   - With -si (the files are in time order, ascending or descending), a chunk
+#     is checked using just its first and last timestamps, so a chunk outside
+#     the time range is skipped without converting its timestamps, and reading
+#     stops at the first chunk past the time range. A -n or -t merge file is
+#     checked the same way using its first and last rows, and is not read at
+#     all if it is outside the time range. Only its header is read, so its tags
+#     are still in the output. Archive files are grouped by tag rather than
+#     time, so this does not apply to them.
+#
+# The rows kept always include all the rows in the time range, and the
+# instruments still apply the start and end times exactly. The time range is
+# widened by a ms at each end, since the timestamps are rounded to the nearest
+# ms after the rows are filtered.
+
+# imports
+#
+# system related
+import io
+import os
+import csv
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# rows read at a time when filtering -n and -t files
+WINDOW_CHUNK_ROWS = 100000
+# added to each end of the time range, to allow for rounding to the ms
+WINDOW_MARGIN = pd.Timedelta(1, unit='ms')
+# bytes read from the end of a file to find its last row
+TAIL_BYTES = 1 << 16
+
+
+class TimeWindow(object):
+    """
+    The start and end time (-st/-et) range used to filter rows as they are
+    read. start and end are timestamps, or None for no limit. sortedInput is
+    True if the files are in time order (ascending or descending).
+
+    A window without a start or end (not active) keeps everything.
+    """
+    def __init__(self, start=None, end=None, sortedInput=False):
+        self.start = start
+        self.end = end
+        self.sortedInput = sortedInput
+        # the range widened by the margin
+        self._low = None if start is None else pd.Timestamp(start) - WINDOW_MARGIN
+        self._high = None if end is None else pd.Timestamp(end) + WINDOW_MARGIN
+
+    @property
+    def active(self):
+        """
+        True if there is a start or end time to filter with.
+        """
+        return self.start is not None or self.end is not None
+
+    def contains(self, ts):
+        """
+        Return a boolean numpy array which is True for the times (a series,
+        index or array of datetimes) in the time range. NaT is False.
+        """
+        values = np.asarray(ts, dtype='datetime64[ns]')
+        keep = ~np.isnat(values)
+        if self._low is not None:
+            keep &= values >= np.datetime64(self._low.value, 'ns')
+        if self._high is not None:
+            keep &= values <= np.datetime64(self._high.value, 'ns')
+        return keep
+
+    def overlaps(self, first, last):
+        """
+        Return True if any of the times from first to last (in either order)
+        could be in the time range.
+        """
+        low, high = min(first, last), max(first, last)
+        return not ((self._high is not None and low > self._high) or
+                    (self._low is not None and high < self._low))
+
+    def filterIndex(self, df_data):
+        """
+        Return the rows of the timestamp indexed data frame in the time range.
+        """
+        if not self.active:
+            return df_data
+        return df_data[self.contains(df_data.index)]
+
+    def chunkFilter(self, toDatetime, pairs=False):
+        """
+        Return a function for readTyped(keepChunk=...). The function is given
+        each chunk read (columns labeled by their position in the file), and
+        returns a tuple of a boolean array of the rows to keep (None for all),
+        and True if reading can stop after the chunk.
+
+        The timestamps are in the first column, or in every other column
+        (0, 2, 4, ...) if pairs is True. A row is kept if any of its
+        timestamps are in the time range. toDatetime converts a series of
+        timestamp strings to datetimes, with NaT for those it cannot convert.
+        """
+        def _keepChunk(df_chunk):
+            if pairs:
+                tsCols = [col for col in df_chunk.columns if col % 2 == 0]
+            else:
+                tsCols = [df_chunk.columns[0]]
+            if self.sortedInput:
+                return self._sortedChunk(df_chunk, tsCols, toDatetime)
+            keep = np.zeros(len(df_chunk.index), dtype=bool)
+            for col in tsCols:
+                keep |= self.contains(toDatetime(df_chunk[col]))
+            return keep, False
+        return _keepChunk
+
+    def _sortedChunk(self, df_chunk, tsCols, toDatetime):
+        """
+        Decide on a chunk of a time ordered file using just the first and last
+        timestamps of each timestamp column. Return the same as the function
+        from chunkFilter().
+        """
+        overlaps = False
+        past = True
+        seen = False
+        for col in tsCols:
+            ts = df_chunk[col].dropna()
+            if ts.empty:
+                continue
+            seen = True
+            first, last = toDatetime(ts.iloc[[0, -1]]).tolist()
+            if pd.isna(first) or pd.isna(last):
+                # can't tell. Keep the chunk, and keep reading.
+                return None, False
+            if self.overlaps(first, last):
+                overlaps = True
+            # past the range: ascending and after the end, or descending and
+            # before the start
+            if not ((last >= first and self._high is not None and first > self._high) or
+                    (last < first and self._low is not None and first < self._low)):
+                past = False
+        if overlaps or not seen:
+            return None, False
+        return np.zeros(len(df_chunk.index), dtype=bool), past
+
+    def fileOutside(self, fileName, sep, encoding, toDatetime, pairs=False):
+        """
+        Return True if the file (with a header row) is in time order and
+        entirely outside the time range, judging by its first and last rows.
+        Return False if it is not, or if this cannot be told (not sortedInput,
+        a delimiter which is not a single character, an encoding which cannot
+        be read from the middle of the file, or missing timestamps).
+        """
+        if not (self.active and self.sortedInput) or len(sep) != 1:
+            return False
+        try:
+            firstRow = pd.read_csv(fileName, sep=sep, encoding=encoding, header=None,
+                                   dtype=str, skipinitialspace=True, skiprows=1,
+                                   nrows=1).iloc[0].tolist()
+            tailRows = _tailRows(fileName, sep, encoding)
+        except (ValueError, OSError, IndexError, csv.Error):
+            return False
+        if pairs:
+            tsCols = range(0, len(firstRow), 2)
+        else:
+            tsCols = [0]
+        for col in tsCols:
+            # The last timestamp of the column. The columns of time/value pairs
+            # can be different lengths, so look back for the last one present.
+            last = next((row[col] for row in reversed(tailRows)
+                         if col < len(row) and row[col].strip()), None)
+            if last is None:
+                return False
+            first, last = toDatetime(pd.Series([firstRow[col], last],
+                                               dtype=object)).tolist()
+            if pd.isna(first) or pd.isna(last) or self.overlaps(first, last):
+                return False
+        return True
+
+
+def _tailRows(fileName, sep, encoding):
+    """
+    Return the (non blank) rows in the last TAIL_BYTES of the csv file, as
+    lists of strings. The list is empty if the encoding cannot be decoded from
+    the middle of the file.
+    """
+    codec = encoding.lower().replace('-', '_')
+    if codec.startswith('utf_16') or codec.startswith('utf_32'):
+        return []
+    with open(fileName, 'rb') as srcFile:
+        srcFile.seek(0, os.SEEK_END)
+        size = srcFile.tell()
+        srcFile.seek(max(0, size - TAIL_BYTES))
+        tail = srcFile.read()
+    lines = tail.decode(encoding, errors='ignore').splitlines()
+    if size > TAIL_BYTES:
+        # the first line is probably partial
+        lines = lines[1:]
+    lines = [line for line in lines if line.strip()]
+    return list(csv.reader(io.StringIO('\n'.join(lines)), delimiter=sep,
+                           skipinitialspace=True))
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ftppWriter.py
+#
+# Output (destination) file writer for ftArchPostProc.
+#
+# Writing the aligned destination data frame with
+#   df_dest.to_csv(outFile, sep=..., date_format=destTimeFormat)
+# runs strftime() on every row, one timestamp object at a time. With millions of
+# rows this takes longer than all the processing before it. writeFrame() here
+# writes the same text, faster:
+#
+#   1) The timestamps are formatted once, before writing. For formats made
+#      only of fixed width fields (%Y %m %d %H %I %M %S %f %y %p and literal
+#      characters), the text is built with int64 arithmetic on all the
+#      timestamps at once. Any other format is done with one strftime() per
+#      unique timestamp.
+#
+#   2) The rows are formatted a chunk at a time (to_csv into a string, so the
+#      values are formatted exactly as before), and each chunk is written to the
+#      file in one large write. The chunks can optionally be formatted by a
+#      number of worker threads.
+#
+#   3) Optionally, float values are rounded to a number of decimal places
+#      before formatting, which makes the file smaller.
+#
+# The export control message is written by the caller before writeFrame(), the
+# same as before.
+#
+# writeColumnar() writes the data frame in a binary, columnar format (Parquet,
+# Feather/Arrow IPC or HDF5) instead, so it can be read without parsing text.
+# The timestamp index is stored as datetime64, and the values keep their
+# types. Compression is optional. There is no text header, so the export
+# control message is kept as file level metadata (key "export_control").
+# Parquet and Feather need the pyarrow package, and HDF5 needs the tables
+# (PyTables) package. They are only imported when used, and an ImportError is
+# raised if they are not installed.
+#
+# WindowWriter writes the output a time window at a time (-ow): each window's
+# data frame is written with writeFrame() by a background thread, while the
+# next window is aligned. Only a few windows wait to be written at a time, so
+# the memory used does not grow with the output time span.
+
+# imports
+#
+# system related
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# date and time stuff
+from datetime import time
+
+# numerical manipulation libraries
+import numpy as np
+import pandas as pd
+
+# rows formatted and written at a time
+WRITE_CHUNK_ROWS = 100000
+# data frames waiting to be written by a WindowWriter before write() waits
+WINDOW_PENDING = 2
+# output file formats. csv is written by writeFrame(), the others by writeColumnar()
+OUTPUT_FORMATS = ['csv', 'parquet', 'feather', 'hdf5']
+# metadata key for the export control message in the columnar formats
+EXPORT_MSG_KEY = 'export_control'
+# HDF5 data set name (key), and compression level used when compressing
+HDF5_KEY = 'data'
+HDF5_COMPLEVEL = 5
+NS_PER_DAY = 24 * 60 * 60 * 10**9
+NS_PER_HOUR = 60 * 60 * 10**9
+NS_PER_MIN = 60 * 10**9
+NS_PER_SEC = 10**9
+NS_PER_US = 1000
+# width of each fixed width directive
+FIXED_WIDTHS = {'Y': 4, 'm': 2, 'd': 2, 'H': 2, 'I': 2, 'M': 2, 'S': 2,
+                'f': 6, 'y': 2, 'p': 2}
+
+
+def _tokenize(dateFormat):
+    """
+    Split the strftime format into a list of tokens: ('%', directive letter)
+    for each directive, and ('', text) for literal text. Return None if the
+    format has a directive which is not fixed width, or literal text which is
+    not ascii.
+    """
+    tokens = []
+    pos = 0
+    while pos < len(dateFormat):
+        char = dateFormat[pos]
+        if char == '%':
+            if pos + 1 >= len(dateFormat):
+                return None
+            directive = dateFormat[pos + 1]
+            if directive == '%':
+                tokens.append(('', '%'))
+            elif directive in FIXED_WIDTHS:
+                tokens.append(('%', directive))
+            else:
+                return None
+            pos += 2
+        else:
+            if ord(char) > 127:
+                return None
+            tokens.append(('', char))
+            pos += 1
+    return tokens
+
+
+def _amPm():
+    """
+    Return the (AM, PM) strings strftime() uses for %p, or None if they cannot
+    be used in a fixed width (e.g. they depend on the locale).
+    """
+    am = time(0).strftime('%p')
+    pm = time(12).strftime('%p')
+    if len(am) != FIXED_WIDTHS['p'] or len(pm) != FIXED_WIDTHS['p'] or \
+            max(ord(char) for char in am + pm) > 127:
+        return None
+    return am, pm
+
+
+def _formatFixedWidth(nsValues, tokens):
+    """
+    Format the int64 ns since the epoch values using the fixed width tokens.
+    Return a numpy array of strings, or None if the format cannot be done
+    this way.
+    """
+    amPm = None
+    if ('%', 'p') in tokens:
+        amPm = _amPm()
+        if amPm is None:
+            return None
+
+    # break the values into fields
+    days = nsValues // NS_PER_DAY
+    timeOfDay = nsValues - days * NS_PER_DAY
+    dates = days.astype('datetime64[D]')
+    years = dates.astype('datetime64[Y]')
+    months = dates.astype('datetime64[M]')
+    hours = timeOfDay // NS_PER_HOUR
+    fields = {
+        'Y': years.astype(np.int64) + 1970,
+        'm': (months - years).astype(np.int64) + 1,
+        'd': (dates - months).astype(np.int64) + 1,
+        'H': hours,
+        'I': (hours + 11) % 12 + 1,
+        'M': timeOfDay // NS_PER_MIN % 60,
+        'S': timeOfDay // NS_PER_SEC % 60,
+        'f': timeOfDay % NS_PER_SEC // NS_PER_US,
+    }
+    fields['y'] = fields['Y'] % 100
+
+    # One row of character codes per timestamp. Fill it a token at a time.
+    width = sum(FIXED_WIDTHS[text] if kind == '%' else 1 for kind, text in tokens)
+    if not width:
+        return np.full(len(nsValues), '', dtype=object)
+    chars = np.empty((len(nsValues), width), dtype=np.uint8)
+    pos = 0
+    for kind, text in tokens:
+        if kind == '':
+            chars[:, pos] = ord(text)
+            pos += 1
+        elif text == 'p':
+            isPm = hours >= 12
+            for charNum in range(FIXED_WIDTHS['p']):
+                chars[:, pos + charNum] = np.where(isPm, ord(amPm[1][charNum]),
+                                                   ord(amPm[0][charNum]))
+            pos += FIXED_WIDTHS['p']
+        else:
+            value = fields[text]
+            fieldWidth = FIXED_WIDTHS[text]
+            for charNum in range(fieldWidth):
+                chars[:, pos + charNum] = value // 10**(fieldWidth - 1 - charNum) % 10 + ord('0')
+            pos += fieldWidth
+    return chars.view('S' + str(width)).ravel().astype(str)
+
+
+def formatTimestamps(index, dateFormat):
+    """
+    Return a numpy array of the datetimes in the index (or series) formatted
+    using the strftime format. The strings are the same as to_csv() writes
+    with date_format=dateFormat. Missing times (NaT) are empty strings.
+    """
+    stamps = pd.DatetimeIndex(index)
+    if stamps.tz is not None:
+        # time zone aware. Leave it to strftime().
+        return np.array(stamps.strftime(dateFormat), dtype=object)
+    nsValues = stamps.asi8
+    missing = stamps.isna()
+
+    formatted = None
+    tokens = _tokenize(dateFormat)
+    if tokens is not None:
+        formatted = _formatFixedWidth(np.where(missing, 0, nsValues), tokens)
+    if formatted is None:
+        # one strftime() for each unique timestamp
+        uniques, inverse = np.unique(nsValues, return_inverse=True)
+        formatted = np.array([pd.Timestamp(value).strftime(dateFormat)
+                              for value in uniques.tolist()], dtype=object)[inverse]
+    formatted = formatted.astype(object)
+    formatted[missing] = ''
+    return formatted
+
+
+def _roundFloats(df, floatDecimals):
+    """
+    Round the float columns of the data frame to floatDecimals decimal places,
+    in place, and return it. Nothing is done if floatDecimals is None.
+    """
+    if floatDecimals is not None:
+        for colNum in range(df.shape[1]):
+            if pd.api.types.is_float_dtype(df.iloc[:, colNum]):
+                df.iloc[:, colNum] = np.round(df.iloc[:, colNum].values, floatDecimals)
+    return df
+
+
+def writeFrame(df, outFile, sep, dateFormat, floatDecimals=None,
+               chunkRows=WRITE_CHUNK_ROWS, threads=1, header=True):
+    """
+    Write the timestamp indexed data frame to the open output file, the same
+    as df.to_csv(outFile, sep=sep, date_format=dateFormat) does: a header row
+    with the index name and column names (unless header is False), then one
+    row per timestamp.
+
+    If floatDecimals is not None, float values are rounded to that many
+    decimal places. The rows are formatted chunkRows at a time, using the
+    number of worker threads specified.
+    """
+    stamps = formatTimestamps(df.index, dateFormat)
+
+    def _formatChunk(start):
+        """
+        Return the csv text for the rows starting at start.
+        """
+        chunk = _roundFloats(df.iloc[start:start + chunkRows].copy(), floatDecimals)
+        chunk.index = pd.Index(stamps[start:start + chunkRows], name=df.index.name)
+        buffer = io.StringIO()
+        chunk.to_csv(buffer, sep=sep, header=(header and start == 0))
+        return buffer.getvalue()
+
+    # always format the first chunk, so the header row is written for an empty frame
+    starts = list(range(0, max(len(df), 1), chunkRows))
+    if threads > 1 and len(starts) > 1:
+        # Format up to one chunk per thread at a time, and write them in order.
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for batchStart in range(0, len(starts), threads):
+                for text in executor.map(_formatChunk, starts[batchStart:batchStart + threads]):
+                    outFile.write(text)
+    else:
+        for start in starts:
+            outFile.write(_formatChunk(start))
+
+
+class WindowWriter(object):
+    """
+    Writes data frames to the open output file one after another, with
+    writeFrame() in a background thread, so the caller can make the next one
+    while one is written. The header row is written before the first data
+    frame only (unless header is False). The other arguments are passed on to
+    writeFrame().
+
+    At most pending data frames wait to be written. write() waits for the
+    oldest one to be written when there are more. Call close() to wait for
+    all of them. An error while writing is raised by the next write() or
+    close() call.
+    """
+    def __init__(self, outFile, sep, dateFormat, floatDecimals=None, threads=1,
+                 header=True, pending=WINDOW_PENDING):
+        self._outFile = outFile
+        self._sep = sep
+        self._dateFormat = dateFormat
+        self._floatDecimals = floatDecimals
+        self._threads = threads
+        self._header = header
+        self._pending = max(1, pending)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = deque()
+
+    def write(self, df):
+        """
+        Queue the data frame to be written, after the ones before it.
+        """
+        while len(self._futures) >= self._pending:
+            self._futures.popleft().result()
+        self._futures.append(self._executor.submit(
+            writeFrame, df, self._outFile, self._sep, self._dateFormat,
+            floatDecimals=self._floatDecimals, threads=self._threads,
+            header=self._header))
+        self._header = False
+
+    def close(self):
+        """
+        Wait for the queued data frames to be written, and stop the thread.
+        """
+        try:
+            while self._futures:
+                self._futures.popleft().result()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+def writeColumnar(df, fileName, fileFormat, compression=None, exportMsg=None,
+                  floatDecimals=None):
+    """
+    Write the timestamp indexed data frame to the file in a columnar format:
+    'parquet', 'feather' or 'hdf5'. The timestamp is stored as datetime64 (for
+    feather, which has no index, as the first column), and the values keep
+    their types.
+
+    compression is the codec (e.g. snappy, gzip, zstd for parquet, lz4 or zstd
+    for feather, and zlib, blosc, bzip2 for hdf5), or None for no compression.
+    The export control message, if not None, is kept as file level metadata.
+    If floatDecimals is not None, float values are rounded to that many
+    decimal places.
+
+    Raises ImportError if the package needed for the format is not installed,
+    and ValueError for an unknown format or compression.
+    """
+    df = _roundFloats(df.copy() if floatDecimals is not None else df, floatDecimals)
+
+    if fileFormat in ('parquet', 'feather'):
+        import pyarrow as pa
+        if fileFormat == 'parquet':
+            table = pa.Table.from_pandas(df, preserve_index=True)
+        else:
+            # feather has no index. Store the timestamp as the first column.
+            table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+        if exportMsg is not None:
+            metadata = dict(table.schema.metadata or {})
+            metadata[EXPORT_MSG_KEY.encode()] = exportMsg.encode('utf-8')
+            table = table.replace_schema_metadata(metadata)
+        try:
+            if fileFormat == 'parquet':
+                import pyarrow.parquet as pq
+                pq.write_table(table, fileName, compression=compression or 'none')
+            else:
+                import pyarrow.feather as feather
+                feather.write_feather(table, fileName,
+                                      compression=compression or 'uncompressed')
+        except pa.ArrowException as ae:
+            raise ValueError(str(ae))
+
+    elif fileFormat == 'hdf5':
+        import tables
+        # check for the package now, rather than get a less clear error from pandas
+        del tables
+        with pd.HDFStore(fileName, mode='w', complib=compression,
+                         complevel=HDF5_COMPLEVEL if compression else 0) as store:
+            store.put(HDF5_KEY, df, format='fixed')
+            if exportMsg is not None:
+                setattr(store.get_storer(HDF5_KEY).attrs, EXPORT_MSG_KEY, exportMsg)
+
+    else:
+        raise ValueError('Unknown output format "' + str(fileFormat) + '".')